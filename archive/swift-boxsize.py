@@ -57,7 +57,7 @@ def read_file(srcfile):
 
     import h5py
 
-    f = h5py.File(srcfile)
+    f = h5py.File(srcfile, "r")
 
     h = f["Header"]
 
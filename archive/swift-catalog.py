@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+
+# ============================================
+# Print a table of header data (box size,
+# time, redshift, particle counts, units,
+# code version) of all swift hdf5 files in a
+# directory tree. Only hdf5 attributes are
+# read, and results are cached in an index
+# file so repeated calls are fast.
+# usage:
+#   swift-catalog.py [dir] [--where "z<1" --where "n_gas>1e8"]
+# ============================================
+
+
+import argparse
+import fnmatch
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+
+
+index_default = ".swift-catalog.json"
+index_version = 1
+
+# Header/NumPart_Total index -> column name
+ptype_names = ["gas", "dm", "dm_bg", "sinks", "stars", "bh", "nu"]
+
+# Units group attribute -> column name
+unit_attrs = {
+    "Unit mass in cgs (U_M)": "unit_mass",
+    "Unit length in cgs (U_L)": "unit_length",
+    "Unit time in cgs (U_t)": "unit_time",
+    "Unit temperature in cgs (U_T)": "unit_temperature",
+}
+
+columns_default = [
+    "path",
+    "time",
+    "redshift",
+    "boxsize",
+    "n_gas",
+    "n_dm",
+    "n_stars",
+    "n_bh",
+    "code_version",
+]
+
+# short forms accepted in --where and --columns
+column_aliases = {"z": "redshift", "t": "time", "a": "scale_factor"}
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to print header data of all swift outputs in a
+        directory tree. Only hdf5 attributes are read; results are
+        cached in an index file keyed by path and modification time.
+            """
+    )
+
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        default=".",
+        help="Directory to scan recursively. Default=.",
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        dest="patterns",
+        action="append",
+        default=None,
+        help="Glob pattern for file names to include. Can be repeated. "
+        "Default: *.hdf5 and *.h5",
+    )
+    parser.add_argument(
+        "-w",
+        "--where",
+        dest="where",
+        action="append",
+        default=[],
+        help='Filter condition like "z<1" or "n_gas>=1e8". Can be repeated; '
+        "all conditions must hold.",
+    )
+    parser.add_argument(
+        "-c",
+        "--columns",
+        dest="columns",
+        action="store",
+        default=",".join(columns_default),
+        help="Comma separated columns to print, or 'all'. Default="
+        + ",".join(columns_default),
+    )
+    parser.add_argument(
+        "--sort",
+        dest="sort",
+        action="store",
+        default="path",
+        help="Column to sort by. Default=path",
+    )
+    parser.add_argument(
+        "-j",
+        "--threads",
+        dest="threads",
+        type=int,
+        action="store",
+        default=16,
+        help="Number of threads to read headers with. Default=16",
+    )
+    parser.add_argument(
+        "--index",
+        dest="index",
+        action="store",
+        default=None,
+        help="Index file to cache results in. Default=<directory>/" + index_default,
+    )
+    parser.add_argument(
+        "--rebuild",
+        dest="rebuild",
+        action="store_true",
+        help="Ignore the existing index and re-read all headers",
+    )
+    parser.add_argument(
+        "--csv",
+        dest="csv",
+        action="store_true",
+        help="Print comma separated values instead of a table",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print("Given directory, '", args.directory, "' is not a directory.")
+        quit(2)
+
+    if args.patterns is None:
+        args.patterns = ["*.hdf5", "*.h5"]
+
+    if args.index is None:
+        args.index = os.path.join(args.directory, index_default)
+
+    args.where = [parse_condition(w) for w in args.where]
+    args.sort = column_aliases.get(args.sort, args.sort)
+
+    return args
+
+
+def parse_condition(cond):
+    """
+    Parse a filter condition "<column> <op> <value>".
+    """
+
+    match = re.match(r"^\s*([A-Za-z_]\w*)\s*(<=|>=|==|!=|<|>|=)\s*(.+?)\s*$", cond)
+    if match is None:
+        raise ValueError("Can't parse condition '{0}'".format(cond))
+
+    column, op, value = match.groups()
+    column = column_aliases.get(column, column)
+    if op == "=":
+        op = "=="
+    try:
+        value = float(value)
+    except ValueError:
+        value = value.strip("\"'")
+
+    return column, op, value
+
+
+def check_condition(row, cond):
+    """
+    Check whether a catalog row fulfils a parsed condition. Rows
+    without the column never match.
+    """
+
+    column, op, value = cond
+    val = row.get(column)
+    if val is None:
+        return False
+    if isinstance(value, float) and not isinstance(val, (int, float)):
+        return False
+    if isinstance(value, str):
+        val = str(val)
+
+    if op == "<":
+        return val < value
+    if op == "<=":
+        return val <= value
+    if op == ">":
+        return val > value
+    if op == ">=":
+        return val >= value
+    if op == "==":
+        return val == value
+    if op == "!=":
+        return val != value
+
+    raise ValueError("Unknown operator '{0}'".format(op))
+
+
+def find_files(directory, patterns):
+    """
+    Find all files matching any of the patterns in a directory tree.
+    """
+
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for fname in sorted(files):
+            if any(fnmatch.fnmatch(fname, p) for p in patterns):
+                found.append(os.path.abspath(os.path.join(root, fname)))
+
+    return found
+
+
+def to_python(val):
+    """
+    Convert hdf5 attribute values to something json can store.
+    """
+
+    if hasattr(val, "tolist"):
+        val = val.tolist()
+    if isinstance(val, bytes):
+        val = val.decode(errors="replace")
+    if isinstance(val, list) and len(val) == 1:
+        val = val[0]
+    if isinstance(val, list):
+        val = [to_python(v) for v in val]
+
+    return val
+
+
+def read_header(fname):
+    """
+    Read the header attributes of a swift hdf5 file. Doesn't touch
+    any datasets. Returns None if the file isn't a swift output.
+    """
+
+    try:
+        f = h5py.File(fname, "r")
+    except OSError:
+        return None
+
+    try:
+        if "Header" not in f:
+            return None
+
+        h = f["Header"].attrs
+        row = {}
+
+        if "BoxSize" in h:
+            boxsize = to_python(h["BoxSize"])
+            if isinstance(boxsize, list):
+                row["boxsize"] = boxsize[0]
+                row["boxsize_all"] = boxsize
+            else:
+                row["boxsize"] = boxsize
+        for attr, col in [
+            ("Time", "time"),
+            ("Redshift", "redshift"),
+            ("Scale-factor", "scale_factor"),
+            ("Dimension", "dimension"),
+            ("NumFilesPerSnapshot", "nfiles"),
+        ]:
+            if attr in h:
+                row[col] = to_python(h[attr])
+
+        if "NumPart_Total" in h:
+            npart = h["NumPart_Total"].astype("int64").ravel()
+            if "NumPart_Total_HighWord" in h:
+                high = h["NumPart_Total_HighWord"].astype("int64").ravel()
+                # older files may have fewer high words than types
+                n = min(npart.shape[0], high.shape[0])
+                npart[:n] += high[:n] << 32
+            for i, n in enumerate(npart.tolist()):
+                name = ptype_names[i] if i < len(ptype_names) else str(i)
+                row["n_" + name] = n
+
+        if "Units" in f:
+            units = f["Units"].attrs
+            for attr, col in unit_attrs.items():
+                if attr in units:
+                    row[col] = to_python(units[attr])
+
+        if "Code" in f:
+            code = f["Code"].attrs
+            for attr, col in [
+                ("Code Version", "code_version"),
+                ("Git Revision", "git_revision"),
+                ("Git Branch", "git_branch"),
+            ]:
+                if attr in code:
+                    row[col] = to_python(code[attr])
+
+    finally:
+        f.close()
+
+    return row
+
+
+def read_entry(fname):
+    """
+    Read the header of one file for the catalog. A file whose header
+    can't be interpreted is reported and left out, like a file that
+    can't be opened, instead of aborting the whole catalog.
+    """
+
+    try:
+        return read_header(fname)
+    except Exception as e:
+        print("Couldn't read the header of", fname, ":", e)
+        return None
+
+
+def load_index(fname):
+    """
+    Load cached catalog entries, if there are any.
+    """
+
+    if not os.path.isfile(fname):
+        return {}
+
+    try:
+        with open(fname, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        print("Couldn't read index file", fname, "- rebuilding it.")
+        return {}
+
+    if index.get("version") != index_version:
+        return {}
+
+    return index.get("entries", {})
+
+
+def save_index(fname, entries):
+    """
+    Store catalog entries. Writes to a temporary file first so a
+    concurrent reader never sees a partial index.
+    """
+
+    tmpname = fname + ".tmp{0}".format(os.getpid())
+    try:
+        with open(tmpname, "w") as f:
+            json.dump({"version": index_version, "entries": entries}, f)
+        os.replace(tmpname, fname)
+    except OSError as e:
+        print("Couldn't write index file", fname, ":", e)
+
+    return
+
+
+def build_catalog(files, entries, nthreads):
+    """
+    Get catalog rows for all files, re-reading only the headers of
+    files which aren't in the index or have changed since.
+    Returns the rows and the updated index entries.
+    """
+
+    todo = []
+    new_entries = {}
+    for fname in files:
+        st = os.stat(fname)
+        key = [st.st_mtime_ns, st.st_size]
+        entry = entries.get(fname)
+        if entry is not None and entry["key"] == key:
+            new_entries[fname] = entry
+        else:
+            todo.append((fname, key))
+
+    if len(todo) > 0:
+        with ThreadPoolExecutor(max_workers=max(nthreads, 1)) as pool:
+            rows = pool.map(read_entry, [fname for fname, _ in todo])
+            for (fname, key), row in zip(todo, rows):
+                new_entries[fname] = {"key": key, "row": row}
+
+    rows = []
+    for fname in files:
+        row = new_entries[fname]["row"]
+        if row is None:
+            continue
+        row = dict(row)
+        row["path"] = fname
+        rows.append(row)
+
+    return rows, new_entries, len(todo)
+
+
+def format_cell(val):
+    """
+    Format a single table entry.
+    """
+
+    if val is None:
+        return "-"
+    if isinstance(val, float):
+        return "{0:.6g}".format(val)
+    if isinstance(val, list):
+        return "[" + ",".join(format_cell(v) for v in val) + "]"
+
+    return str(val)
+
+
+def print_table(rows, columns, csv):
+    """
+    Print the catalog rows to screen.
+    """
+
+    cells = [[format_cell(row.get(c)) for c in columns] for row in rows]
+
+    if csv:
+        print(",".join(columns))
+        for line in cells:
+            print(",".join(line))
+        return
+
+    widths = [len(c) for c in columns]
+    for line in cells:
+        widths = [max(w, len(c)) for w, c in zip(widths, line)]
+
+    print(" | ".join("{0:{1}}".format(c, w) for c, w in zip(columns, widths)))
+    print("-+-".join("-" * w for w in widths))
+    for line in cells:
+        print(" | ".join("{0:>{1}}".format(c, w) for c, w in zip(line, widths)))
+
+    return
+
+
+def sort_key(column):
+    """
+    Sort key putting rows without the column last.
+    """
+
+    def key(row):
+        val = row.get(column)
+        if val is None:
+            return (2, "")
+        if isinstance(val, (int, float)):
+            return (0, val)
+        return (1, str(val))
+
+    return key
+
+
+def main():
+
+    args = getargs()
+
+    files = find_files(args.directory, args.patterns)
+
+    old_entries = {} if args.rebuild else load_index(args.index)
+    rows, entries, nread = build_catalog(files, old_entries, args.threads)
+    # also drop files which have been removed since
+    if nread > 0 or entries.keys() != old_entries.keys():
+        save_index(args.index, entries)
+
+    rows = [r for r in rows if all(check_condition(r, w) for w in args.where)]
+    rows.sort(key=sort_key(args.sort))
+
+    if args.columns == "all":
+        columns = ["path"]
+        for row in rows:
+            for c in row:
+                if c not in columns:
+                    columns.append(c)
+    else:
+        columns = [
+            column_aliases.get(c.strip(), c.strip()) for c in args.columns.split(",")
+        ]
+
+    print_table(rows, columns, args.csv)
+    if args.csv:
+        return
+
+    print(
+        "{0} of {1} files matched; {2} headers read, {3} from index".format(
+            len(rows), len(files), nread, len(files) - nread
+        )
+    )
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Compare particle data of two swift
+# hdf5 files, matching particles by
+# their IDs.
+# usage:
+#   swift-diffparticles.py <file1> <file2>
+# =====================================
+
+
+import numpy as np
+import argparse
+import h5py
+import os
+
+import swift_io
+
+
+fields_default = "Coordinates,SmoothingLengths,Masses,Densities"
+percentiles_default = "50,90,99"
+
+# log10 bins for the difference histograms which the percentiles
+# are estimated from.
+hist_log_min = -20.0
+hist_log_max = 20.0
+hist_bins_per_dex = 100
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to compare particle data of two swift outputs.
+        Particles are matched by their ParticleIDs, so the particle
+        order in the files doesn't matter.
+            """
+    )
+
+    parser.add_argument("file1")
+    parser.add_argument("file2")
+    parser.add_argument(
+        "--pt",
+        dest="ptype",
+        action="store",
+        default="PartType0",
+        help="PartType to use. Default=PartType0",
+    )
+    parser.add_argument(
+        "--fields",
+        dest="fields",
+        action="store",
+        default=fields_default,
+        help="Comma separated list of datasets to compare. Default=" + fields_default,
+    )
+    parser.add_argument(
+        "--grads",
+        dest="fields",
+        action="store_const",
+        const="GradientSum",
+        help='Compare the "GradientSum" field only',
+    )
+    parser.add_argument(
+        "-k",
+        "--worst",
+        dest="worst",
+        type=int,
+        action="store",
+        default=10,
+        help="Number of worst particles to list per field. Default=10",
+    )
+    parser.add_argument(
+        "--rank",
+        dest="rank",
+        action="store",
+        choices=["abs", "rel"],
+        default="rel",
+        help="Rank worst particles by absolute or relative difference. " "Default=rel",
+    )
+    parser.add_argument(
+        "--percentiles",
+        dest="percentiles",
+        action="store",
+        default=percentiles_default,
+        help="Comma separated percentiles of the differences to print. "
+        "Default=" + percentiles_default,
+    )
+    parser.add_argument(
+        "--show-missing",
+        dest="show_missing",
+        type=int,
+        action="store",
+        default=10,
+        help="Max number of IDs to print which are only in one file. Default=10",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        type=int,
+        action="store",
+        default=swift_io.chunksize_default,
+        help="Number of particles to hold per file and chunk. Default={0}".format(
+            swift_io.chunksize_default
+        ),
+    )
+
+    args = parser.parse_args()
+
+    for fname in [args.file1, args.file2]:
+        if not os.path.isfile(fname):
+            print("Given filename, '", fname, "' is not a file.")
+            quit(2)
+
+    args.fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    args.percentiles = [float(p) for p in args.percentiles.split(",")]
+
+    return args
+
+
+class FieldDiff(object):
+    """
+    Accumulates the differences of one field over all matched
+    particles, chunk by chunk.
+    """
+
+    def __init__(self, name, worst, rank):
+        self.name = name
+        self.worst = worst
+        self.rank = rank
+        self.count = 0
+        self.max_abs = 0.0
+        self.max_rel = 0.0
+        nbins = int((hist_log_max - hist_log_min) * hist_bins_per_dex)
+        # first bin: exact zeros; last bin: overflow
+        self.hist_abs = np.zeros(nbins + 2, dtype=np.int64)
+        self.hist_rel = np.zeros(nbins + 2, dtype=np.int64)
+        self.worst_ids = None
+        self.worst_a = None
+        self.worst_b = None
+        self.worst_abs = np.empty(0)
+        self.worst_rel = np.empty(0)
+
+    def add(self, ids, a, b):
+        """
+        Add a chunk of matched particles. `a` and `b` are the field
+        values of the same particles `ids` in both files.
+        """
+
+        a = a.astype(np.float64)
+        b = b.astype(np.float64)
+        if a.ndim > 1:
+            # vector quantities: compare the norm of the difference
+            a2 = a.reshape(a.shape[0], -1)
+            b2 = b.reshape(b.shape[0], -1)
+            absdiff = np.sqrt(((a2 - b2) ** 2).sum(axis=1))
+            scale = np.maximum(
+                np.sqrt((a2**2).sum(axis=1)), np.sqrt((b2**2).sum(axis=1))
+            )
+        else:
+            absdiff = np.abs(a - b)
+            scale = np.maximum(np.abs(a), np.abs(b))
+
+        reldiff = np.zeros_like(absdiff)
+        nonzero = scale > 0
+        reldiff[nonzero] = absdiff[nonzero] / scale[nonzero]
+
+        if absdiff.shape[0] == 0:
+            return
+
+        self.count += absdiff.shape[0]
+        self.max_abs = max(self.max_abs, absdiff.max())
+        self.max_rel = max(self.max_rel, reldiff.max())
+        self.hist_abs += self._histogram(absdiff)
+        self.hist_rel += self._histogram(reldiff)
+
+        if self.worst > 0:
+            self._update_worst(ids, a, b, absdiff, reldiff)
+
+        return
+
+    def _histogram(self, diff):
+        """
+        Bin differences into the fixed log10 histogram.
+        """
+
+        nbins = self.hist_abs.shape[0] - 2
+        ind = np.zeros(diff.shape[0], dtype=np.int64)
+        pos = diff > 0
+        logd = np.log10(diff[pos])
+        ind[pos] = np.clip(
+            np.floor((logd - hist_log_min) * hist_bins_per_dex).astype(np.int64) + 1,
+            1,
+            nbins + 1,
+        )
+        return np.bincount(ind, minlength=nbins + 2)
+
+    def _update_worst(self, ids, a, b, absdiff, reldiff):
+        """
+        Keep the `worst` particles seen so far.
+        """
+
+        key = reldiff if self.rank == "rel" else absdiff
+        nkeep = min(self.worst, key.shape[0])
+        sel = np.argpartition(-key, nkeep - 1)[:nkeep]
+
+        if self.worst_a is None:
+            # keep the dtype of the IDs, e.g. uint64
+            self.worst_ids = ids[:0]
+            self.worst_a = a[:0]
+            self.worst_b = b[:0]
+
+        all_ids = np.concatenate([self.worst_ids, ids[sel]])
+        all_a = np.concatenate([self.worst_a, a[sel]])
+        all_b = np.concatenate([self.worst_b, b[sel]])
+        all_abs = np.concatenate([self.worst_abs, absdiff[sel]])
+        all_rel = np.concatenate([self.worst_rel, reldiff[sel]])
+
+        all_key = all_rel if self.rank == "rel" else all_abs
+        order = np.argsort(-all_key, kind="stable")[: self.worst]
+
+        self.worst_ids = all_ids[order]
+        self.worst_a = all_a[order]
+        self.worst_b = all_b[order]
+        self.worst_abs = all_abs[order]
+        self.worst_rel = all_rel[order]
+
+        return
+
+    def percentile(self, hist, p):
+        """
+        Estimate the p-th percentile from a difference histogram.
+        Accurate to the histogram bin width of 1/hist_bins_per_dex dex.
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        cumulative = np.cumsum(hist)
+        ind = np.searchsorted(cumulative, p / 100.0 * self.count)
+        ind = min(ind, hist.shape[0] - 1)
+        if ind == 0:
+            return 0.0
+
+        # return upper bin edge
+        return 10.0 ** (hist_log_min + ind / hist_bins_per_dex)
+
+    def report(self, percentiles):
+        """
+        Print results to screen.
+        """
+
+        print()
+        print("Field:", self.name, "({0} particles compared)".format(self.count))
+
+        print("{0:14} | {1:>12} {2:>12}".format("", "absolute", "relative"))
+        print("---------------------------------------------")
+        print("{0:14} | {1:12.4e} {2:12.4e}".format("max", self.max_abs, self.max_rel))
+        for p in percentiles:
+            print(
+                "{0:14} | {1:12.4e} {2:12.4e}".format(
+                    "percentile {0:g}".format(p),
+                    self.percentile(self.hist_abs, p),
+                    self.percentile(self.hist_rel, p),
+                )
+            )
+
+        nshow = np.count_nonzero(self.worst_abs > 0)
+        if nshow == 0:
+            return
+
+        print()
+        print("Worst particles by {0}. diff:".format(self.rank))
+        print(
+            "{0:>12} | {1:>12} {2:>12} | {3:>24} | {4:>24}".format(
+                "ID", "abs diff", "rel diff", "file1", "file2"
+            )
+        )
+        print(
+            "---------------------------------------------------------------------------------------------"
+        )
+        for i in range(nshow):
+            print(
+                "{0:12d} | {1:12.4e} {2:12.4e} | {3:>24} | {4:>24}".format(
+                    int(self.worst_ids[i]),
+                    self.worst_abs[i],
+                    self.worst_rel[i],
+                    format_value(self.worst_a[i]),
+                    format_value(self.worst_b[i]),
+                )
+            )
+
+        return
+
+
+def format_value(val):
+    """
+    Format a scalar or vector particle quantity compactly.
+    """
+
+    val = np.atleast_1d(val).ravel()
+    return " ".join("{0:.6g}".format(v) for v in val)
+
+
+class MissingIDs(object):
+    """
+    Keeps track of particle IDs only present in one of the files.
+    """
+
+    def __init__(self, show):
+        self.show = show
+        self.count = 0
+        self.ids = None
+
+    def add(self, ids):
+        self.count += ids.shape[0]
+        if self.ids is None:
+            # keep the dtype of the IDs, e.g. uint64
+            self.ids = ids[:0]
+        if self.ids.shape[0] < self.show:
+            self.ids = np.concatenate([self.ids, ids[: self.show - self.ids.shape[0]]])
+        return
+
+    def report(self, fname):
+        print("IDs only in {0}: {1}".format(fname, self.count))
+        if self.count > 0 and self.show > 0:
+            print(
+                "  ",
+                [int(i) for i in self.ids],
+                "..." if self.count > self.show else "",
+            )
+        return
+
+
+def sorted_chunks(srcfile, ptype, fields, chunksize):
+    """
+    Generator yielding the particles of a file as structured
+    arrays sorted by ParticleIDs.
+    """
+
+    reader = swift_io.SnapshotReader(srcfile)
+    chunks = reader.iter_records(ptype, ["ParticleIDs"] + fields, chunksize)
+    try:
+        yield from swift_io.external_sort(
+            chunks,
+            "ParticleIDs",
+            chunksize=chunksize,
+            tmpdir=os.path.dirname(os.path.abspath(srcfile)),
+        )
+    finally:
+        reader.close()
+
+
+class SortedStream(object):
+    """
+    Buffer on top of a stream of ID-sorted chunks.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = None
+        self.done = False
+        self.fill()
+
+    def fill(self):
+        """
+        Make sure the buffer is non-empty unless the stream is done.
+        """
+
+        while (self.buffer is None or self.buffer.shape[0] == 0) and not self.done:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                self.done = True
+                self.buffer = None
+        return
+
+    def empty(self):
+        return self.buffer is None
+
+    def last_id(self):
+        return self.buffer["ParticleIDs"][-1]
+
+    def take_upto(self, cutoff):
+        """
+        Remove and return all buffered particles with ID <= cutoff.
+        """
+
+        n = np.searchsorted(self.buffer["ParticleIDs"], cutoff, side="right")
+        out = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        self.fill()
+        return out
+
+    def take_all(self):
+        out = self.buffer
+        self.buffer = None
+        self.fill()
+        return out
+
+
+def diff_files(args):
+    """
+    Join both files on ParticleIDs with a chunked sort-merge and
+    accumulate the differences.
+    """
+
+    fields = [f for f in args.fields if f != "ParticleIDs"]
+
+    diffs = [FieldDiff(name, args.worst, args.rank) for name in fields]
+    only1 = MissingIDs(args.show_missing)
+    only2 = MissingIDs(args.show_missing)
+
+    s1 = SortedStream(sorted_chunks(args.file1, args.ptype, fields, args.chunksize))
+    s2 = SortedStream(sorted_chunks(args.file2, args.ptype, fields, args.chunksize))
+
+    while not s1.empty() and not s2.empty():
+        # everything up to the smaller of the two last buffered IDs
+        # can be joined now: later chunks only have larger IDs.
+        cutoff = min(s1.last_id(), s2.last_id())
+        b1 = s1.take_upto(cutoff)
+        b2 = s2.take_upto(cutoff)
+
+        ids, i1, i2 = np.intersect1d(
+            b1["ParticleIDs"],
+            b2["ParticleIDs"],
+            assume_unique=True,
+            return_indices=True,
+        )
+
+        for d in diffs:
+            d.add(ids, b1[d.name][i1], b2[d.name][i2])
+
+        mask1 = np.ones(b1.shape[0], dtype=bool)
+        mask1[i1] = False
+        only1.add(b1["ParticleIDs"][mask1])
+        mask2 = np.ones(b2.shape[0], dtype=bool)
+        mask2[i2] = False
+        only2.add(b2["ParticleIDs"][mask2])
+
+    while not s1.empty():
+        only1.add(s1.take_all()["ParticleIDs"])
+    while not s2.empty():
+        only2.add(s2.take_all()["ParticleIDs"])
+
+    return diffs, only1, only2
+
+
+def main():
+
+    args = getargs()
+
+    # skip fields which aren't in both files, e.g. Densities of ICs
+    fields = []
+    for field in args.fields:
+        missing = []
+        for fname in [args.file1, args.file2]:
+            with h5py.File(fname, "r") as f:
+                if args.ptype not in f:
+                    print("No", args.ptype, "in", fname)
+                    quit(2)
+                try:
+                    swift_io.resolve_field(f[args.ptype], field)
+                except KeyError:
+                    missing.append(fname)
+        if len(missing) > 0:
+            print("Skipping field", field, "which is missing in", ", ".join(missing))
+        else:
+            fields.append(field)
+    args.fields = fields
+
+    diffs, only1, only2 = diff_files(args)
+
+    print("Comparing", args.ptype, "of", args.file1, "and", args.file2)
+    only1.report(args.file1)
+    only2.report(args.file2)
+
+    for d in diffs:
+        d.report(args.percentiles)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Find friends-of-friends groups in a
+# swift snapshot or IC file, with the
+# box split into slabs which are
+# processed in parallel.
+# usage:
+#   swift-fof.py <fname> [--pt PartType1] [-b 0.2] [--min-size 20]
+# =====================================
+
+
+import numpy as np
+import argparse
+import h5py
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from scipy.spatial import cKDTree
+
+import swift_io
+
+
+# group ID of particles which aren't in any group, as in SWIFT
+group_id_none = 2147483647
+
+# slabs with more particles are searched for pairs in batches of this
+# many particles. Batches find each pair twice, so they are only used
+# to bound the memory of the pair lists.
+batchsize_default = 1 << 22
+
+# record layout of the per-slab particle files
+particle_dtype = np.dtype([("index", np.int64), ("x", np.float64, (3,))])
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to find friends-of-friends groups of the particles
+        of a snapshot or IC file. Particles closer than the linking
+        length are linked, and groups are the connected sets of
+        linked particles. The periodic box is split into slabs along
+        x, each read with a ghost layer of one linking length and
+        searched by its own worker with a periodic cKDTree; groups
+        crossing slabs are merged afterwards. Group IDs are given by
+        decreasing group size. Writes the group ID of each particle,
+        and the size, mass and centre of mass of each group.
+            """
+    )
+
+    parser.add_argument("filename")
+    parser.add_argument(
+        "--pt",
+        dest="ptype",
+        action="store",
+        default="PartType1",
+        help="PartType to use. Default=PartType1",
+    )
+    parser.add_argument(
+        "-b",
+        "--linking-length",
+        dest="linking_length",
+        type=float,
+        action="store",
+        default=0.2,
+        help="Linking length in units of the mean interparticle separation. "
+        "Default=0.2",
+    )
+    parser.add_argument(
+        "--absolute",
+        dest="absolute",
+        action="store_true",
+        help="The linking length is given in internal length units instead",
+    )
+    parser.add_argument(
+        "--min-size",
+        dest="min_size",
+        type=int,
+        action="store",
+        default=20,
+        help="Minimal number of particles of a group. Default=20",
+    )
+    parser.add_argument(
+        "-d",
+        "--domains",
+        dest="ndomains",
+        type=int,
+        action="store",
+        default=None,
+        help="Number of slabs to split the box into. Default: number of processes",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of worker processes. Default: all cores",
+    )
+    parser.add_argument(
+        "--ndim",
+        dest="ndim",
+        type=int,
+        action="store",
+        choices=[1, 2, 3],
+        default=None,
+        help="Number of dimensions. Default: Header/Dimension, or 3",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="outfile",
+        action="store",
+        default=None,
+        help="Output .npz file. Default=<fname>-fof.npz",
+    )
+    parser.add_argument(
+        "--write",
+        dest="write",
+        action="store_true",
+        help="Also write the group IDs into the file as FOFGroupIDs",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        type=int,
+        action="store",
+        default=swift_io.chunksize_default,
+        help="Number of particles to read and write at once. Default={0}".format(
+            swift_io.chunksize_default
+        ),
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.filename):
+        print("Given filename, '", args.filename, "' is not a file.")
+        quit(2)
+    if args.linking_length <= 0.0:
+        parser.error("--linking-length must be positive")
+    if args.min_size < 1:
+        parser.error("--min-size must be at least 1")
+    if args.chunksize <= 0:
+        parser.error("--chunksize must be positive")
+
+    if args.ndomains is None:
+        args.ndomains = max(args.nproc, 1)
+
+    if args.outfile is None:
+        base, _ = os.path.splitext(args.filename)
+        args.outfile = base + "-fof.npz"
+
+    return args
+
+
+def read_header(srcfile, ptype, ndim):
+    """
+    Get the box size, dimension, and particle count.
+    """
+
+    with h5py.File(srcfile, "r") as f:
+        boxsize, ndim = swift_io.read_box(f, ndim)
+        if ptype not in f:
+            print("No", ptype, "in", srcfile)
+            quit(2)
+        npart = swift_io.npart_in_group(f, ptype)
+
+    return boxsize, ndim, npart
+
+
+def find(parent, i):
+    """
+    Get the roots of the elements i of a union-find forest stored as
+    an array of parents, by pointer jumping over all of them at once.
+    The visited elements are then pointed to their roots directly.
+    """
+
+    r = parent[i]
+    while True:
+        rr = parent[r]
+        if (rr == r).all():
+            break
+        r = rr
+    parent[i] = r
+
+    return r
+
+
+def union(parent, i, j):
+    """
+    Link the elements i[k] and j[k] of a union-find forest for all k.
+    Of each pair of roots, the larger is hooked onto the smaller, so
+    every root is the smallest element of its set. Hooks competing
+    for the same root are resolved with np.minimum.at, and the pairs
+    which lost are linked again in the next round.
+    """
+
+    while i.shape[0] > 0:
+        ri = find(parent, i)
+        rj = find(parent, j)
+        diff = ri != rj
+        i = np.minimum(ri[diff], rj[diff])
+        j = np.maximum(ri[diff], rj[diff])
+        np.minimum.at(parent, j, i)
+
+    return
+
+
+def roots(parent):
+    """
+    Point every element of a union-find forest to its root.
+    """
+
+    while True:
+        grand = parent[parent]
+        if (grand == parent).all():
+            break
+        parent[:] = grand
+
+    return parent
+
+
+def partition(srcfile, ptype, edges, ghost, boxsize, workdir, chunksize):
+    """
+    Single chunked pass over the file which writes each slab's
+    particles, plus its ghost layer, to its own temporary file.
+    Coordinates are wrapped into the box first; ghost particles
+    across the periodic x boundary are shifted by one box length.
+    """
+
+    ndomains = edges.shape[0] - 1
+    L = boxsize[0]
+    fnames = [
+        os.path.join(workdir, "domain{0:05d}.dat".format(d)) for d in range(ndomains)
+    ]
+    outs = [open(fname, "wb") for fname in fnames]
+
+    try:
+        with swift_io.SnapshotReader(srcfile) as reader:
+            npart = swift_io.npart_in_group(reader.file, ptype)
+            for start in range(0, npart, chunksize):
+                stop = min(start + chunksize, npart)
+                data = reader.read([(ptype, "Coordinates")], start, stop)
+                x = np.mod(data[(ptype, "Coordinates")].astype(np.float64), boxsize)
+                # mod of tiny negative values may round up to the box size
+                x = np.where(x >= boxsize, 0.0, x)
+
+                for d in range(ndomains):
+                    lo = edges[d] - ghost
+                    hi = edges[d + 1] + ghost
+                    for shift in [0.0, -L, L]:
+                        if shift != 0.0 and ndomains == 1:
+                            continue
+                        xs = x[:, 0] + shift
+                        sel = np.flatnonzero((xs >= lo) & (xs < hi))
+                        if sel.shape[0] == 0:
+                            continue
+                        out = np.empty(sel.shape[0], dtype=particle_dtype)
+                        out["index"] = start + sel
+                        out["x"] = x[sel]
+                        if shift != 0.0:
+                            out["x"][:, 0] += shift
+                        out.tofile(outs[d])
+    finally:
+        for out in outs:
+            out.close()
+
+    return fnames
+
+
+def domain_fof(fname, boxsize, ndim, linking_length, periodic_x, batchsize):
+    """
+    Worker: link the particles of a slab, ghosts included. Pairs are
+    found with query_pairs, or for large slabs batch by batch with
+    sparse distance matrices of a batch's tree against the slab's,
+    so only one batch of pairs is held at a time. Returns the name
+    of the .npy file holding the global index of each particle in a
+    non-trivial set, and the smallest global index of its set.
+    """
+
+    part = np.fromfile(fname, dtype=particle_dtype)
+    os.remove(fname)
+    n = part.shape[0]
+
+    # spatially compact batches
+    part = part[np.argsort(part["x"][:, 0], kind="stable")]
+    x = part["x"][:, :ndim]
+
+    # the slab isn't periodic along x any more, unless it is the whole box
+    box = boxsize[:ndim].copy()
+    if not periodic_x:
+        box[0] = 0.0
+
+    parent = np.arange(n)
+    if n > 0:
+        tree = cKDTree(x, boxsize=box)
+    if n <= batchsize:
+        if n > 0:
+            pairs = tree.query_pairs(linking_length, output_type="ndarray")
+            union(parent, pairs[:, 0], pairs[:, 1])
+    else:
+        for start in range(0, n, batchsize):
+            stop = min(start + batchsize, n)
+            batch = cKDTree(x[start:stop], boxsize=box)
+            pairs = batch.sparse_distance_matrix(
+                tree, linking_length, output_type="ndarray"
+            )
+            i = pairs["i"].astype(np.int64) + start
+            j = pairs["j"].astype(np.int64)
+            keep = i < j
+            union(parent, i[keep], j[keep])
+
+    root = roots(parent)
+    size = np.bincount(root, minlength=n)
+    linked = np.flatnonzero(size[root] > 1)
+
+    # smallest global index of each set, to merge sets across slabs
+    first = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(first, root[linked], part["index"][linked])
+
+    result = np.empty(linked.shape[0], dtype=[("index", np.int64), ("root", np.int64)])
+    result["index"] = part["index"][linked]
+    result["root"] = first[root[linked]]
+
+    outname = fname.replace(".dat", "-links.npy")
+    np.save(outname, result)
+
+    return outname
+
+
+def group_properties(srcfile, ptype, root, gid, ngroups, boxsize, ndim, chunksize):
+    """
+    Chunked pass over the file to get the mass and centre of mass of
+    each group. Offsets are taken to the group's first particle with
+    the periodic minimum image, so groups across the box boundary
+    get the right centre. The first particle of a group is its root,
+    so it is read before any other member.
+    """
+
+    mass = np.zeros(ngroups)
+    moment = np.zeros((ngroups, ndim))
+    ref = np.zeros((ngroups, ndim))
+    box = boxsize[:ndim]
+
+    with swift_io.SnapshotReader(srcfile) as reader:
+        fields = ["Coordinates"]
+        if reader.has(ptype, "Masses"):
+            fields.append("Masses")
+        else:
+            print("No Masses in", ptype, "; using unit masses")
+
+        npart = root.shape[0]
+        for start in range(0, npart, chunksize):
+            stop = min(start + chunksize, npart)
+            g = gid[start:stop]
+            sel = np.flatnonzero(g != group_id_none)
+            if sel.shape[0] == 0:
+                continue
+
+            rec = reader.read_records(ptype, fields, start, stop)
+            x = rec["Coordinates"][sel, :ndim].astype(np.float64)
+            if "Masses" in fields:
+                m = rec["Masses"][sel].astype(np.float64)
+            else:
+                m = np.ones(sel.shape[0])
+            g = g[sel] - 1
+
+            first = np.flatnonzero(root[start + sel] == start + sel)
+            ref[g[first]] = x[first]
+
+            dx = swift_io.periodic_offset(x, ref[g], box)
+            mass += np.bincount(g, weights=m, minlength=ngroups)
+            for k in range(ndim):
+                moment[:, k] += np.bincount(g, weights=m * dx[:, k], minlength=ngroups)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centre = np.mod(ref + moment / mass[:, None], box)
+
+    return mass, centre
+
+
+def main():
+
+    args = getargs()
+
+    boxsize, ndim, npart = read_header(args.filename, args.ptype, args.ndim)
+
+    if args.absolute:
+        ll = args.linking_length
+    else:
+        spacing = (np.prod(boxsize[:ndim]) / max(npart, 1)) ** (1.0 / ndim)
+        ll = args.linking_length * spacing
+
+    L = boxsize[0]
+    ndomains = args.ndomains
+    if ndomains > 1 and L / ndomains + 2.0 * ll >= L:
+        # a slab and its ghost layers would overlap with themselves
+        print(
+            "Ghost layers are too wide for {0} slabs; using a single domain.".format(
+                ndomains
+            )
+        )
+        ndomains = 1
+    edges = np.linspace(0.0, L, ndomains + 1)
+    edges[-1] = L
+
+    print(
+        "Linking {0} particles with linking length {1:.4g} in {2} slabs".format(
+            npart, ll, ndomains
+        )
+    )
+
+    workdir = tempfile.mkdtemp(
+        prefix="swift-fof-", dir=os.path.dirname(os.path.abspath(args.outfile))
+    )
+
+    try:
+        fnames = partition(
+            args.filename,
+            args.ptype,
+            edges,
+            ll if ndomains > 1 else 0.0,
+            boxsize,
+            workdir,
+            args.chunksize,
+        )
+
+        # merge the sets of all slabs through the particles they share
+        parent = np.arange(npart)
+        with ProcessPoolExecutor(max_workers=max(args.nproc, 1)) as pool:
+            futures = [
+                pool.submit(
+                    domain_fof,
+                    fnames[d],
+                    boxsize,
+                    ndim,
+                    ll,
+                    ndomains == 1,
+                    batchsize_default,
+                )
+                for d in range(ndomains)
+            ]
+            for d, fut in enumerate(futures):
+                result = np.load(fut.result())
+                union(parent, result["index"], result["root"])
+                print("Finished slab", d, "with", result.shape[0], "linked particles")
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    root = roots(parent)
+    size = np.bincount(root, minlength=npart)
+
+    # group IDs by decreasing size, ties by first particle
+    first = np.flatnonzero((size >= args.min_size) & (np.arange(npart) == root))
+    first = first[np.argsort(-size[first], kind="stable")]
+    ngroups = first.shape[0]
+    gid = np.full(npart, group_id_none, dtype=np.int64)
+    gid[first] = np.arange(1, ngroups + 1)
+    gid = gid[root]
+
+    mass, centre = group_properties(
+        args.filename, args.ptype, root, gid, ngroups, boxsize, ndim, args.chunksize
+    )
+
+    np.savez(
+        args.outfile,
+        group_ids=gid,
+        ids=np.arange(1, ngroups + 1),
+        sizes=size[first],
+        masses=mass,
+        centres=centre,
+        linking_length=ll,
+    )
+
+    print(
+        "Found {0} groups with at least {1} particles, {2} particles in groups".format(
+            ngroups, args.min_size, int(size[first].sum())
+        )
+    )
+    nshow = min(ngroups, 10)
+    if nshow > 0:
+        print("{0:>8} {1:>10} {2:>12}  {3}".format("id", "size", "mass", "centre"))
+        for g in range(nshow):
+            print(
+                "{0:8d} {1:10d} {2:12.4e}  {3}".format(
+                    g + 1,
+                    size[first[g]],
+                    mass[g],
+                    " ".join("{0:10.4f}".format(c) for c in centre[g]),
+                )
+            )
+
+    if args.write:
+        with h5py.File(args.filename, "r+") as f:
+            group = f[args.ptype]
+            if "FOFGroupIDs" in group:
+                del group["FOFGroupIDs"]
+            dset = group.create_dataset("FOFGroupIDs", shape=(npart,), dtype=np.int64)
+            for start in range(0, npart, args.chunksize):
+                stop = min(start + args.chunksize, npart)
+                dset[start:stop] = gid[start:stop]
+        print("Written FOFGroupIDs to", args.filename)
+
+    print("Written groups to", args.outfile)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Estimate SPH densities of IC files
+# which don't fit into memory, by
+# splitting the box into slabs which
+# are processed in parallel.
+# usage:
+#   swift-ic-density.py <fname> [--domains N] [--write]
+# =====================================
+
+
+import numpy as np
+import argparse
+import h5py
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import swift_io
+import swift_sph
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to estimate SPH densities of (large) IC files.
+        The periodic box is split into slabs along x. Each slab is
+        read together with a ghost layer of width gamma * max(h) and
+        processed by its own worker process, so only one slab per
+        worker needs to fit into memory. Densities are the same as
+        those of swift-ic-plot.py.
+            """
+    )
+
+    parser.add_argument("filename")
+    parser.add_argument(
+        "--pt",
+        dest="ptype",
+        action="store",
+        default="PartType0",
+        help="PartType to use. Default=PartType0",
+    )
+    parser.add_argument(
+        "-d",
+        "--domains",
+        dest="ndomains",
+        type=int,
+        action="store",
+        default=None,
+        help="Number of slabs to split the box into. Default: number of processes",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of worker processes. Default: all cores",
+    )
+    parser.add_argument(
+        "--neighbours",
+        dest="neighbours",
+        type=int,
+        action="store",
+        default=50,
+        help="Max number of neighbours per particle. Default=50",
+    )
+    parser.add_argument(
+        "--ndim",
+        dest="ndim",
+        type=int,
+        action="store",
+        choices=[1, 2, 3],
+        default=None,
+        help="Number of dimensions. Default: Header/Dimension, or 3",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="outfile",
+        action="store",
+        default=None,
+        help="Output .npy file for the densities. Default=<fname>-density.npy",
+    )
+    parser.add_argument(
+        "--write",
+        dest="write",
+        action="store_true",
+        help="Also write the densities into the IC file",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        type=int,
+        action="store",
+        default=swift_io.chunksize_default,
+        help="Number of particles to read and write at once. Default={0}".format(
+            swift_io.chunksize_default
+        ),
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.filename):
+        print("Given filename, '", args.filename, "' is not a file.")
+        quit(2)
+
+    if args.ndomains is None:
+        args.ndomains = max(args.nproc, 1)
+
+    if args.outfile is None:
+        base, _ = os.path.splitext(args.filename)
+        args.outfile = base + "-density.npy"
+
+    return args
+
+
+def read_header(srcfile, ptype, ndim, chunksize):
+    """
+    Get the box size, dimension, particle count, and the largest
+    smoothing length. The latter is found with a chunked pass over
+    the smoothing lengths.
+    """
+
+    with h5py.File(srcfile, "r") as f:
+        boxsize, ndim = swift_io.read_box(f, ndim)
+
+        group = f[ptype]
+        npart = swift_io.npart_in_group(f, ptype)
+        hset = group[swift_io.resolve_field(group, "SmoothingLengths")]
+        hmax = 0.0
+        for start in range(0, npart, chunksize):
+            hmax = max(hmax, float(hset[start : start + chunksize].max()))
+
+    return boxsize, ndim, npart, hmax
+
+
+# record layout of the per-domain particle files
+particle_dtype = np.dtype(
+    [("index", np.int64), ("x", np.float64, (3,)), ("m", np.float64), ("h", np.float64)]
+)
+
+
+def partition(srcfile, ptype, edges, ghost, boxsize, workdir, chunksize):
+    """
+    Single chunked pass over the file which writes each slab's
+    particles, plus its ghost layer, to its own temporary file.
+    Ghost particles across the periodic x boundary are shifted by
+    one box length; all other particles keep their coordinates bit
+    for bit, so distances are computed exactly as in a global tree.
+    """
+
+    ndomains = edges.shape[0] - 1
+    L = boxsize[0]
+    fnames = [
+        os.path.join(workdir, "domain{0:05d}.dat".format(d)) for d in range(ndomains)
+    ]
+    outs = [open(fname, "wb") for fname in fnames]
+
+    try:
+        with swift_io.SnapshotReader(srcfile) as reader:
+            fields = ["Coordinates", "Masses", "SmoothingLengths"]
+            npart = swift_io.npart_in_group(reader.file, ptype)
+            for start in range(0, npart, chunksize):
+                stop = min(start + chunksize, npart)
+                rec = reader.read_records(ptype, fields, start, stop)
+                x = rec["Coordinates"].astype(np.float64)
+
+                for d in range(ndomains):
+                    lo = edges[d] - ghost
+                    hi = edges[d + 1] + ghost
+                    for shift in [0.0, -L, L]:
+                        if shift != 0.0 and ndomains == 1:
+                            continue
+                        xs = x[:, 0] + shift
+                        sel = np.flatnonzero((xs >= lo) & (xs < hi))
+                        if sel.shape[0] == 0:
+                            continue
+                        out = np.empty(sel.shape[0], dtype=particle_dtype)
+                        out["index"] = start + sel
+                        out["x"] = x[sel]
+                        if shift != 0.0:
+                            out["x"][:, 0] += shift
+                        out["m"] = rec["Masses"][sel]
+                        out["h"] = rec["SmoothingLengths"][sel]
+                        out.tofile(outs[d])
+    finally:
+        for out in outs:
+            out.close()
+
+    return fnames
+
+
+def domain_density(fname, lo, hi, boxsize, ndim, neighbours, periodic_x):
+    """
+    Worker: compute the densities of the particles a slab owns,
+    i.e. those with lo <= x < hi. Returns the name of the .npy file
+    holding their global indices and densities.
+    """
+
+    part = np.fromfile(fname, dtype=particle_dtype)
+    if part.shape[0] == 0:
+        result = np.empty(0, dtype=[("index", np.int64), ("rho", np.float64)])
+    else:
+        owned = np.flatnonzero((part["x"][:, 0] >= lo) & (part["x"][:, 0] < hi))
+
+        # the slab isn't periodic along x any more, unless it is the whole box
+        box = boxsize.copy()
+        if not periodic_x:
+            box[0] = 0.0
+
+        rho = swift_sph.approximate_density(
+            part["x"],
+            part["m"],
+            part["h"],
+            boxsize=box,
+            ndim=ndim,
+            neighbours=neighbours,
+            workers=1,
+            targets=owned,
+        )
+
+        result = np.empty(
+            owned.shape[0], dtype=[("index", np.int64), ("rho", np.float64)]
+        )
+        result["index"] = part["index"][owned]
+        result["rho"] = rho
+
+    os.remove(fname)
+    outname = fname.replace(".dat", "-rho.npy")
+    np.save(outname, result)
+
+    return outname
+
+
+def main():
+
+    args = getargs()
+
+    boxsize, ndim, npart, hmax = read_header(
+        args.filename, args.ptype, args.ndim, args.chunksize
+    )
+    _, _, _, kernel_gamma = swift_sph.get_kernel("cubic spline", ndim)
+    ghost = kernel_gamma * hmax
+
+    L = boxsize[0]
+    ndomains = args.ndomains
+    if ndomains > 1 and L / ndomains + 2.0 * ghost >= L:
+        # a slab and its ghost layers would overlap with themselves
+        print(
+            "Ghost layers are too wide for {0} slabs; using a single domain.".format(
+                ndomains
+            )
+        )
+        ndomains = 1
+    edges = np.linspace(0.0, L, ndomains + 1)
+    edges[-1] = L
+
+    print(
+        "Splitting {0} particles into {1} slabs with ghost layers of {2:.4g}".format(
+            npart, ndomains, ghost
+        )
+    )
+
+    workdir = tempfile.mkdtemp(
+        prefix="swift-ic-density-", dir=os.path.dirname(os.path.abspath(args.outfile))
+    )
+
+    try:
+        fnames = partition(
+            args.filename,
+            args.ptype,
+            edges,
+            ghost if ndomains > 1 else 0.0,
+            boxsize,
+            workdir,
+            args.chunksize,
+        )
+
+        rho = np.lib.format.open_memmap(
+            args.outfile, mode="w+", dtype=np.float64, shape=(npart,)
+        )
+
+        with ProcessPoolExecutor(max_workers=max(args.nproc, 1)) as pool:
+            futures = [
+                pool.submit(
+                    domain_density,
+                    fnames[d],
+                    edges[d],
+                    edges[d + 1],
+                    boxsize,
+                    ndim,
+                    args.neighbours,
+                    ndomains == 1,
+                )
+                for d in range(ndomains)
+            ]
+            for d, fut in enumerate(futures):
+                result = np.load(fut.result())
+                rho[result["index"]] = result["rho"]
+                print("Finished slab", d, "with", result.shape[0], "particles")
+
+        rho.flush()
+
+        if args.write:
+            with h5py.File(args.filename, "r+") as f:
+                group = f[args.ptype]
+                try:
+                    name = swift_io.resolve_field(group, "Densities")
+                except KeyError:
+                    # IC files use the old names
+                    name = "Density"
+                    group.create_dataset(
+                        name, shape=(npart,), dtype=group["Masses"].dtype
+                    )
+                dset = group[name]
+                for start in range(0, npart, args.chunksize):
+                    stop = min(start + args.chunksize, npart)
+                    dset[start:stop] = rho[start:stop]
+            print("Written", name, "to", args.filename)
+
+        del rho
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("Written densities to", args.outfile)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,14 @@
 
 import numpy as np
 import unyt
-from scipy.spatial import cKDTree
 from swiftsimio import load
-from swiftsimio.visualisation.projection import project_gas
-from swiftsimio.initial_conditions.IC_kernel import get_kernel_data
+
+import swift_io
+import swift_projection
+import swift_sph
 
 import argparse
+import h5py
 from os import path
 
 import matplotlib
@@ -52,60 +54,121 @@ def getargs():
 
     #  parser.add_help(True)
     parser.add_argument("filename")
+    parser.add_argument(
+        "--solve-h",
+        dest="solve_h",
+        action="store_true",
+        help="Iterate smoothing lengths to consistency before estimating "
+        "densities missing in the file, instead of using the file's h "
+        "and 50 neighbours",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="Don't use or store cached neighbour lists for the density estimate",
+    )
+    parser.add_argument(
+        "--axis",
+        dest="axis",
+        action="store",
+        choices=["x", "y", "z"],
+        default="z",
+        help="3D only: axis to slice or project along. Default=z",
+    )
+    parser.add_argument(
+        "--slice-pos",
+        dest="slice_pos",
+        type=float,
+        action="store",
+        default=0.5,
+        help="3D only: position of the slice, or centre of the projected "
+        "slab, in units of the box size. Default=0.5",
+    )
+    parser.add_argument(
+        "--projection",
+        dest="projection",
+        action="store_true",
+        help="3D only: project a slab instead of plotting a thin slice",
+    )
+    parser.add_argument(
+        "--thickness",
+        dest="thickness",
+        type=float,
+        action="store",
+        default=1.0,
+        help="3D only: thickness of the projected slab in units of the box "
+        "size. Default=1 (whole box)",
+    )
+    parser.add_argument(
+        "--resolution",
+        dest="resolution",
+        type=int,
+        action="store",
+        default=256,
+        help="3D only: number of pixels per dimension. Default=256",
+    )
 
     args = parser.parse_args()
 
-    infile = args.filename
-
-    if not path.exists(infile):
+    if not path.exists(args.filename):
         raise ValueError("Given file doesn't exist.")
 
-    return infile
+    return args
 
 
-def compute_approximate_density(data):
+def compute_approximate_density(data, solve_h=False, cache=True):
     """
     Compute approximate density if it is not present in
-    the IC file.
+    the IC file. If solve_h is set or the file has no smoothing
+    lengths, they are first solved for with swift_sph. Otherwise,
+    the neighbour lists are cached on disk if cache is set, so
+    re-plotting the same IC skips the neighbour search.
     """
 
     x = data.gas.coordinates
     m = data.gas.masses
-    h = data.gas.smoothing_length
 
-    npart = m.shape[0]
     ndim = data.metadata.dimension
     boxsize = data.metadata.boxsize
 
-    rho = unyt.unyt_array(
-        np.zeros(m.shape), m.units
-    )  # change to density units after neighbour loop
-    neighbours = min(50, npart)
-
-    kernel_func, _, kernel_gamma = get_kernel_data("cubic spline", ndim)
-
-    tree = cKDTree(x, boxsize=boxsize)
-    for p in range(npart):
-        dist, neighs = tree.query(
-            x[p], distance_upper_bound=kernel_gamma * h[p], k=neighbours
+    try:
+        h = data.gas.smoothing_lengths
+    except AttributeError:
+        try:
+            h = data.gas.smoothing_length
+        except AttributeError:
+            solve_h = True
+
+    if solve_h:
+        h, rho, nfailed = swift_sph.solve_smoothing_lengths(
+            x.value,
+            m.value,
+            boxsize=boxsize.to(x.units).value,
+            ndim=ndim,
+            kernel="cubic spline",
         )
-        # tree.query returns index nparts+1 if not enough neighbours were found
-        mask = neighs < npart
-        dist = dist[mask]
-        neighs = neighs[mask]
-        if neighs.shape[0] == 0:
-            raise RuntimeError("Found no neighbour for a particle.")
-        H = dist[-1]
-        for i, n in enumerate(neighs):
-            W = kernel_func(dist[i], H)
-            rho[p] += W * m[n]
-
-    rho = unyt.unyt_array(rho.value, m.units / x.units**ndim)
+        if nfailed > 0:
+            print("WARNING:", nfailed, "smoothing lengths didn't converge")
+        return unyt.unyt_array(rho, m.units / x.units**ndim)
+
+    rho = swift_sph.approximate_density(
+        x.value,
+        m.value,
+        h.to(x.units).value,
+        boxsize=boxsize.to(x.units).value,
+        ndim=ndim,
+        kernel="cubic spline",
+        neighbours=50,
+        cache=cache,
+    )
+
+    rho = unyt.unyt_array(rho, m.units / x.units**ndim)
 
     return rho
 
 
-def plot_1D(data):
+def plot_1D(data, solve_h=False, cache=True):
     """
     creates 1D plots.
     data: swift IC file data as returned from swiftsimio.load()
@@ -113,11 +176,10 @@ def plot_1D(data):
 
     x = data.gas.coordinates
     m = data.gas.masses
-    h = data.gas.smoothing_length
     try:
         rho = data.gas.density
     except AttributeError:
-        rho = compute_approximate_density(data)
+        rho = compute_approximate_density(data, solve_h, cache)
 
     u = data.gas.internal_energy
     v = data.gas.velocities
@@ -152,15 +214,11 @@ def plot_2D(data):
 
     resolution = min(100, int(np.sqrt(data.gas.masses.shape[0])) + 1)
 
-    mass_map = project_gas(
-        data, resolution=resolution, project="masses", parallel="True"
-    )
-    velocity_map = project_gas(
-        data, resolution=resolution, project="velocities", parallel="True"
-    )
-    energy_map = project_gas(
-        data, resolution=resolution, project="internal_energy", parallel="True"
+    # all three maps in a single pass over the particles
+    maps, units = swift_projection.project_gas_fields(
+        data, ["masses", "velocities", "internal_energy"], resolution
     )
+    mass_map, velocity_map, energy_map = maps
 
     plt.imsave("test.png", mass_map)
 
@@ -170,30 +228,162 @@ def plot_2D(data):
     ax2 = fig.add_subplot(132)
     ax3 = fig.add_subplot(133)
 
-    im1 = ax1.imshow(mass_map.value.T, extent=extent)
+    im1 = ax1.imshow(mass_map.T, extent=extent)
     fig.colorbar(im1, ax=ax1)
     ax1.set_title("density")
 
-    im2 = ax2.imshow(velocity_map.value.T, extent=extent)
+    im2 = ax2.imshow(velocity_map.T, extent=extent)
     fig.colorbar(im2, ax=ax2)
     ax2.set_title("velocity")
 
-    im3 = ax3.imshow(energy_map.value.T, extent=extent)
+    im3 = ax3.imshow(energy_map.T, extent=extent)
     fig.colorbar(im3, ax=ax3)
     ax3.set_title("internal energy")
 
     return fig
 
 
+def read_3D(infile, axis, lo, hi, kernel_overlap, ptype="PartType0"):
+    """
+    Read the particles needed for a slice or projection of a 3D IC.
+    Only particles within lo <= x[axis] < hi are read, or those whose
+    kernel overlaps it if kernel_overlap is set. If the file has no
+    smoothing lengths, a constant h from the mean particle spacing is
+    used.
+    """
+
+    _, _, _, kernel_gamma = swift_sph.get_kernel("cubic spline", 3)
+
+    with swift_io.SnapshotReader(infile) as reader:
+        boxsize, _ = swift_io.read_box(reader.file)
+
+        fields = ["Coordinates", "Masses", "Velocities", "InternalEnergies"]
+        has_h = reader.has(ptype, "SmoothingLengths")
+        if has_h:
+            fields.append("SmoothingLengths")
+        else:
+            npart = reader.dataset(ptype, "Coordinates").shape[0]
+            h0 = 1.2348 * (np.prod(boxsize) / npart) ** (1.0 / 3.0)
+            print("No smoothing lengths in file, using h =", h0)
+
+        L = boxsize[axis]
+        if has_h:
+            data = swift_io.read_slab(
+                reader,
+                ptype,
+                fields,
+                axis,
+                lo,
+                hi,
+                L,
+                kernel_gamma=kernel_gamma if kernel_overlap else None,
+            )
+        else:
+            pad = kernel_gamma * h0 if kernel_overlap else 0.0
+            data = swift_io.read_slab(
+                reader, ptype, fields, axis, lo - pad, hi + pad, L
+            )
+            data["SmoothingLengths"] = np.full(data["Masses"].shape[0], h0)
+
+    print("Selected", data["Masses"].shape[0], "particles")
+
+    return data, boxsize, kernel_gamma
+
+
+def plot_3D(
+    infile, axis="z", slice_pos=0.5, projection=False, thickness=1.0, resolution=256
+):
+    """
+    creates slices or projections of 3D ICs along the given axis.
+    Only the particles which contribute to the maps are read and
+    deposited.
+    infile: swift IC file name
+    """
+
+    iz = "xyz".index(axis)
+    ix, iy = [i for i in range(3) if i != iz]
+
+    with h5py.File(infile, "r") as f:
+        boxsize, _ = swift_io.read_box(f)
+
+    z0 = slice_pos * boxsize[iz]
+    if projection:
+        half = 0.5 * min(thickness, 1.0) * boxsize[iz]
+        data, boxsize, kernel_gamma = read_3D(infile, iz, z0 - half, z0 + half, False)
+        dz = None
+    else:
+        data, boxsize, kernel_gamma = read_3D(infile, iz, z0, z0, True)
+
+    x = data["Coordinates"]
+    m = data["Masses"]
+    H = kernel_gamma * data["SmoothingLengths"]
+    v = np.sqrt(np.sum(data["Velocities"].astype(np.float64) ** 2, axis=1))
+    u = data["InternalEnergies"]
+    if not projection:
+        dz = swift_io.periodic_offset(x[:, iz], z0, boxsize[iz])
+
+    extent = (0, boxsize[ix], 0, boxsize[iy])
+    mass_map, velocity_map, energy_map = swift_projection.deposit(
+        x[:, ix],
+        x[:, iy],
+        H,
+        np.stack([m, m * v, m * u]),
+        resolution,
+        resolution,
+        extent,
+        dz=dz,
+        periodic=(True, True),
+    )
+
+    # mass weighted velocities and internal energies
+    with np.errstate(invalid="ignore", divide="ignore"):
+        velocity_map = np.where(mass_map > 0, velocity_map / mass_map, 0.0)
+        energy_map = np.where(mass_map > 0, energy_map / mass_map, 0.0)
+
+    fig = plt.figure(figsize=(12, 4))
+
+    ax1 = fig.add_subplot(131)
+    ax2 = fig.add_subplot(132)
+    ax3 = fig.add_subplot(133)
+
+    im1 = ax1.imshow(mass_map.T, extent=extent, origin="lower")
+    fig.colorbar(im1, ax=ax1)
+    ax1.set_title("surface density" if projection else "density")
+
+    im2 = ax2.imshow(velocity_map.T, extent=extent, origin="lower")
+    fig.colorbar(im2, ax=ax2)
+    ax2.set_title("velocity")
+
+    im3 = ax3.imshow(energy_map.T, extent=extent, origin="lower")
+    fig.colorbar(im3, ax=ax3)
+    ax3.set_title("internal energy")
+
+    for ax in [ax1, ax2, ax3]:
+        ax.set_xlabel("xyz"[ix])
+        ax.set_ylabel("xyz"[iy])
+
+    return fig
+
+
 if __name__ == "__main__":
-    infile = getargs()
+    args = getargs()
+    infile = args.filename
 
     data = load(infile)
     meta = data.metadata
     if meta.dimension == 1:
-        fig = plot_1D(data)
+        fig = plot_1D(data, args.solve_h, args.cache)
     elif meta.dimension == 2:
         fig = plot_2D(data)
+    else:
+        fig = plot_3D(
+            infile,
+            args.axis,
+            args.slice_pos,
+            args.projection,
+            args.thickness,
+            args.resolution,
+        )
 
     figname, h5 = path.splitext(infile)
     plt.savefig(figname + ".png", dpi=200)
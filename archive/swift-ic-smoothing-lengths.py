@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Compute consistent smoothing lengths
+# and densities for the particles of a
+# swift IC file, and optionally write
+# them back into the file.
+# usage:
+#   swift-ic-smoothing-lengths.py <fname> [--write]
+# =====================================
+
+
+import numpy as np
+import argparse
+import h5py
+import os
+
+import swift_io
+import swift_sph
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to compute consistent smoothing lengths and
+        densities for IC files, using the same condition as SWIFT:
+        h^ndim * sum_j W(r_ij, h) = eta^ndim.
+            """
+    )
+
+    parser.add_argument("filename")
+    parser.add_argument(
+        "--pt",
+        dest="ptype",
+        action="store",
+        default="PartType0",
+        help="PartType to use. Default=PartType0",
+    )
+    parser.add_argument(
+        "--kernel",
+        dest="kernel",
+        action="store",
+        choices=list(swift_sph.kernels.keys()),
+        default="cubic spline",
+        help="SPH kernel. Default='cubic spline'",
+    )
+    parser.add_argument(
+        "--eta",
+        dest="eta",
+        type=float,
+        action="store",
+        default=1.2348,
+        help="Resolution eta. Default=1.2348",
+    )
+    parser.add_argument(
+        "--ndim",
+        dest="ndim",
+        type=int,
+        action="store",
+        choices=[1, 2, 3],
+        default=None,
+        help="Number of dimensions. Default: Header/Dimension, or 3",
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        type=float,
+        action="store",
+        default=1e-4,
+        help="Relative tolerance on the neighbour number. Default=1e-4",
+    )
+    parser.add_argument(
+        "--max-iter",
+        dest="max_iter",
+        type=int,
+        action="store",
+        default=50,
+        help="Max number of iterations. Default=50",
+    )
+    parser.add_argument(
+        "--no-periodic",
+        dest="periodic",
+        action="store_false",
+        help="Don't treat the box as periodic",
+    )
+    parser.add_argument(
+        "-j",
+        "--threads",
+        dest="workers",
+        type=int,
+        action="store",
+        default=-1,
+        help="Number of threads for the neighbour search. Default: all cores",
+    )
+    parser.add_argument(
+        "--write",
+        dest="write",
+        action="store_true",
+        help="Write the smoothing lengths and densities into the file",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.filename):
+        print("Given filename, '", args.filename, "' is not a file.")
+        quit(2)
+
+    return args
+
+
+def read_file(srcfile, ptype, ndim):
+    """
+    Read particle positions, masses and box data from an IC file.
+    """
+
+    data = swift_io.read_fields(
+        srcfile,
+        [(ptype, "Coordinates"), (ptype, "Masses"), (ptype, "SmoothingLengths")],
+        missing="skip",
+    )
+    x = data[(ptype, "Coordinates")]
+    m = data[(ptype, "Masses")]
+    h = data.get((ptype, "SmoothingLengths"))
+
+    f = h5py.File(srcfile, "r")
+
+    boxsize, ndim = swift_io.read_box(f, ndim)
+    f.close()
+
+    return x, m, h, boxsize, ndim
+
+
+def write_dataset(group, field, data):
+    """
+    Write data into the group, replacing the existing dataset under
+    either SWIFT naming convention, or creating one with the IC
+    naming convention.
+    """
+
+    dtype = group["Coordinates"].dtype
+    try:
+        name = swift_io.resolve_field(group, field)
+        dtype = group[name].dtype
+        del group[name]
+    except KeyError:
+        # IC files use the old names
+        names = {v: k for k, v in swift_io.field_aliases.items()}
+        name = names.get(field, field)
+
+    group.create_dataset(name, data=data.astype(dtype))
+
+    return name
+
+
+def main():
+
+    args = getargs()
+
+    x, m, h_old, boxsize, ndim = read_file(args.filename, args.ptype, args.ndim)
+
+    h, rho, nfailed = swift_sph.solve_smoothing_lengths(
+        x,
+        m,
+        boxsize=boxsize if args.periodic else None,
+        ndim=ndim,
+        kernel=args.kernel,
+        eta=args.eta,
+        h_init=h_old,
+        tolerance=args.tolerance,
+        max_iterations=args.max_iter,
+        workers=args.workers,
+        verbose=True,
+    )
+
+    if nfailed > 0:
+        print("WARNING:", nfailed, "particles didn't converge")
+
+    print("{0:10} | {1:>12} {2:>12} {3:>12}".format("", "min", "median", "max"))
+    print("------------------------------------------------------")
+    for name, arr in [("h", h), ("rho", rho)]:
+        print(
+            "{0:10} | {1:12.4e} {2:12.4e} {3:12.4e}".format(
+                name, arr.min(), np.median(arr), arr.max()
+            )
+        )
+
+    if args.write:
+        with h5py.File(args.filename, "r+") as f:
+            group = f[args.ptype]
+            hname = write_dataset(group, "SmoothingLengths", h)
+            rhoname = write_dataset(group, "Densities", rho)
+        print("Written", hname, "and", rhoname, "to", args.filename)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
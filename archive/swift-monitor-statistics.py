@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Watch statistics.txt while a run is
+# going and warn when mass or energy
+# conservation drifts too far.
+# usage:
+#   swift-monitor-statistics.py [statistics.txt] [--threshold energy 1e-3]
+#       [--hook "notify-send drift"] [--exit-on-alert] [--once]
+# =====================================
+
+
+import argparse
+import os
+import subprocess
+import time
+
+import numpy as np
+
+import swift_statistics
+
+
+# monitored quantity -> statistics columns summed up for it
+quantities = {
+    "total_mass": ["total_mass"],
+    "gas_mass": ["gas_mass"],
+    "star_mass": ["star_mass"],
+    "sink_mass": ["sink_mass"],
+    "bh_mass": ["bh_mass"],
+    "energy": ["kin_energy", "int_energy", "pot_energy"],
+}
+
+# default alert thresholds on the relative error. Gas, star, sink and
+# BH masses are exchanged between each other, so they are only
+# reported unless a threshold is given.
+thresholds_default = {"total_mass": 1e-4, "energy": 1e-2}
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to monitor mass and energy conservation of a
+        running simulation by tailing its statistics.txt. Each poll
+        only parses the rows appended since the previous one. For
+        total, gas, star, sink and BH mass and E_kin + E_int + E_pot
+        the relative error |X - X_0| / |X_0| and its drift rate per
+        unit time are printed. Masses which start at zero are
+        compared to the initial total mass, and an energy which
+        starts at zero to the sum of the absolute initial energies.
+        When an error crosses its threshold, an alert is printed, a
+        hook command is run, and optionally the monitor exits.
+        """
+    )
+
+    parser.add_argument(
+        "filename",
+        nargs="?",
+        default="statistics.txt",
+        help="Statistics file to monitor. Default=statistics.txt",
+    )
+    parser.add_argument(
+        "--threshold",
+        dest="thresholds",
+        nargs=2,
+        action="append",
+        metavar=("QUANTITY", "TOL"),
+        default=None,
+        help="Alert when the relative error of QUANTITY exceeds TOL. "
+        "QUANTITY is one of {0}. Can be repeated. Default: {1}".format(
+            ", ".join(quantities.keys()),
+            ", ".join("{0} {1:g}".format(k, v) for k, v in thresholds_default.items()),
+        ),
+    )
+    parser.add_argument(
+        "--interval",
+        dest="interval",
+        type=float,
+        action="store",
+        default=10.0,
+        help="Seconds between polls. Default=10",
+    )
+    parser.add_argument(
+        "--hook",
+        dest="hook",
+        action="store",
+        default=None,
+        help="Shell command to run on an alert. It gets the quantity, its "
+        "error, the threshold, time and step in the environment variables "
+        "SWIFT_MONITOR_QUANTITY, _ERROR, _THRESHOLD, _TIME and _STEP",
+    )
+    parser.add_argument(
+        "--exit-on-alert",
+        dest="exit_on_alert",
+        action="store_true",
+        help="Exit with code 1 on the first alert",
+    )
+    parser.add_argument(
+        "--once",
+        dest="once",
+        action="store_true",
+        help="Check the file once and exit, with code 1 if any threshold "
+        "was crossed",
+    )
+
+    args = parser.parse_args()
+
+    thresholds = dict(thresholds_default)
+    if args.thresholds is not None:
+        for name, tol in args.thresholds:
+            if name not in quantities:
+                print("Unknown quantity '", name, "'; use one of", list(quantities))
+                quit(2)
+            thresholds[name] = float(tol)
+    args.thresholds = thresholds
+
+    if args.once and not os.path.isfile(args.filename):
+        print("Given filename, '", args.filename, "' is not a file.")
+        quit(2)
+
+    return args
+
+
+class ConservationMonitor(object):
+    """
+    Running conservation errors of a statistics file which is being
+    appended to. Only the first row, the last row of the previous
+    poll and the maximal errors are kept, so each poll costs only as
+    much as the rows added since the previous one.
+    """
+
+    def __init__(self, filename, thresholds):
+        self.filename = filename
+        self.thresholds = thresholds
+        self.reset()
+
+        return
+
+    def reset(self):
+        """
+        Start over from the beginning of the file, e.g. when it was
+        replaced.
+        """
+
+        self.offset = None
+        self.inode = None
+        self.columns = None
+        self.nrows = 0
+        self.initial = None
+        self.scale = None
+        self.previous = None
+        self.max_error = {name: 0.0 for name in quantities}
+        self.alerted = set()
+
+        return
+
+    def read_header(self):
+        """
+        Read the header and find the columns to monitor. Returns
+        False if the file doesn't have a complete header yet.
+        """
+
+        try:
+            names, _, _, offset = swift_statistics.read_header(self.filename)
+        except (OSError, ValueError):
+            return False
+        if "time" not in names or "step" not in names:
+            return False
+
+        # columns: step, time, then each quantity's columns
+        self.columns = [names.index("step"), names.index("time")]
+        self.slices = {}
+        for name, cols in quantities.items():
+            if all(c in names for c in cols):
+                start = len(self.columns)
+                self.columns.extend(names.index(c) for c in cols)
+                self.slices[name] = slice(start, len(self.columns))
+        self.offset = offset
+        self.inode = os.stat(self.filename).st_ino
+
+        return True
+
+    def values(self, rows):
+        """
+        Get the monitored quantities of an array of rows.
+        """
+
+        return {name: rows[:, sl].sum(axis=1) for name, sl in self.slices.items()}
+
+    def poll(self):
+        """
+        Read the rows added since the last poll and update the
+        errors. Returns the list of new alerts as (quantity, error,
+        threshold, time, step).
+        """
+
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return []
+        if self.offset is not None and (
+            st.st_ino != self.inode or st.st_size < self.offset
+        ):
+            print("File", self.filename, "was replaced, starting over")
+            self.reset()
+        if self.offset is None and not self.read_header():
+            return []
+
+        rows, self.offset = swift_statistics.read_columns(
+            self.filename, self.columns, self.offset
+        )
+        if rows.shape[0] == 0:
+            return []
+        self.nrows += rows.shape[0]
+        values = self.values(rows)
+
+        if self.initial is None:
+            self.initial = {name: val[0] for name, val in values.items()}
+            self.scale = {}
+            for name, val in self.initial.items():
+                if val != 0.0:
+                    self.scale[name] = abs(val)
+                elif name == "energy":
+                    sl = self.slices["energy"]
+                    self.scale[name] = np.abs(rows[0, sl]).sum()
+                else:
+                    self.scale[name] = abs(self.initial.get("total_mass", 0.0))
+            self.previous = (rows[0, 1], {name: 0.0 for name in values})
+
+        alerts = []
+        errors = {}
+        for name, val in values.items():
+            if self.scale[name] == 0.0:
+                err = np.zeros(val.shape)
+            else:
+                err = np.abs(val - self.initial[name]) / self.scale[name]
+            errors[name] = err[-1]
+            self.max_error[name] = max(self.max_error[name], err.max())
+
+            tol = self.thresholds.get(name)
+            if tol is None:
+                continue
+            above = np.flatnonzero(err > tol)
+            if above.shape[0] > 0 and name not in self.alerted:
+                i = above[0]
+                alerts.append((name, err[i], tol, rows[i, 1], int(rows[i, 0])))
+                self.alerted.add(name)
+            elif above.shape[0] == 0 or err[-1] <= tol:
+                # re-arm once the error is back below the threshold
+                self.alerted.discard(name)
+
+        self.report(rows[-1, 0], rows[-1, 1], rows.shape[0], errors)
+        self.previous = (rows[-1, 1], errors)
+
+        return alerts
+
+    def report(self, step, t, nnew, errors):
+        """
+        Print the current errors and their drift rates since the
+        previous poll.
+        """
+
+        t_prev, errors_prev = self.previous
+        dt = t - t_prev
+
+        print(
+            "step {0:d} t = {1:.6e}: {2:d} new rows, {3:d} total".format(
+                int(step), t, nnew, self.nrows
+            )
+        )
+        for name, err in errors.items():
+            if dt > 0.0:
+                rate = "{0:+.3e}".format((err - errors_prev[name]) / dt)
+            else:
+                rate = "n/a"
+            tol = self.thresholds.get(name)
+            print(
+                "    {0:12s} err {1:.3e}  max {2:.3e}  drift/dt {3:>10s}{4}".format(
+                    name,
+                    err,
+                    self.max_error[name],
+                    rate,
+                    "" if tol is None else "  (threshold {0:.1e})".format(tol),
+                )
+            )
+
+        return
+
+
+def run_hook(hook, alert):
+    """
+    Run the alert hook command with the alert in its environment.
+    """
+
+    name, err, tol, t, step = alert
+    env = dict(os.environ)
+    env["SWIFT_MONITOR_QUANTITY"] = name
+    env["SWIFT_MONITOR_ERROR"] = "{0:.6e}".format(err)
+    env["SWIFT_MONITOR_THRESHOLD"] = "{0:.6e}".format(tol)
+    env["SWIFT_MONITOR_TIME"] = "{0:.6e}".format(t)
+    env["SWIFT_MONITOR_STEP"] = str(step)
+    result = subprocess.run(hook, shell=True, env=env)
+    if result.returncode != 0:
+        print("Alert hook exited with code", result.returncode)
+
+    return
+
+
+def main():
+
+    args = getargs()
+    monitor = ConservationMonitor(args.filename, args.thresholds)
+
+    alerted = False
+    while True:
+        for alert in monitor.poll():
+            alerted = True
+            name, err, tol, t, step = alert
+            print(
+                "ALERT: {0} error {1:.3e} exceeds {2:.1e} at step {3:d}, "
+                "t = {4:.6e}".format(name, err, tol, step, t)
+            )
+            if args.hook is not None:
+                run_hook(args.hook, alert)
+            if args.exit_on_alert:
+                quit(1)
+
+        if args.once:
+            if monitor.offset is None:
+                print("'", args.filename, "' has no statistics header")
+                quit(2)
+            quit(1 if alerted else 0)
+
+        try:
+            time.sleep(args.interval)
+        except KeyboardInterrupt:
+            break
+
+    return
+
+
+if __name__ == "__main__":
+    main()
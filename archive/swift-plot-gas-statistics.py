@@ -2,10 +2,13 @@
 
 # Reads in "statistics.txt" and plots gas mass and energies over time.
 
-from swiftsimio import load_statistics
+from swift_statistics import load_statistics
+import swift_downsample
 from matplotlib import pyplot as plt
 
-data = load_statistics("statistics.txt")
+data = load_statistics(
+    "statistics.txt", ["time", "gas_mass", "kin_energy", "int_energy", "pot_energy"]
+)
 
 times = data.time
 mass = data.gas_mass
@@ -17,11 +20,11 @@ etot = ekin + eu + epot
 
 fig = plt.figure(figsize=(8, 4), dpi=200)
 ax = fig.add_subplot(111)
-ax.plot(times, mass, "r--", label="gas mass")
-ax.plot(times, etot, "b", label="E_kin + E_int + E_pot")
-ax.plot(times, ekin, ":", label="E_kin", alpha=0.6)
-ax.plot(times, eu, ":", label="E_int", alpha=0.6)
-ax.plot(times, epot, ":", label="E_pot", alpha=0.6)
+swift_downsample.plot(ax, times, mass, "r--", label="gas mass")
+swift_downsample.plot(ax, times, etot, "b", label="E_kin + E_int + E_pot")
+swift_downsample.plot(ax, times, ekin, ":", label="E_kin", alpha=0.6)
+swift_downsample.plot(ax, times, eu, ":", label="E_int", alpha=0.6)
+swift_downsample.plot(ax, times, epot, ":", label="E_pot", alpha=0.6)
 ax.legend()
 ax.set_xlabel("Time")
 ax.set_ylabel("Energies")
@@ -2,10 +2,14 @@
 
 # Reads in "statistics.txt" and plots all masses over time.
 
-from swiftsimio import load_statistics
+from swift_statistics import load_statistics
+import swift_downsample
 from matplotlib import pyplot as plt
 
-data = load_statistics("statistics.txt")
+data = load_statistics(
+    "statistics.txt",
+    ["time", "total_mass", "gas_mass", "star_mass", "sink_mass", "bh_mass"],
+)
 
 plotkwargs = {"linestyle": "--", "alpha": 0.6}
 
@@ -39,14 +43,14 @@ if mbh.any():
 fig = plt.figure(figsize=(8, 4), dpi=200)
 ax = fig.add_subplot(111)
 if has_gas:
-    ax.plot(times, mgas, label="gas", **plotkwargs)
+    swift_downsample.plot(ax, times, mgas, label="gas", **plotkwargs)
 if has_stars:
-    ax.plot(times, mstars, label="stars", **plotkwargs)
+    swift_downsample.plot(ax, times, mstars, label="stars", **plotkwargs)
 if has_sinks:
-    ax.plot(times, msinks, label="sinks", **plotkwargs)
+    swift_downsample.plot(ax, times, msinks, label="sinks", **plotkwargs)
 if has_bh:
-    ax.plot(times, mbh, label="BH", **plotkwargs)
-ax.plot(times, mtot, "r", label="total mass")
+    swift_downsample.plot(ax, times, mbh, label="BH", **plotkwargs)
+swift_downsample.plot(ax, times, mtot, "r", label="total mass")
 ax.legend()
 ax.set_xlabel("Time")
 ax.set_ylabel("Masses")
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Overlay the mass and energy histories
+# of many runs, e.g. of a parameter
+# study, and tabulate their final
+# conservation errors.
+# usage:
+#   swift-plot-statistics-runs.py "runs/*" [-o runs_statistics.png]
+# =====================================
+
+
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+from matplotlib import pyplot as plt
+
+from swift_statistics import load_statistics
+
+
+columns = [
+    "time",
+    "total_mass",
+    "gas_mass",
+    "star_mass",
+    "kin_energy",
+    "int_energy",
+    "pot_energy",
+]
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to compare the statistics.txt of many runs. Runs
+        are loaded concurrently, interpolated onto a common time
+        grid and their total mass, gas mass and total energy
+        E_kin + E_int + E_pot drawn on shared axes, together with
+        the relative errors |1 - X_0 / X| of total mass and energy.
+        A table of the final errors per run is printed and written
+        next to the figure.
+        """
+    )
+
+    parser.add_argument(
+        "runs",
+        nargs="+",
+        help="Run directories holding a statistics.txt, or the statistics "
+        "files themselves. Glob patterns are expanded; quote them.",
+    )
+    parser.add_argument(
+        "--ngrid",
+        dest="ngrid",
+        type=int,
+        action="store",
+        default=2000,
+        help="Number of points of the common time grid. Default=2000",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of processes to load runs with. Default: all cores",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="outfile",
+        action="store",
+        default="runs_statistics.png",
+        help="Output figure. The table is written to the same name with "
+        ".txt. Default=runs_statistics.png",
+    )
+
+    args = parser.parse_args()
+
+    files = []
+    for pattern in args.runs:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            matches = [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                fname = os.path.join(match, "statistics.txt")
+                if not os.path.isfile(fname):
+                    print("No statistics.txt in '", match, "'; skipping it.")
+                    continue
+            elif match == pattern or os.path.basename(match) == "statistics.txt":
+                # files named explicitly, or statistics files matched
+                fname = match
+                if not os.path.isfile(fname):
+                    print("Given filename, '", fname, "' is not a file; skipping it.")
+                    continue
+            else:
+                # other files a pattern matches, e.g. figures
+                continue
+            files.append(fname)
+    args.files = list(dict.fromkeys(files))
+
+    if len(args.files) == 0:
+        print("Found no statistics files to compare.")
+        quit(2)
+
+    return args
+
+
+def run_name(fname):
+    """
+    Get a label for a run: its directory, or the file name if the
+    statistics file was given without one.
+    """
+
+    dirname = os.path.dirname(fname)
+    if dirname == "":
+        return fname
+    return os.path.relpath(dirname)
+
+
+def load_run(fname):
+    """
+    Worker: load the columns needed of a run's statistics. Returns
+    a dict of plain arrays and a dict of their units.
+    """
+
+    data = load_statistics(fname, columns)
+    values = {}
+    units = {}
+    for name in columns:
+        arr = getattr(data, name)
+        values[name] = np.array(arr.value, dtype=np.float64)
+        units[name] = arr.units
+
+    return values, units
+
+
+def relative_error(x):
+    """
+    Get |1 - X_0 / X| as printed by the single run statistics scripts.
+    """
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.abs(1.0 - x[0] / x)
+
+
+def main():
+
+    args = getargs()
+    nruns = len(args.files)
+    names = [run_name(f) for f in args.files]
+
+    print("Loading", nruns, "runs")
+    with ProcessPoolExecutor(max_workers=max(min(args.nproc, nruns), 1)) as pool:
+        runs = list(pool.map(load_run, args.files))
+
+    # convert everything to the units of the first run
+    ref_units = runs[0][1]
+    series = []
+    for values, units in runs:
+        for name in columns:
+            if units[name] != ref_units[name]:
+                values[name] = (values[name] * units[name]).to(ref_units[name]).value
+        series.append(
+            {
+                "time": values["time"],
+                "total mass": values["total_mass"],
+                "gas mass": values["gas_mass"],
+                "star mass": values["star_mass"],
+                "energy": values["kin_energy"]
+                + values["int_energy"]
+                + values["pot_energy"],
+            }
+        )
+
+    # common time grid over all runs; runs aren't extrapolated
+    tmin = min(s["time"][0] for s in series if s["time"].shape[0] > 0)
+    tmax = max(s["time"][-1] for s in series if s["time"].shape[0] > 0)
+    grid = np.linspace(tmin, tmax, args.ngrid)
+
+    quantities = ["total mass", "gas mass", "star mass", "energy"]
+    gridded = {q: np.full((nruns, args.ngrid), np.nan) for q in quantities}
+    errors = {q: np.full((nruns, args.ngrid), np.nan) for q in ["total mass", "energy"]}
+    for r, s in enumerate(series):
+        if s["time"].shape[0] == 0:
+            continue
+        for q in quantities:
+            gridded[q][r] = np.interp(grid, s["time"], s[q], left=np.nan, right=np.nan)
+        for q in errors:
+            errors[q][r] = np.interp(
+                grid, s["time"], relative_error(s[q]), left=np.nan, right=np.nan
+            )
+
+    fig = plt.figure(figsize=(12, 8), dpi=200)
+    axes = [fig.add_subplot(2, 2, i + 1) for i in range(4)]
+    colors = plt.get_cmap("viridis")(np.linspace(0.0, 0.9, nruns))
+    plotkwargs = {"alpha": 0.8, "linewidth": 1.0}
+
+    for r in range(nruns):
+        label = names[r] if nruns <= 12 else None
+        axes[0].plot(grid, gridded["total mass"][r], color=colors[r], **plotkwargs)
+        axes[0].plot(grid, gridded["gas mass"][r], "--", color=colors[r], **plotkwargs)
+        if np.nanmax(np.abs(gridded["star mass"][r]), initial=0.0) > 0.0:
+            axes[0].plot(
+                grid, gridded["star mass"][r], ":", color=colors[r], **plotkwargs
+            )
+        axes[1].plot(grid, gridded["energy"][r], color=colors[r], **plotkwargs)
+        axes[2].plot(
+            grid, errors["total mass"][r], color=colors[r], label=label, **plotkwargs
+        )
+        axes[3].plot(grid, errors["energy"][r], color=colors[r], **plotkwargs)
+
+    axes[0].set_ylabel("Masses (solid: total, dashed: gas, dotted: stars)")
+    axes[1].set_ylabel("E_kin + E_int + E_pot")
+    axes[2].set_ylabel("| 1 - M_tot_initial / M_tot |")
+    axes[3].set_ylabel("| 1 - E_tot_initial / E_tot |")
+    for ax in axes[2:]:
+        ax.set_yscale("log")
+    for ax in axes:
+        ax.set_xlabel("Time")
+    if nruns <= 12:
+        axes[2].legend(fontsize=6)
+
+    plt.tight_layout()
+    plt.savefig(args.outfile)
+    plt.close(fig)
+    print("Written", args.outfile)
+
+    # final errors from the actual last rows, not the grid
+    header = "{0:<30s} {1:>8s} {2:>12s} {3:>12s} {4:>12s} {5:>12s}".format(
+        "run", "rows", "t_final", "dM_tot", "dM_gas", "dE_tot"
+    )
+    lines = [header]
+    for name, s in zip(names, series):
+        if s["time"].shape[0] == 0:
+            lines.append("{0:<30s} {1:>8d}".format(name, 0))
+            continue
+        lines.append(
+            "{0:<30s} {1:>8d} {2:12.4e} {3:12.4e} {4:12.4e} {5:12.4e}".format(
+                name,
+                s["time"].shape[0],
+                s["time"][-1],
+                relative_error(s["total mass"])[-1],
+                relative_error(s["gas mass"])[-1],
+                relative_error(s["energy"])[-1],
+            )
+        )
+
+    table = "\n".join(lines) + "\n"
+    print(table, end="")
+    tablefile = os.path.splitext(args.outfile)[0] + ".txt"
+    with open(tablefile, "w") as f:
+        f.write(table)
+    print("Written", tablefile)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
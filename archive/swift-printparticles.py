@@ -2,15 +2,22 @@
 
 # =====================================
 # Print out particle data for a swift
-# hdf5 file.
+# hdf5 file, or export it to a binary
+# file.
 # usage:
 #   swift-printparticles.py <fname>
+#   swift-printparticles.py <fname> --format npy --fields Coordinates,Masses
 # =====================================
 
 
 import numpy as np
 import argparse
 import h5py
+import os
+import tempfile
+import zipfile
+
+import swift_io
 
 
 errormsg = """
@@ -24,6 +31,10 @@ tosort = None
 sort_by = None
 for_debug = False
 debugtools = None
+out_format = "txt"
+fields = None
+outfile = None
+chunksize = swift_io.chunksize_default
 
 
 def getargs():
@@ -31,9 +42,6 @@ def getargs():
     Read cmd line args.
     """
 
-    import sys
-    import os
-
     parser = argparse.ArgumentParser(
         description="""
         A program to print particle data.
@@ -69,22 +77,55 @@ def getargs():
         const="grads",
         help='Print the "GradientSum" field only with IDs',
     )
+    parser.add_argument(
+        "--format",
+        dest="out_format",
+        action="store",
+        choices=["txt", "npy", "npz", "raw"],
+        default="txt",
+        help="Output format. 'txt' prints to screen; 'npy' and 'raw' write "
+        "one structured record per particle, 'npz' one array per field. "
+        "Default=txt",
+    )
+    parser.add_argument(
+        "--fields",
+        dest="fields",
+        action="store",
+        default=None,
+        help="Comma separated list of datasets to export with a binary "
+        "--format. ParticleIDs are always included. "
+        "Default=Coordinates,SmoothingLengths,Masses,Densities",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="outfile",
+        action="store",
+        default=None,
+        help="Output file name for a binary --format. "
+        "Default=<fname>-<ptype>.<format>",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        type=int,
+        action="store",
+        default=swift_io.chunksize_default,
+        help="Number of particles to read and write at once for a binary "
+        "--format. Default={0}".format(swift_io.chunksize_default),
+    )
 
     args = parser.parse_args()
 
     global tosort, sort_by, for_debug, debugtools
+    global out_format, fields, outfile, chunksize
 
     fname = args.filename
     tosort = args.tosort
     ptype = args.ptype
 
-    try:
-        fname = sys.argv[1]
-        if not os.path.isfile(fname):
-            print("Given filename, '", fname, "' is not a file.")
-            print(errormsg)
-            quit(2)
-    except IndexError:
+    if not os.path.isfile(fname):
+        print("Given filename, '", fname, "' is not a file.")
         print(errormsg)
         quit(2)
 
@@ -99,6 +140,34 @@ def getargs():
         for_debug = True
         debugtools = args.debugtool
 
+    out_format = args.out_format
+    chunksize = args.chunksize
+    if chunksize <= 0:
+        parser.error("--chunksize must be positive, got {0}".format(chunksize))
+
+    if args.fields is not None:
+        fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+        # fail early on typos, with the available datasets listed
+        with h5py.File(fname, "r") as f:
+            if ptype not in f:
+                parser.error("'{0}' has no group '{1}'".format(fname, ptype))
+            for field in fields:
+                try:
+                    swift_io.resolve_field(f[ptype], field)
+                except KeyError:
+                    parser.error(
+                        "unknown --fields entry '{0}'. {1} in '{2}' has: {3}".format(
+                            field, ptype, fname, ", ".join(sorted(f[ptype].keys()))
+                        )
+                    )
+
+    if out_format != "txt":
+        if args.outfile is None:
+            base, _ = os.path.splitext(fname)
+            outfile = "{0}-{1}.{2}".format(base, ptype, out_format)
+        else:
+            outfile = args.outfile
+
     return fname, ptype
 
 
@@ -107,43 +176,36 @@ def read_file(srcfile, ptype):
     Read swift output hdf5 file.
     """
 
-    import h5py
-
-    f = h5py.File(srcfile)
-
-    x = f[ptype]["Coordinates"][:, 0]
-    y = f[ptype]["Coordinates"][:, 1]
-    z = f[ptype]["Coordinates"][:, 2]
-    m = f[ptype]["Masses"][:]
-    ids = f[ptype]["ParticleIDs"][:]
-
-    try:
-        # old SWIFT header versions
-        rho = f[ptype]["Density"][:]
-    except KeyError:
-        # new SWIFT header versions
-        try:
-            rho = f[ptype]["Densities"][:]
-        except KeyError:
-            print(
-                "This file doesn't have a density dataset (Could be the case for IC files.). Skipping it."
-            )
-            rho = None
-
-    try:
-        # old SWIFT header versions
-        h = f[ptype]["SmoothingLength"][:]
-    except KeyError:
-        # new SWIFT header versions
-        h = f[ptype]["SmoothingLengths"][:]
-
-    if for_debug:
-        if debugtools == "grads":
-            debug_array = f[ptype]["GradientSum"][:]
-    else:
-        debug_array = None
+    requests = [
+        (ptype, "Coordinates"),
+        (ptype, "Masses"),
+        (ptype, "ParticleIDs"),
+        (ptype, "Densities"),
+        (ptype, "SmoothingLengths"),
+    ]
+    if for_debug and debugtools == "grads":
+        requests.append((ptype, "GradientSum"))
+
+    # all datasets in one go; optional ones are skipped if missing.
+    # They are only printed, so contiguous ones are just mapped.
+    data = swift_io.read_fields(srcfile, requests, missing="skip", mmap=True)
+
+    # one read of the coordinates, split into views
+    coords = data[(ptype, "Coordinates")]
+    x = coords[:, 0]
+    y = coords[:, 1]
+    z = coords[:, 2]
+    m = data[(ptype, "Masses")]
+    ids = data[(ptype, "ParticleIDs")]
+    h = data[(ptype, "SmoothingLengths")]
+
+    rho = data.get((ptype, "Densities"))
+    if rho is None:
+        print(
+            "This file doesn't have a density dataset (Could be the case for IC files.). Skipping it."
+        )
 
-    f.close()
+    debug_array = data.get((ptype, "GradientSum"))
 
     return x, y, z, h, rho, m, ids, debug_array
 
@@ -223,9 +285,159 @@ def print_particles(x, y, z, h, rho, m, ids, debug_array):
     return
 
 
+def get_export_fields(group):
+    """
+    Get the list of fields to export for a binary output format.
+    ParticleIDs always come first so the output can be matched to
+    other files.
+    """
+
+    if fields is None:
+        export = ["Coordinates", "SmoothingLengths", "Masses"]
+        try:
+            swift_io.resolve_field(group, "Densities")
+            export.append("Densities")
+        except KeyError:
+            print(
+                "This file doesn't have a density dataset (Could be the case for IC files.). Skipping it."
+            )
+    else:
+        export = list(fields)
+
+    # fail early on typos
+    for field in export:
+        swift_io.resolve_field(group, field)
+
+    return ["ParticleIDs"] + [f for f in export if f != "ParticleIDs"]
+
+
+def export_particles(srcfile, ptype):
+    """
+    Stream particle data from the hdf5 file into a binary file
+    without going through text formatting. Only `chunksize`
+    particles are held in memory at a time, also when sorting.
+    """
+
+    reader = swift_io.SnapshotReader(srcfile)
+    group = reader.file[ptype]
+
+    export = get_export_fields(group)
+    npart = swift_io.npart_in_group(reader.file, ptype)
+    dtype = swift_io.record_dtype(group, export)
+
+    chunks = reader.iter_records(ptype, export, chunksize=chunksize, dtype=dtype)
+    if tosort and sort_by == "ids":
+        chunks = swift_io.external_sort(
+            chunks,
+            "ParticleIDs",
+            chunksize=chunksize,
+            tmpdir=os.path.dirname(os.path.abspath(outfile)),
+        )
+
+    if out_format == "npy":
+        write_npy(chunks, npart, dtype)
+    elif out_format == "npz":
+        write_npz(chunks, npart, dtype)
+    elif out_format == "raw":
+        write_raw(chunks, dtype)
+    else:
+        raise ValueError("Unknown output format '{0}'".format(out_format))
+
+    reader.close()
+
+    print("Written", npart, ptype, "particles with fields", export, "to", outfile)
+
+    return
+
+
+def write_npy(chunks, npart, dtype):
+    """
+    Write a structured .npy file, one record per particle.
+    """
+
+    out = np.lib.format.open_memmap(outfile, mode="w+", dtype=dtype, shape=(npart,))
+    start = 0
+    for chunk in chunks:
+        out[start : start + chunk.shape[0]] = chunk
+        start += chunk.shape[0]
+    out.flush()
+    del out
+
+    return
+
+
+def write_npz(chunks, npart, dtype):
+    """
+    Write an uncompressed .npz file with one array per field. The
+    arrays are first streamed into temporary .npy files which are
+    then packed into the archive.
+    """
+
+    workdir = tempfile.mkdtemp(
+        prefix="swift-export-", dir=os.path.dirname(os.path.abspath(outfile))
+    )
+
+    try:
+        arrays = {}
+        for name in dtype.names:
+            sub, _ = dtype.fields[name]
+            arrays[name] = np.lib.format.open_memmap(
+                os.path.join(workdir, name + ".npy"),
+                mode="w+",
+                dtype=sub.base,
+                shape=(npart,) + sub.shape,
+            )
+
+        start = 0
+        for chunk in chunks:
+            stop = start + chunk.shape[0]
+            for name in dtype.names:
+                arrays[name][start:stop] = chunk[name]
+            start = stop
+
+        for name in dtype.names:
+            arrays[name].flush()
+        arrays = None
+
+        with zipfile.ZipFile(
+            outfile, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True
+        ) as zf:
+            for name in dtype.names:
+                zf.write(os.path.join(workdir, name + ".npy"), arcname=name + ".npy")
+
+    finally:
+        for name in dtype.names:
+            tmpname = os.path.join(workdir, name + ".npy")
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+        os.rmdir(workdir)
+
+    return
+
+
+def write_raw(chunks, dtype):
+    """
+    Write raw structured records without any header. The record
+    layout is printed so the file can be read back with np.fromfile.
+    """
+
+    with open(outfile, "wb") as out:
+        for chunk in chunks:
+            chunk.tofile(out)
+
+    print("Record dtype:", dtype.descr)
+
+    return
+
+
 def main():
 
     fname, ptype = getargs()
+
+    if out_format != "txt":
+        export_particles(fname, ptype)
+        return
+
     x, y, z, h, rho, m, ids, debug_array = read_file(fname, ptype)
 
     print_particles(x, y, z, h, rho, m, ids, debug_array)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Build a multi-resolution pyramid of
+# projected gas maps of a swift output
+# for pan and zoom, or fetch a region
+# of one of its levels.
+# usage:
+#   swift-pyramid.py <snapshot.hdf5> [--levels N] [--tile T] [--dens ...]
+#   swift-pyramid.py <snapshot-pyramid> --level L [--region x0 x1 y0 y1]
+# =====================================
+
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib import colors as mcolors
+
+import swift_pyramid
+
+
+names = {}
+# dict of plotting cases -> array names, as in swift-quickplot.py
+names["mass"] = "masses"
+names["density"] = "densities"
+names["h"] = "smoothing_lengths"
+names["internal energy"] = "internal_energies"
+names["entropy"] = "entropies"
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to build a quadtree pyramid of projected gas maps
+        of a swift output. The finest level is projected tile by tile
+        from the particles overlapping each tile; each coarser level
+        has half the resolution and is averaged from the next finer
+        one. Levels are stored as tiled .npy arrays in a directory,
+        so any level and region can be fetched later without touching
+        the particles. Given a pyramid directory instead of a
+        snapshot, fetch a region of one level and write it to a PNG
+        or .npy file.
+        """
+    )
+
+    parser.add_argument("filename", help="Snapshot, or pyramid directory to read")
+    for flag, case in [
+        ("--mass", "mass"),
+        ("--sl", "h"),
+        ("--dens", "density"),
+        ("--u", "internal energy"),
+        ("--ent", "entropy"),
+    ]:
+        parser.add_argument(
+            flag,
+            dest="to_plot",
+            action="append_const",
+            const=case,
+            default=None,
+            help="project " + case,
+        )
+    parser.add_argument(
+        "--levels",
+        dest="levels",
+        type=int,
+        action="store",
+        default=4,
+        help="Number of pyramid levels. The finest one has tile * 2^(levels-1) "
+        "pixels per side. Default=4",
+    )
+    parser.add_argument(
+        "--tile",
+        dest="tilesize",
+        type=int,
+        action="store",
+        default=256,
+        help="Tile size in pixels; must be even. Default=256",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of processes for the projection. Default: all cores",
+    )
+    parser.add_argument(
+        "--level",
+        dest="level",
+        type=int,
+        action="store",
+        default=0,
+        help="Level to fetch from a pyramid. Default=0",
+    )
+    parser.add_argument(
+        "--region",
+        dest="region",
+        type=float,
+        nargs=4,
+        default=None,
+        metavar=("XMIN", "XMAX", "YMIN", "YMAX"),
+        help="Region to fetch from a pyramid. Default: everything",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        action="store",
+        default=None,
+        help="Output pyramid directory, or PNG or .npy file when fetching. "
+        "Default: <snapshot>-pyramid, or <pyramid>-L<level>.png",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.filename):
+        print("Given filename, '", args.filename, "' is not a file.")
+        quit(2)
+
+    if args.tilesize < 2 or args.tilesize % 2 != 0:
+        print("Tile size must be even, got", args.tilesize)
+        quit(2)
+
+    if args.to_plot is None:
+        args.to_plot = ["mass"]
+    args.to_plot = list(dict.fromkeys(args.to_plot))
+
+    return args
+
+
+def is_pyramid(dirname):
+    """
+    Check whether a directory holds a completely built pyramid.
+    """
+
+    return os.path.isfile(os.path.join(dirname, swift_pyramid.meta_file))
+
+
+def build(args):
+    """
+    Project the snapshot at the finest level and build the pyramid.
+    It is built in a temporary directory next to the output directory
+    and only moved there once complete, so a failed build leaves
+    nothing behind that looks like a pyramid.
+    """
+
+    # imported here so fetching doesn't need swiftsimio
+    from swiftsimio import load
+    from swift_projection import project_gas_fields
+
+    data = load(args.filename)
+    boxsize = data.metadata.boxsize
+    L = boxsize.to(boxsize.units).value
+
+    outdir = args.output
+    if outdir is None:
+        outdir = os.path.splitext(args.filename)[0] + "-pyramid"
+    if os.path.exists(outdir):
+        if not os.path.isdir(outdir) or (
+            len(os.listdir(outdir)) > 0 and not is_pyramid(outdir)
+        ):
+            print("Output '", outdir, "' exists and isn't a pyramid.")
+            quit(2)
+
+    nx = args.tilesize * 2 ** (args.levels - 1)
+    print("Projecting", args.to_plot, "at", nx, "x", nx, "pixels")
+
+    parent = os.path.dirname(os.path.abspath(outdir))
+    os.makedirs(parent, exist_ok=True)
+    builddir = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    # the finest level, row by row, before it is stored tiled
+    fd, mapfile = tempfile.mkstemp(suffix=".npy", dir=builddir)
+    os.close(fd)
+    try:
+        maps, units = project_gas_fields(
+            data,
+            [names[p] for p in args.to_plot],
+            nx,
+            tilesize=args.tilesize,
+            outfile=mapfile,
+            nproc=args.nproc,
+        )
+        swift_pyramid.build_pyramid(
+            builddir,
+            maps,
+            (0.0, L[0], 0.0, L[1]),
+            args.tilesize,
+            fields=args.to_plot,
+            units=units,
+        )
+        del maps
+        os.remove(mapfile)
+
+        # replace an older pyramid
+        if os.path.isdir(outdir):
+            shutil.rmtree(outdir)
+        os.rename(builddir, outdir)
+    finally:
+        if os.path.isdir(builddir):
+            shutil.rmtree(builddir, ignore_errors=True)
+
+    print("Written pyramid with", args.levels, "levels to", outdir)
+
+    return
+
+
+def fetch(args):
+    """
+    Fetch a region of a pyramid level and write it out.
+    """
+
+    meta = swift_pyramid.load_meta(args.filename)
+    maps, extent = swift_pyramid.fetch(
+        args.filename, args.level, region=args.region, meta=meta
+    )
+
+    outfile = args.output
+    if outfile is None:
+        outfile = args.filename.rstrip("/") + "-L{0}.png".format(args.level)
+
+    if outfile.endswith(".npy"):
+        np.save(outfile, maps)
+        print("Written", maps.shape, "maps to", outfile)
+        return
+
+    fig = plt.figure(figsize=(7 * len(meta["fields"]), 6))
+    for f, field in enumerate(meta["fields"]):
+        ax = fig.add_subplot(1, len(meta["fields"]), f + 1, aspect="equal")
+        im = ax.imshow(
+            maps[f].T,
+            origin="lower",
+            cmap="YlGnBu_r",
+            extent=extent,
+            norm=mcolors.SymLogNorm(1e-6),
+        )
+        cb = fig.colorbar(im, ax=ax, fraction=0.046, pad=0.01)
+        cb.ax.set_ylabel(field + " [" + meta["units"][f] + "]")
+        ax.set_title("level {0}".format(args.level))
+        ax.set_xlabel("x")
+        ax.set_ylabel("y")
+
+    fig.savefig(outfile, dpi=200)
+    plt.close(fig)
+    print("Written", outfile)
+
+    return
+
+
+def main():
+
+    args = getargs()
+
+    if os.path.isdir(args.filename):
+        if not is_pyramid(args.filename):
+            print("Given directory, '", args.filename, "' is not a pyramid.")
+            quit(2)
+        fetch(args)
+    else:
+        build(args)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
 
 #  from matplotlib import colors as mcolors
 
@@ -15,6 +16,9 @@ import argparse
 
 from swiftsimio import load
 
+import swift_io
+import swift_raster
+
 
 # Plot parameters
 params = {
@@ -47,6 +51,9 @@ def getargs():
         description="""
         A program to quickly plot swift outputs.
         Will plot position scatter plot along z axis.
+        Particles are binned per type into a pixel grid
+        and shaded by their number density, so any number
+        of particles renders quickly.
         """
     )
 
@@ -62,18 +69,45 @@ def getargs():
         default=False,
         help="Add a legend to the plot",
     )
+    parser.add_argument(
+        "--nx",
+        dest="nx",
+        type=int,
+        action="store",
+        default=1024,
+        help="Image pixel resolution. Default=1024",
+    )
+    parser.add_argument(
+        "--shading",
+        dest="shading",
+        action="store",
+        choices=["log", "eq"],
+        default="log",
+        help="Shade pixels by the log of their particle counts, or by "
+        "histogram equalisation. Default=log",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        type=int,
+        action="store",
+        default=swift_io.chunksize_default,
+        help="Number of particles to read at once. Default={0}".format(
+            swift_io.chunksize_default
+        ),
+    )
 
     args = parser.parse_args()
 
     infile = args.filename
     draw_legend = args.legend
 
-    return infile, draw_legend
+    return infile, draw_legend, args
 
 
 def main():
 
-    infile, draw_legend = getargs()
+    infile, draw_legend, args = getargs()
 
     data = load(infile)
     meta = data.metadata
@@ -99,39 +133,27 @@ def main():
     fig = plt.figure(figsize=figsize)
     ax = fig.add_subplot(111, aspect="equal")
 
-    PPN = meta.present_particle_names
+    # bin each particle type in chunks straight from the file
+    grids, _ = swift_raster.file_count_grids(
+        infile, args.nx, args.nx, chunksize=args.chunksize
+    )
+
     handles = []
-    if "dark_matter" in PPN:
-        h1 = ax.scatter(
-            data.dark_matter.coordinates[:, 0],
-            data.dark_matter.coordinates[:, 1],
-            fc="red",
-            label="DM",
-            alpha=0.5,
-        )
-        handles.append(h1)
-    if "gas" in PPN:
-        h2 = ax.scatter(
-            data.gas.coordinates[:, 0],
-            data.gas.coordinates[:, 1],
-            fc="blue",
-            label="gas",
-            alpha=0.5,
-        )
-        handles.append(h2)
-    if "stars" in PPN:
-        h3 = ax.scatter(
-            data.stars.coordinates[:, 0],
-            data.stars.coordinates[:, 1],
-            fc="gold",
-            label="stars",
-            alpha=0.5,
-        )
-        handles.append(h3)
+    layers = []
+    for name, color, counts in grids:
+        layers.append((color, swift_raster.shade(counts, args.shading)))
+        handles.append(Patch(fc=color, label=name))
 
     if len(handles) == 0:
         raise ValueError("Nothing to plot? No stars, gas, or DM?")
 
+    ax.imshow(
+        swift_raster.composite(layers),
+        origin="lower",
+        extent=(0.0, boxsize[0], 0.0, boxsize[1]),
+        interpolation="nearest",
+    )
+
     if draw_legend:
         fig.legend(handles=handles, loc="upper right")
 
@@ -11,9 +11,15 @@ from matplotlib import colors as mcolors
 
 import subprocess
 import argparse
+import os
 
 from swiftsimio import load
-from swiftsimio.visualisation.projection import project_gas
+
+from swift_projection import (
+    cache_max_default,
+    project_gas_fields,
+    project_gas_fields_cached,
+)
 
 
 infile = None
@@ -61,6 +67,9 @@ def getargs():
         description="""
         A program to quickly plot swift outputs.
         Will plot mass projection along z axis as default.
+        Several fields can be given at once; they are all
+        projected in a single pass over the particles, and
+        each is written to its own image.
         """
     )
 
@@ -69,49 +78,49 @@ def getargs():
     parser.add_argument(
         "--mass",
         dest="to_plot",
-        action="store_const",
+        action="append_const",
         const="mass",
-        default="mass",
+        default=None,
         help="project mass",
     )
     parser.add_argument(
         "--sl",
         dest="to_plot",
-        action="store_const",
+        action="append_const",
         const="h",
-        default="mass",
+        default=None,
         help="project smoothing length",
     )
     parser.add_argument(
         "--dens",
         dest="to_plot",
-        action="store_const",
+        action="append_const",
         const="density",
-        default="mass",
+        default=None,
         help="project mass density",
     )
     parser.add_argument(
         "--rho",
         dest="to_plot",
-        action="store_const",
+        action="append_const",
         const="density",
-        default="mass",
+        default=None,
         help="project mass density",
     )
     parser.add_argument(
         "--u",
         dest="to_plot",
-        action="store_const",
+        action="append_const",
         const="internal energy",
-        default="mass",
+        default=None,
         help="project internal energy",
     )
     parser.add_argument(
         "--ent",
         dest="to_plot",
-        action="store_const",
+        action="append_const",
         const="entropy",
-        default="mass",
+        default=None,
         help="project entropy",
     )
     #  parser.add_argument('--pt',
@@ -132,19 +141,92 @@ def getargs():
         default=nx_default,
         help="Image pixel resolution.",
     )
+    parser.add_argument(
+        "--tile",
+        dest="tilesize",
+        type=int,
+        action="store",
+        default=None,
+        help="Project the image in tiles of this many pixels per side, "
+        "writing the maps to a memory-mapped .npy file and one PNG per "
+        "tile instead of a single figure. Use this for very large --nx.",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of processes for tiled projections. Default: all cores",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="Don't use or store cached projections. By default, projected "
+        "maps are cached, so re-plotting the same snapshot, fields and "
+        "resolution only redoes the plotting.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=float,
+        action="store",
+        default=cache_max_default / 2**30,
+        help="Max size of the projection cache in GB; least recently used "
+        "maps are evicted first. Default={0:g}".format(cache_max_default / 2**30),
+    )
 
     args = parser.parse_args()
 
     infile = args.filename
     to_plot = args.to_plot
+    if to_plot is None:
+        to_plot = ["mass"]
+    # drop duplicates, e.g. from --dens --rho
+    to_plot = list(dict.fromkeys(to_plot))
     nx = args.nx
 
-    return infile, to_plot, nx
+    return infile, to_plot, nx, args
+
+
+def write_tile_images(mymap, outdir, tilesize):
+    """
+    Write a (memory-mapped) map as one PNG per tile into outdir,
+    using the same colormap and a common color scale for all tiles.
+    Only one tile is held in memory at a time. Files are named
+    tile_x<i>_y<j>.png, with y counted from the bottom.
+    """
+
+    os.makedirs(outdir, exist_ok=True)
+    nx, ny = mymap.shape
+
+    vmin = np.inf
+    vmax = -np.inf
+    for i0 in range(0, nx, tilesize):
+        rows = np.asarray(mymap[i0 : i0 + tilesize])
+        vmin = min(vmin, rows.min())
+        vmax = max(vmax, rows.max())
+
+    norm = mcolors.SymLogNorm(1e-6, vmin=vmin, vmax=vmax)
+    cmap = plt.get_cmap("YlGnBu_r")
+
+    for i0 in range(0, nx, tilesize):
+        for j0 in range(0, ny, tilesize):
+            tile = np.asarray(mymap[i0 : i0 + tilesize, j0 : j0 + tilesize])
+            # image rows go from top to bottom
+            rgba = cmap(norm(tile.T[::-1]))
+            fname = "tile_x{0:04d}_y{1:04d}.png".format(i0 // tilesize, j0 // tilesize)
+            plt.imsave(os.path.join(outdir, fname), rgba)
+
+    return
 
 
 def main():
 
-    infile, to_plot, nx = getargs()
+    infile, to_plot, nx, args = getargs()
+    tilesize = args.tilesize
 
     data = load(infile)
     meta = data.metadata
@@ -163,45 +245,76 @@ def main():
     except AttributeError:
         no_time = True
 
-    mymap = project_gas(data, resolution=nx, project=names[to_plot], parallel=True)
-
-    fig = plt.figure(figsize=(7, 6))
-    ax = fig.add_subplot(111, aspect="equal")
-
-    im = ax.imshow(
-        mymap.value.T,
-        origin="lower",
-        cmap="YlGnBu_r",
-        extent=(0, boxsize.value[0], 0, boxsize.value[1]),
-        norm=mcolors.SymLogNorm(1e-6),
-    )
-
-    cb = fig.colorbar(im, fraction=0.046, pad=0.01)
-    cb.ax.set_ylabel(to_plot + " [$" + mymap.units.latex_repr + "$]")
-
-    title = r"\verb|{}|".format(infile)
-    if no_redshift and no_time:
-        pass
-    elif no_redshift:
-        title += "; t= {1:.3e}".format(time)
-    elif no_time:
-        title += "; z = {0:.3f}".format(redshift)
-    else:
-        title += "; z = {0:.3f}, t= {1:.3e}".format(redshift, time)
-
-    ax.set_title(title)
-    ax.set_xlabel("x [{}]".format(boxsize.units))
-    ax.set_ylabel("y [{}]".format(boxsize.units))
-
     if infile[-5:] == ".hdf5":
-        outfile = infile.replace(".hdf5", "")
+        outbase = infile.replace(".hdf5", "")
     elif infile[-3:] == ".h5":
-        outfile = infile.replace(".h5", "")
-    outfile += "-{}.png".format(names[to_plot])
-
-    plt.savefig(outfile, dpi=200)
-
-    subprocess.run(["eog", outfile])
+        outbase = infile.replace(".h5", "")
+
+    if tilesize is not None:
+        mapfile = outbase + "-maps.npy"
+        maps, units = project_gas_fields(
+            data,
+            [names[p] for p in to_plot],
+            nx,
+            tilesize=tilesize,
+            outfile=mapfile,
+            nproc=args.nproc,
+        )
+        print("Written maps of", to_plot, "to", mapfile)
+        for mymap, map_units, plot_case in zip(maps, units, to_plot):
+            outdir = outbase + "-{}-tiles".format(names[plot_case])
+            write_tile_images(mymap, outdir, tilesize)
+            print("Written", plot_case, "[" + str(map_units) + "] tiles to", outdir)
+        return
+
+    # all requested fields in one pass over the particles
+    if args.cache:
+        maps, units = project_gas_fields_cached(
+            data,
+            [names[p] for p in to_plot],
+            nx,
+            max_bytes=int(args.cache_size * 2**30),
+        )
+    else:
+        maps, units = project_gas_fields(data, [names[p] for p in to_plot], nx)
+
+    outfiles = []
+    for mymap, map_units, plot_case in zip(maps, units, to_plot):
+
+        fig = plt.figure(figsize=(7, 6))
+        ax = fig.add_subplot(111, aspect="equal")
+
+        im = ax.imshow(
+            mymap.T,
+            origin="lower",
+            cmap="YlGnBu_r",
+            extent=(0, boxsize.value[0], 0, boxsize.value[1]),
+            norm=mcolors.SymLogNorm(1e-6),
+        )
+
+        cb = fig.colorbar(im, fraction=0.046, pad=0.01)
+        cb.ax.set_ylabel(plot_case + " [$" + map_units.latex_repr + "$]")
+
+        title = r"\verb|{}|".format(infile)
+        if no_redshift and no_time:
+            pass
+        elif no_redshift:
+            title += "; t= {1:.3e}".format(time)
+        elif no_time:
+            title += "; z = {0:.3f}".format(redshift)
+        else:
+            title += "; z = {0:.3f}, t= {1:.3e}".format(redshift, time)
+
+        ax.set_title(title)
+        ax.set_xlabel("x [{}]".format(boxsize.units))
+        ax.set_ylabel("y [{}]".format(boxsize.units))
+
+        outfile = outbase + "-{}.png".format(names[plot_case])
+        plt.savefig(outfile, dpi=200)
+        plt.close(fig)
+        outfiles.append(outfile)
+
+    subprocess.run(["eog"] + outfiles)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Render a movie frame for each swift
+# output matching a glob, in parallel,
+# with the same color scale for all of
+# them, and optionally make a video.
+# usage:
+#   swift-render-frames.py "output_*.hdf5" [--scatter] [--movie movie.mp4]
+# =====================================
+
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib import colors as mcolors
+
+import swift_cache
+import swift_raster
+
+
+# plotting cases -> gas array names, as in swift-quickplot.py
+names = {}
+names["mass"] = "masses"
+names["density"] = "densities"
+names["h"] = "smoothing_lengths"
+names["internal energy"] = "internal_energies"
+names["entropy"] = "entropies"
+
+state_file = ".frames-state.json"
+state_version = 2
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to render movie frames of many swift outputs.
+        Frames are projections (as in swift-quickplot.py) or
+        density shaded scatter plots (as in
+        swift-quick-scatterplot.py). A first pass over all
+        snapshots fixes the color scale from the full resolution
+        maps, which are cached on disk for the frames, then frames
+        are rendered by a pool of processes. Frames newer than their
+        snapshot and rendered with the same settings are skipped.
+            """
+    )
+
+    parser.add_argument(
+        "patterns",
+        nargs="+",
+        help="Glob pattern(s) of the snapshots to render. Quote them.",
+    )
+    parser.add_argument(
+        "--scatter",
+        dest="scatter",
+        action="store_true",
+        help="Render particle scatter plots instead of gas projections",
+    )
+    parser.add_argument(
+        "--field",
+        dest="field",
+        action="store",
+        choices=list(names.keys()),
+        default="mass",
+        help="Gas field to project. Default=mass",
+    )
+    parser.add_argument(
+        "--shading",
+        dest="shading",
+        action="store",
+        choices=["log", "eq"],
+        default="log",
+        help="Shading of scatter plots. Default=log",
+    )
+    parser.add_argument(
+        "--nx",
+        dest="nx",
+        type=int,
+        action="store",
+        default=1024,
+        help="Image pixel resolution. Default=1024",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        dest="outdir",
+        action="store",
+        default="frames",
+        help="Directory to write the frames into. Default=frames",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of processes to use. Default: all cores",
+    )
+    parser.add_argument(
+        "--force",
+        dest="force",
+        action="store_true",
+        help="Re-render all frames, even if they are up to date",
+    )
+    parser.add_argument(
+        "--movie",
+        dest="movie",
+        action="store",
+        default=None,
+        help="Also encode the frames into this video file with ffmpeg, if "
+        "it is installed",
+    )
+    parser.add_argument(
+        "--fps",
+        dest="fps",
+        type=int,
+        action="store",
+        default=24,
+        help="Frames per second of the video. Default=24",
+    )
+
+    args = parser.parse_args()
+
+    files = []
+    for pattern in args.patterns:
+        files.extend(glob.glob(pattern))
+    args.files = sorted(set(f for f in files if os.path.isfile(f)))
+
+    if len(args.files) == 0:
+        print("No files match", args.patterns)
+        quit(2)
+
+    return args
+
+
+def frame_names(outdir, files):
+    """
+    Get the frame file name of each snapshot: its basename, or, if
+    snapshots of different directories share a basename, its path
+    below their common directory with "_" instead of separators.
+    """
+
+    bases = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    if len(set(bases)) < len(bases):
+        paths = [os.path.abspath(f) for f in files]
+        common = os.path.commonpath(paths)
+        bases = [
+            os.path.splitext(os.path.relpath(p, common))[0].replace(os.sep, "_")
+            for p in paths
+        ]
+
+    return [os.path.join(outdir, base + ".png") for base in bases]
+
+
+def snapshot_limits(fname, scatter, field, nx):
+    """
+    Worker for the first pass: get the range of values of one
+    snapshot's frame. For projections, this is the range of the
+    positive pixels of the full resolution map, which is kept in the
+    projection cache for render_frame(); a coarser map would miss
+    the peaks, and they would be clipped. For scatter plots, it is
+    the largest particle count per pixel of each type, which is as
+    cheap as the frame.
+    """
+
+    if scatter:
+        grids, _ = swift_raster.file_count_grids(fname, nx, nx)
+        return {name: int(counts.max()) for name, _, counts in grids}
+
+    # imported here so scatter plots don't need swiftsimio
+    from swiftsimio import load
+    from swift_projection import project_gas_fields_cached
+
+    data = load(fname)
+    maps, _ = project_gas_fields_cached(data, [names[field]], nx)
+    positive = maps[0][maps[0] > 0]
+    if positive.shape[0] == 0:
+        return {}
+
+    return {"vmin": float(positive.min()), "vmax": float(positive.max())}
+
+
+def merge_limits(limits):
+    """
+    Combine the per-snapshot value ranges into one color scale.
+    """
+
+    merged = {}
+    for lim in limits:
+        for key, val in lim.items():
+            if key == "vmin":
+                merged[key] = min(merged.get(key, val), val)
+            else:
+                merged[key] = max(merged.get(key, val), val)
+
+    return merged
+
+
+def snapshot_title(fname):
+    """
+    Get a frame title with the snapshot name, time and redshift, as
+    far as they are in the header.
+    """
+
+    title = os.path.basename(fname)
+    with h5py.File(fname, "r") as f:
+        attrs = f["Header"].attrs
+        if "Redshift" in attrs:
+            title += "; z = {0:.3f}".format(float(np.ravel(attrs["Redshift"])[0]))
+        if "Time" in attrs:
+            title += "; t = {0:.3e}".format(float(np.ravel(attrs["Time"])[0]))
+
+    return title
+
+
+def render_frame(fname, outfile, scatter, field, shading, nx, limits):
+    """
+    Worker: render one frame with the given color scale and write it
+    to outfile.
+    """
+
+    fig = plt.figure(figsize=(7, 6))
+    ax = fig.add_subplot(111, aspect="equal")
+
+    if scatter:
+        grids, boxsize = swift_raster.file_count_grids(fname, nx, nx)
+        layers = []
+        for name, color, counts in grids:
+            vmax = limits.get(name) if shading == "log" else None
+            layers.append((color, swift_raster.shade(counts, shading, vmax=vmax)))
+        if len(layers) > 0:
+            ax.imshow(
+                swift_raster.composite(layers),
+                origin="lower",
+                extent=(0.0, boxsize[0], 0.0, boxsize[1]),
+                interpolation="nearest",
+            )
+        ax.set_xlim(0.0, boxsize[0])
+        ax.set_ylim(0.0, boxsize[1])
+
+    else:
+        from swiftsimio import load
+        from swift_projection import project_gas_fields_cached
+
+        data = load(fname)
+        boxsize = data.metadata.boxsize
+        maps, units = project_gas_fields_cached(data, [names[field]], nx)
+
+        cmap = plt.get_cmap("YlGnBu_r").copy()
+        cmap.set_bad(cmap(0.0))
+        if "vmin" in limits:
+            norm = mcolors.LogNorm(vmin=limits["vmin"], vmax=limits["vmax"], clip=True)
+        else:
+            norm = None
+        im = ax.imshow(
+            np.ma.masked_less_equal(maps[0].T, 0.0),
+            origin="lower",
+            cmap=cmap,
+            extent=(0, boxsize.value[0], 0, boxsize.value[1]),
+            norm=norm,
+        )
+        cb = fig.colorbar(im, fraction=0.046, pad=0.01)
+        cb.ax.set_ylabel(field + " [" + str(units[0]) + "]")
+
+    ax.set_title(snapshot_title(fname))
+    ax.set_xlabel("x")
+    ax.set_ylabel("y")
+
+    fig.savefig(outfile, dpi=200)
+    plt.close(fig)
+
+    return outfile
+
+
+def load_state(outdir):
+    """
+    Load the first pass results and the settings each frame was
+    rendered with.
+    """
+
+    fname = os.path.join(outdir, state_file)
+    try:
+        with open(fname, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {"limits": {}, "frames": {}}
+
+    if state.get("version") != state_version:
+        return {"limits": {}, "frames": {}}
+
+    return state
+
+
+def save_state(outdir, state):
+    """
+    Store the state file, via a temporary file.
+    """
+
+    state["version"] = state_version
+    fname = os.path.join(outdir, state_file)
+    tmpname = fname + ".tmp{0}".format(os.getpid())
+    with open(tmpname, "w") as f:
+        json.dump(state, f)
+    os.replace(tmpname, fname)
+
+    return
+
+
+def make_movie(outdir, frames, movie, fps):
+    """
+    Encode the frames into a video with ffmpeg, if available.
+    """
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        print("ffmpeg not found, not making", movie)
+        return
+
+    listfile = os.path.join(outdir, ".frames.txt")
+    with open(listfile, "w") as f:
+        for frame in frames:
+            f.write("file '{0}'\n".format(os.path.abspath(frame)))
+            f.write("duration {0}\n".format(1.0 / fps))
+
+    cmd = [
+        ffmpeg,
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        listfile,
+        "-r",
+        str(fps),
+        "-vf",
+        "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-pix_fmt",
+        "yuv420p",
+        movie,
+    ]
+    subprocess.run(cmd, check=True)
+    os.remove(listfile)
+    print("Written", movie)
+
+    return
+
+
+def main():
+
+    args = getargs()
+
+    os.makedirs(args.outdir, exist_ok=True)
+    state = load_state(args.outdir)
+
+    settings = {
+        "scatter": args.scatter,
+        "field": args.field,
+        "shading": args.shading,
+        "nx": args.nx,
+    }
+    settings_key = json.dumps(settings, sort_keys=True)
+
+    # first pass: value ranges of snapshots we haven't seen yet
+    keys = {
+        fname: swift_cache.hash_key(swift_cache.file_key(fname), settings_key)
+        for fname in args.files
+    }
+    todo = [fname for fname in args.files if keys[fname] not in state["limits"]]
+    if len(todo) > 0:
+        print("Getting value ranges of", len(todo), "snapshots")
+        with ProcessPoolExecutor(max_workers=max(args.nproc, 1)) as pool:
+            results = pool.map(
+                snapshot_limits,
+                todo,
+                [args.scatter] * len(todo),
+                [args.field] * len(todo),
+                [args.nx] * len(todo),
+            )
+            for fname, lim in zip(todo, results):
+                state["limits"][keys[fname]] = lim
+
+    # forget snapshots which aren't rendered anymore
+    used = {keys[fname] for fname in args.files}
+    stale = [key for key in state["limits"] if key not in used]
+    for key in stale:
+        del state["limits"][key]
+    if len(todo) > 0 or len(stale) > 0:
+        save_state(args.outdir, state)
+
+    limits = merge_limits(state["limits"][keys[fname]] for fname in args.files)
+    print("Color scale:", limits)
+
+    # frames are up to date if newer than the snapshot and rendered
+    # with the same settings and color scale
+    render_key = hashlib.sha1(
+        (settings_key + json.dumps(limits, sort_keys=True)).encode()
+    ).hexdigest()
+
+    frames = frame_names(args.outdir, args.files)
+    current = {os.path.basename(outfile) for outfile in frames}
+    for name in [name for name in state["frames"] if name not in current]:
+        del state["frames"][name]
+    render = []
+    for fname, outfile in zip(args.files, frames):
+        up_to_date = (
+            not args.force
+            and os.path.isfile(outfile)
+            and os.path.getmtime(outfile) >= os.path.getmtime(fname)
+            and state["frames"].get(os.path.basename(outfile)) == render_key
+        )
+        if not up_to_date:
+            render.append((fname, outfile))
+
+    print("Rendering", len(render), "frames,", len(frames) - len(render), "up to date")
+
+    if len(render) > 0:
+        with ProcessPoolExecutor(max_workers=max(args.nproc, 1)) as pool:
+            futures = {
+                pool.submit(
+                    render_frame,
+                    fname,
+                    outfile,
+                    args.scatter,
+                    args.field,
+                    args.shading,
+                    args.nx,
+                    limits,
+                ): outfile
+                for fname, outfile in render
+            }
+            for fut in futures:
+                outfile = fut.result()
+                state["frames"][os.path.basename(outfile)] = render_key
+                print("Written", outfile)
+        save_state(args.outdir, state)
+
+    if args.movie is not None:
+        make_movie(args.outdir, frames, args.movie, args.fps)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Rewrite a swift hdf5 file with the
+# particles of each type sorted along
+# a space-filling curve.
+# usage:
+#   swift-reorder.py <infile> <outfile> [--curve hilbert] [--pt PartType0]
+# =====================================
+
+
+import numpy as np
+import argparse
+import h5py
+import os
+
+import swift_io
+import swift_sfc
+
+
+# name of the sort key field in the particle records
+key_field = "_sfc_key"
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to rewrite a swift snapshot or IC file with the
+        particles of each type sorted by their Peano-Hilbert or
+        Morton key, so that particles close in space are close in
+        the file. All datasets of a particle type are permuted
+        consistently, with a chunked external sort. If the file has
+        cell metadata, particles stay in their cells, the cells are
+        sorted along the curve too, and Cells/ offsets are rewritten
+        to match. Everything else is copied as it is.
+            """
+    )
+
+    parser.add_argument("infile")
+    parser.add_argument("outfile")
+    parser.add_argument(
+        "--curve",
+        dest="curve",
+        action="store",
+        choices=swift_sfc.curves,
+        default="hilbert",
+        help="Space-filling curve to sort along. Default=hilbert",
+    )
+    parser.add_argument(
+        "--bits",
+        dest="bits",
+        type=int,
+        action="store",
+        default=None,
+        help="Bits per dimension of the keys. Default: as many as fit into "
+        "63 bits, at most 32",
+    )
+    parser.add_argument(
+        "--pt",
+        dest="ptypes",
+        action="store",
+        default=None,
+        help="Comma separated list of PartTypes to reorder. Default: all",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        type=int,
+        action="store",
+        default=swift_io.chunksize_default,
+        help="Number of particles to hold in memory at a time. Default={0}".format(
+            swift_io.chunksize_default
+        ),
+    )
+    parser.add_argument(
+        "--tmpdir",
+        dest="tmpdir",
+        action="store",
+        default=None,
+        help="Directory for the temporary sort files. Default: the directory "
+        "of the output file",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.infile):
+        print("Given filename, '", args.infile, "' is not a file.")
+        quit(2)
+    if os.path.abspath(args.outfile) == os.path.abspath(args.infile):
+        print("Output file must differ from the input file '", args.infile, "'")
+        quit(2)
+    if args.chunksize <= 0:
+        parser.error("--chunksize must be positive")
+    if args.bits is not None and not 1 <= args.bits <= 32:
+        parser.error("--bits must be within 1 and 32")
+    if args.ptypes is not None:
+        args.ptypes = [p.strip() for p in args.ptypes.split(",") if p.strip()]
+    if args.tmpdir is None:
+        args.tmpdir = os.path.dirname(os.path.abspath(args.outfile))
+
+    return args
+
+
+def cell_layout(f, ptype):
+    """
+    Get the cells of the particles of `ptype` from the Cells/
+    metadata: the cell indices, their offsets and counts, ordered by
+    offset, of all non-empty cells. Returns None if the file has no
+    cell metadata for this type, and raises ValueError if the cells
+    don't cover the particles exactly once.
+    """
+
+    if "Cells" not in f:
+        return None
+    cells = f["Cells"]
+    if "Counts" not in cells or ptype not in cells["Counts"]:
+        return None
+
+    offsets = None
+    for name in ["OffsetsInFile", "Offsets"]:
+        if name in cells and ptype in cells[name]:
+            offsets = cells[name][ptype][:].astype(np.int64)
+            break
+    if offsets is None:
+        raise ValueError("no offsets for {0}".format(ptype))
+    if "Centres" not in cells:
+        raise ValueError("no cell centres")
+
+    counts = cells["Counts"][ptype][:].astype(np.int64)
+    cellid = np.flatnonzero(counts > 0)
+    cellid = cellid[np.argsort(offsets[cellid], kind="stable")]
+    starts = offsets[cellid]
+    stops = starts + counts[cellid]
+
+    npart = swift_io.npart_in_group(f, ptype)
+    if cellid.shape[0] == 0:
+        if npart > 0:
+            raise ValueError("all cells of {0} are empty".format(ptype))
+    elif starts[0] != 0 or stops[-1] != npart or (starts[1:] != stops[:-1]).any():
+        raise ValueError("cells of {0} don't cover its particles".format(ptype))
+
+    return cellid, starts, counts
+
+
+def cell_ranks(f, ndim, boxsize, bits, curve):
+    """
+    Get the rank of each cell when sorting the cells by the key of
+    their centre.
+    """
+
+    centres = f["Cells"]["Centres"][:, :ndim]
+    ckeys = swift_sfc.keys(centres, boxsize, bits, curve)
+    rank = np.empty(ckeys.shape[0], dtype=np.uint64)
+    rank[np.argsort(ckeys, kind="stable")] = np.arange(ckeys.shape[0])
+
+    return rank
+
+
+class SortKey(object):
+    """
+    Sort keys of the particles of one type. Without cells, a
+    particle's key is its key along the curve. With cells, the rank
+    of its cell takes the leading bits and the key along the curve
+    the remaining ones, so particles stay in their cells.
+    """
+
+    def __init__(self, ndim, boxsize, bits, curve, cells=None, ranks=None):
+        self.ndim = ndim
+        self.boxsize = boxsize
+        self.bits = bits
+        self.curve = curve
+        self.cells = cells
+        self.ranks = ranks
+
+        if cells is not None:
+            rankbits = max(int(ranks.shape[0] - 1).bit_length(), 1)
+            self.shift = 64 - rankbits
+            self.drop = max(ndim * bits - self.shift, 0)
+
+        return
+
+    def __call__(self, x, start):
+        """
+        Get the keys of the particles [start, start + len(x)) with
+        positions x.
+        """
+
+        keys = swift_sfc.keys(x[:, : self.ndim], self.boxsize, self.bits, self.curve)
+        if self.cells is None:
+            return keys
+
+        cellid, starts, _ = self.cells
+        index = np.arange(start, start + x.shape[0])
+        cell = cellid[np.searchsorted(starts, index, side="right") - 1]
+        keys >>= np.uint64(self.drop)
+        keys |= self.ranks[cell] << np.uint64(self.shift)
+
+        return keys
+
+
+def keyed_chunks(reader, ptype, fields, sortkey, chunksize):
+    """
+    Generator yielding structured arrays of at most `chunksize`
+    particles with the given fields and their sort key, in file
+    order.
+    """
+
+    dtype = swift_io.record_dtype(reader.file[ptype], fields)
+    dtype = np.dtype([(key_field, np.uint64)] + [(n, dtype[n]) for n in dtype.names])
+
+    start = 0
+    for rec in reader.iter_records(ptype, fields, chunksize, dtype=dtype):
+        rec[key_field] = sortkey(rec["Coordinates"], start)
+        start += rec.shape[0]
+        yield rec
+
+
+def create_like(group, dset):
+    """
+    Create an empty dataset in group with the same name, type, shape,
+    filters and attributes as dset.
+    """
+
+    name = dset.name.split("/")[-1]
+    space = h5py.h5s.create_simple(dset.shape)
+    if dset.is_virtual:
+        dcpl = None
+    else:
+        dcpl = dset.id.get_create_plist()
+    dsid = h5py.h5d.create(
+        group.id, name.encode(), dset.id.get_type(), space, dcpl=dcpl
+    )
+    out = h5py.Dataset(dsid)
+    for key, val in dset.attrs.items():
+        out.attrs[key] = val
+
+    return out
+
+
+def reorder_group(reader, fout, ptype, sortkey, chunksize, tmpdir):
+    """
+    Write the particles of `ptype` sorted by their key into fout.
+    Datasets with one entry per particle are permuted; anything else
+    in the group is copied as it is.
+    """
+
+    fin = reader.file
+    group = fin[ptype]
+    npart = swift_io.npart_in_group(fin, ptype)
+
+    outgroup = fout.create_group(ptype)
+    for key, val in group.attrs.items():
+        outgroup.attrs[key] = val
+
+    fields = []
+    for name, item in group.items():
+        if isinstance(item, h5py.Dataset) and item.ndim > 0 and item.shape[0] == npart:
+            fields.append(name)
+        else:
+            print("Copying", ptype + "/" + name, "as it is")
+            fin.copy(item, outgroup, name=name)
+    fields.sort(key=lambda name: name != "Coordinates")
+
+    out = {name: create_like(outgroup, group[name]) for name in fields}
+
+    chunks = keyed_chunks(reader, ptype, fields, sortkey, chunksize)
+    start = 0
+    for chunk in swift_io.external_sort(
+        chunks, key_field, chunksize=chunksize, tmpdir=tmpdir
+    ):
+        stop = start + chunk.shape[0]
+        for name in fields:
+            out[name][start:stop] = chunk[name]
+        start = stop
+
+    return npart
+
+
+def new_offsets(cells, ranks):
+    """
+    Get the offsets of all cells after sorting them by rank. Empty
+    cells get the offset of the next non-empty one.
+    """
+
+    _, _, counts = cells
+    order = np.argsort(ranks, kind="stable")
+    offsets = np.empty(counts.shape[0], dtype=np.int64)
+    offsets[order] = np.cumsum(counts[order]) - counts[order]
+
+    return offsets
+
+
+def main():
+
+    args = getargs()
+
+    reader = swift_io.SnapshotReader(args.infile)
+    fin = reader.file
+    nfiles = int(np.ravel(fin["Header"].attrs.get("NumFilesPerSnapshot", [1]))[0])
+    if nfiles > 1:
+        print("Can't reorder one file of a snapshot distributed over", nfiles)
+        quit(2)
+
+    boxsize, ndim = swift_io.read_box(fin)
+    boxsize = boxsize[:ndim]
+    bits = args.bits
+    if bits is None:
+        bits = swift_sfc.bits_default(ndim)
+    bits = min(bits, swift_sfc.bits_default(ndim))
+
+    ptypes = sorted(k for k in fin.keys() if k.startswith("PartType"))
+    if args.ptypes is not None:
+        for ptype in args.ptypes:
+            if ptype not in fin:
+                print("No", ptype, "in", args.infile)
+                quit(2)
+        ptypes = [p for p in ptypes if p in args.ptypes]
+
+    # cells of every type to reorder, if the file has them
+    cells = {}
+    ranks = None
+    keep_cells = "Cells" in fin
+    for ptype in ptypes:
+        try:
+            cells[ptype] = cell_layout(fin, ptype)
+        except (KeyError, ValueError) as e:
+            print("Inconsistent cell metadata:", e, "; dropping Cells/")
+            cells[ptype] = None
+            keep_cells = False
+    if keep_cells and any(c is not None for c in cells.values()):
+        ranks = cell_ranks(fin, ndim, boxsize, bits, args.curve)
+    if not keep_cells:
+        cells = {ptype: None for ptype in ptypes}
+
+    fout = h5py.File(args.outfile, "w")
+    for key, val in fin.attrs.items():
+        fout.attrs[key] = val
+
+    for name in fin.keys():
+        if name in ptypes or (name == "Cells" and not keep_cells):
+            continue
+        fin.copy(fin[name], fout, name=name)
+
+    for ptype in ptypes:
+        if "Coordinates" not in fin[ptype]:
+            print("No Coordinates in", ptype, "; copying it as it is")
+            fin.copy(fin[ptype], fout, name=ptype)
+            continue
+
+        sortkey = SortKey(
+            ndim,
+            boxsize,
+            bits,
+            args.curve,
+            cells=cells[ptype],
+            ranks=None if cells[ptype] is None else ranks,
+        )
+        npart = reorder_group(reader, fout, ptype, sortkey, args.chunksize, args.tmpdir)
+
+        if cells[ptype] is not None:
+            for name in ["OffsetsInFile", "Offsets"]:
+                if name in fout["Cells"] and ptype in fout["Cells"][name]:
+                    dset = fout["Cells"][name][ptype]
+                    dset[...] = new_offsets(cells[ptype], ranks)
+            how = "by cell, then"
+        else:
+            how = "by"
+        print("Sorted", npart, ptype, "particles", how, args.curve, "key")
+
+    fout.close()
+    reader.close()
+
+    print("Written", args.outfile)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
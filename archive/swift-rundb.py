@@ -0,0 +1,1045 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Collect the timers, timesteps and
+# statistics of many runs in a local
+# SQLite database, and query them
+# across runs.
+# usage:
+#   swift-rundb.py ingest "runs/*"
+#   swift-rundb.py runs [--since 2026-06-01]
+#   swift-rundb.py timers --timer "gpu_*_pack_*" [--above 1.5]
+#   swift-rundb.py export timesteps -o timesteps.csv [--run "*gpu*"]
+#   swift-rundb.py sql "SELECT ..."
+# =====================================
+
+
+import argparse
+import csv
+import datetime
+import glob
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+import swift_statistics
+
+
+db_default = "swift_runs.sqlite"
+
+# bump this when the tables change; older databases must be re-ingested
+schema_version = 1
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    host TEXT,
+    branch TEXT,
+    revision TEXT,
+    modified REAL,
+    ingested REAL
+);
+CREATE INDEX IF NOT EXISTS runs_name ON runs (name);
+CREATE INDEX IF NOT EXISTS runs_modified ON runs (modified);
+
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    inode INTEGER,
+    offset INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS files_run ON files (run_id);
+
+CREATE TABLE IF NOT EXISTS timesteps (
+    run_id INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    time REAL,
+    scale_factor REAL,
+    redshift REAL,
+    dt REAL,
+    bin_min INTEGER,
+    bin_max INTEGER,
+    updates INTEGER,
+    g_updates INTEGER,
+    s_updates INTEGER,
+    sink_updates INTEGER,
+    b_updates INTEGER,
+    wallclock REAL,
+    props INTEGER,
+    deadtime REAL,
+    PRIMARY KEY (run_id, step)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timer_names (
+    timer_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS timer_steps (
+    run_id INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    PRIMARY KEY (run_id, rank, step)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timer_values (
+    run_id INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    timer_id INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (run_id, rank, step, timer_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS timer_values_timer ON timer_values (timer_id, run_id);
+
+CREATE TABLE IF NOT EXISTS timer_summary (
+    run_id INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    timer_id INTEGER NOT NULL,
+    nsteps INTEGER NOT NULL,
+    total REAL NOT NULL,
+    minimum REAL NOT NULL,
+    maximum REAL NOT NULL,
+    PRIMARY KEY (run_id, rank, timer_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS timer_summary_timer ON timer_summary (timer_id, run_id);
+
+CREATE TABLE IF NOT EXISTS statistics_columns (
+    column_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    unit TEXT
+);
+
+CREATE TABLE IF NOT EXISTS statistics (
+    run_id INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    column_id INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, step, column_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS statistics_column ON statistics (column_id, run_id);
+"""
+
+# columns of the timesteps table, in the order of timesteps.txt
+timestep_columns = [
+    "step",
+    "time",
+    "scale_factor",
+    "redshift",
+    "dt",
+    "bin_min",
+    "bin_max",
+    "updates",
+    "g_updates",
+    "s_updates",
+    "sink_updates",
+    "b_updates",
+    "wallclock",
+    "props",
+    "deadtime",
+]
+
+regex_timers = re.compile(r"timers_([0-9]+)\.txt$")
+regex_meta = re.compile(r"#\s*([A-Za-z][\w ]*?)\s*:\s*(.*)$")
+
+# number of rows to parse and insert at once
+chunkrows = 1 << 14
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to collect the timers_*.txt, timesteps.txt and
+        statistics.txt of many runs in a local SQLite database, and
+        to query and export them across runs without re-parsing the
+        text files. Ingesting is incremental: only rows appended
+        since the last ingest are parsed, and files which were
+        replaced are read again from the start.
+            """
+    )
+    parser.add_argument(
+        "--db",
+        dest="db",
+        action="store",
+        default=os.environ.get("SWIFT_RUNDB", db_default),
+        help="Database file. Default: $SWIFT_RUNDB, or " + db_default,
+    )
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    ingest = sub.add_parser("ingest", help="Add or update runs")
+    ingest.add_argument(
+        "runs",
+        nargs="+",
+        help="Run directories. Glob patterns are expanded; quote them.",
+    )
+    ingest.add_argument(
+        "--name",
+        dest="name",
+        action="store",
+        default=None,
+        help="Name of the run if a single one is given. Default: the name "
+        "of its directory",
+    )
+
+    def add_filters(p):
+        p.add_argument(
+            "--run",
+            dest="run",
+            action="store",
+            default=None,
+            help="Only runs whose name or path match this glob pattern",
+        )
+        p.add_argument(
+            "--since",
+            dest="since",
+            action="store",
+            default=None,
+            help="Only runs whose files were last modified on or after this "
+            "date, YYYY-MM-DD",
+        )
+
+    runs = sub.add_parser("runs", help="List the runs in the database")
+    add_filters(runs)
+    runs.add_argument(
+        "--csv",
+        dest="csv",
+        action="store_true",
+        help="Print comma separated values instead of a table",
+    )
+
+    timers = sub.add_parser(
+        "timers",
+        help="Timer time per step of each run, summed over the selected timers",
+    )
+    add_filters(timers)
+    timers.add_argument(
+        "-t",
+        "--timer",
+        dest="timers",
+        action="append",
+        default=None,
+        help="Glob pattern of timer names, e.g. 'gpu_*_pack_*'. Can be "
+        "repeated. Default: all timers",
+    )
+    timers.add_argument(
+        "--by-timer",
+        dest="by_timer",
+        action="store_true",
+        help="One row per run and timer instead of summing the timers",
+    )
+    timers.add_argument(
+        "--above",
+        dest="above",
+        type=float,
+        action="store",
+        default=None,
+        help="Only rows whose mean time per step exceeds this value [ms]",
+    )
+    timers.add_argument(
+        "--csv",
+        dest="csv",
+        action="store_true",
+        help="Print comma separated values instead of a table",
+    )
+
+    export = sub.add_parser("export", help="Export per-step series")
+    export.add_argument(
+        "table",
+        choices=["timesteps", "timers", "statistics"],
+        help="Series to export",
+    )
+    add_filters(export)
+    export.add_argument(
+        "-c",
+        "--column",
+        dest="columns",
+        action="append",
+        default=None,
+        help="Glob pattern of timer or statistics column names to export. "
+        "Can be repeated. Default: all",
+    )
+    export.add_argument(
+        "-o",
+        "--output",
+        dest="outfile",
+        action="store",
+        required=True,
+        help="Output file: .csv, or .npz with one array per column",
+    )
+
+    sql = sub.add_parser("sql", help="Run a read-only SQL query")
+    sql.add_argument("query", help="SQL query")
+    sql.add_argument(
+        "--csv",
+        dest="csv",
+        action="store_true",
+        help="Print comma separated values instead of a table",
+    )
+
+    args = parser.parse_args()
+
+    if args.command != "ingest" and not os.path.isfile(args.db):
+        print("Given filename, '", args.db, "' is not a file.")
+        quit(2)
+
+    if args.command == "ingest":
+        dirs = []
+        for pattern in args.runs:
+            matches = sorted(glob.glob(pattern))
+            if len(matches) == 0:
+                matches = [pattern]
+            for match in matches:
+                if not os.path.isdir(match):
+                    print("Given directory, '", match, "' is not a directory.")
+                    quit(2)
+                dirs.append(os.path.abspath(match))
+        args.runs = list(dict.fromkeys(dirs))
+        if args.name is not None and len(args.runs) > 1:
+            parser.error("--name needs a single run")
+
+    if getattr(args, "since", None) is not None:
+        try:
+            since = datetime.datetime.strptime(args.since, "%Y-%m-%d")
+        except ValueError:
+            parser.error("--since must be a date YYYY-MM-DD")
+        args.since = since.timestamp()
+
+    return args
+
+
+def connect(fname, readonly=False):
+    """
+    Open the database, creating the tables if needed.
+    """
+
+    if readonly:
+        conn = sqlite3.connect("file:{0}?mode=ro".format(fname), uri=True)
+    else:
+        conn = sqlite3.connect(fname)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0 and not readonly:
+        conn.executescript(schema)
+        conn.execute("PRAGMA user_version={0:d}".format(schema_version))
+        conn.commit()
+    elif version != schema_version:
+        print(
+            "Database '",
+            fname,
+            "' has version",
+            version,
+            "instead of",
+            schema_version,
+            "; remove it and ingest again",
+        )
+        quit(2)
+
+    return conn
+
+
+# -----------------------------------------------------------------
+# Parsing the text files
+# -----------------------------------------------------------------
+
+
+def read_comment_header(fname):
+    """
+    Read the leading comment lines of a text file. Returns the lines
+    without their newline, and the byte offset of the first data row.
+    """
+
+    lines = []
+    offset = 0
+    with open(fname, "rb") as f:
+        for raw in f:
+            if not raw.startswith(b"#"):
+                break
+            if not raw.endswith(b"\n"):
+                # header still being written
+                break
+            offset += len(raw)
+            lines.append(raw.decode(errors="replace").rstrip("\n"))
+
+    return lines, offset
+
+
+def timesteps_layout(lines):
+    """
+    Get the columns of timesteps.txt from its header: the table
+    column of each file column (None to skip it), and the run
+    metadata from the "# Key: value" lines. The number of
+    *-Updates columns and of the trailing ones differs between
+    SWIFT versions.
+    """
+
+    meta = {}
+    for line in lines:
+        match = regex_meta.match(line)
+        if match is not None:
+            meta[match.group(1).strip().lower()] = match.group(2).strip()
+
+    names = None
+    for line in reversed(lines):
+        if re.match(r"#\s*Step\b", line):
+            names = line
+            break
+    if names is None:
+        return None, meta
+
+    layout = timestep_columns[:7]
+    for upd in re.findall(r"\b([\w-]*Updates)\b", names):
+        col = upd.lower().replace("-", "_")
+        layout.append(col if col in timestep_columns else None)
+    layout.append("wallclock")
+    if "Props" in names:
+        layout.append("props")
+    if "Dead time" in names:
+        layout.append("deadtime")
+
+    return layout, meta
+
+
+def timer_layout(lines):
+    """
+    Get the timer names from the "# step | name name ..." header
+    line of a timers file, or None if there is none.
+    """
+
+    for line in reversed(lines):
+        if "|" in line:
+            return line.split("|", 1)[1].split()
+
+    return None
+
+
+def read_rows(fname, ncols, offset):
+    """
+    Read the first ncols columns of the complete data rows of a text
+    file after byte offset, in chunks. Yields (rows, offset after
+    the rows).
+    """
+
+    columns = list(range(ncols))
+    with open(fname, "rb") as f:
+        f.seek(offset)
+        lines = []
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            if line.startswith(b"#") or line.strip() == b"":
+                continue
+            lines.append(line)
+            if len(lines) == chunkrows:
+                yield swift_statistics.parse_rows(lines, columns), offset
+                lines = []
+        yield swift_statistics.parse_rows(lines, columns), offset
+
+
+# -----------------------------------------------------------------
+# Ingesting
+# -----------------------------------------------------------------
+
+
+def get_run(conn, path, name):
+    """
+    Get the id of a run, adding it if it's new.
+    """
+
+    row = conn.execute("SELECT run_id FROM runs WHERE path = ?", (path,)).fetchone()
+    if row is not None:
+        if name is not None:
+            conn.execute("UPDATE runs SET name = ? WHERE run_id = ?", (name, row[0]))
+        return row[0]
+
+    if name is None:
+        name = os.path.basename(path)
+    cur = conn.execute("INSERT INTO runs (name, path) VALUES (?, ?)", (name, path))
+
+    return cur.lastrowid
+
+
+def name_ids(conn, table, idcol, names, extra=None):
+    """
+    Get the ids of names in one of the name tables, adding new ones.
+    """
+
+    ids = []
+    for i, name in enumerate(names):
+        row = conn.execute(
+            "SELECT {0} FROM {1} WHERE name = ?".format(idcol, table), (name,)
+        ).fetchone()
+        if row is None:
+            if extra is None:
+                cur = conn.execute(
+                    "INSERT INTO {0} (name) VALUES (?)".format(table), (name,)
+                )
+            else:
+                cur = conn.execute(
+                    "INSERT INTO {0} (name, unit) VALUES (?, ?)".format(table),
+                    (name, extra[i]),
+                )
+            ids.append(cur.lastrowid)
+        else:
+            ids.append(row[0])
+
+    return ids
+
+
+def file_start(conn, run_id, fname, kind, rank, header_offset):
+    """
+    Find where to continue reading a file. Returns the byte offset,
+    or None if nothing was appended since the last ingest. If the
+    file was replaced or truncated, its rows are removed first.
+    """
+
+    st = os.stat(fname)
+    row = conn.execute(
+        "SELECT inode, offset FROM files WHERE path = ?", (fname,)
+    ).fetchone()
+
+    if row is not None and row[0] == st.st_ino and row[1] <= st.st_size:
+        if row[1] == st.st_size:
+            return None
+        return max(row[1], header_offset)
+
+    if row is not None:
+        clear_file(conn, run_id, kind, rank)
+
+    return header_offset
+
+
+def clear_file(conn, run_id, kind, rank):
+    """
+    Remove the rows of a file of a run.
+    """
+
+    if kind == "timesteps":
+        conn.execute("DELETE FROM timesteps WHERE run_id = ?", (run_id,))
+    elif kind == "statistics":
+        conn.execute("DELETE FROM statistics WHERE run_id = ?", (run_id,))
+    else:
+        for table in ["timer_steps", "timer_values", "timer_summary"]:
+            conn.execute(
+                "DELETE FROM {0} WHERE run_id = ? AND rank = ?".format(table),
+                (run_id, rank),
+            )
+
+    return
+
+
+def file_done(conn, run_id, fname, kind, rank, offset):
+    """
+    Remember up to where a file was read.
+    """
+
+    st = os.stat(fname)
+    conn.execute(
+        "INSERT OR REPLACE INTO files (path, run_id, kind, rank, inode, offset, mtime) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (fname, run_id, kind, rank, st.st_ino, offset, st.st_mtime),
+    )
+
+    return
+
+
+def ingest_timesteps(conn, run_id, fname):
+    """
+    Add the rows of a timesteps.txt appended since the last ingest.
+    Returns the number of rows read, or None if the file has no
+    column header.
+    """
+
+    lines, header_offset = read_comment_header(fname)
+    layout, meta = timesteps_layout(lines)
+    if layout is None:
+        return None
+    conn.execute(
+        "UPDATE runs SET host = ?, branch = ?, revision = ? WHERE run_id = ?",
+        (meta.get("host"), meta.get("branch"), meta.get("revision"), run_id),
+    )
+
+    start = file_start(conn, run_id, fname, "timesteps", 0, header_offset)
+    if start is None:
+        return 0
+
+    keep = [i for i, col in enumerate(layout) if col is not None]
+    names = [layout[i] for i in keep]
+    sql = "INSERT OR REPLACE INTO timesteps (run_id, {0}) VALUES (?{1})".format(
+        ", ".join(names), ", ?" * len(names)
+    )
+
+    nrows = 0
+    offset = start
+    for rows, offset in read_rows(fname, len(layout), start):
+        values = rows[:, keep].tolist()
+        conn.executemany(sql, ([run_id] + v for v in values))
+        nrows += rows.shape[0]
+    file_done(conn, run_id, fname, "timesteps", 0, offset)
+
+    return nrows
+
+
+def ingest_timers(conn, run_id, fname, rank):
+    """
+    Add the rows of a timers_<rank>.txt appended since the last
+    ingest. Only non-zero timer values are stored; timer_steps holds
+    all steps, to average over. Returns the number of rows read.
+    """
+
+    lines, header_offset = read_comment_header(fname)
+    names = timer_layout(lines)
+    if names is None:
+        # no header: name the timers by their column
+        with open(fname, "rb") as f:
+            f.seek(header_offset)
+            first = f.readline().split()
+        names = ["timer{0:d}".format(i) for i in range(max(len(first) - 1, 0))]
+    timer_ids = np.array(name_ids(conn, "timer_names", "timer_id", names))
+
+    start = file_start(conn, run_id, fname, "timers", rank, header_offset)
+    if start is None:
+        return 0
+
+    nrows = 0
+    offset = start
+    for rows, offset in read_rows(fname, len(names) + 1, start):
+        if rows.shape[0] == 0:
+            continue
+        steps = rows[:, 0].astype(np.int64)
+        # steps run again after a restart replace the old ones
+        conn.execute(
+            "DELETE FROM timer_values WHERE run_id = ? AND rank = ? "
+            "AND step BETWEEN ? AND ?",
+            (run_id, rank, int(steps.min()), int(steps.max())),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO timer_steps VALUES (?, ?, ?)",
+            ((run_id, rank, s) for s in steps.tolist()),
+        )
+        r, c = np.nonzero(rows[:, 1:])
+        conn.executemany(
+            "INSERT OR REPLACE INTO timer_values VALUES (?, ?, ?, ?, ?)",
+            zip(
+                [run_id] * r.shape[0],
+                [rank] * r.shape[0],
+                steps[r].tolist(),
+                timer_ids[c].tolist(),
+                rows[r, c + 1].tolist(),
+            ),
+        )
+        nrows += rows.shape[0]
+    file_done(conn, run_id, fname, "timers", rank, offset)
+
+    if nrows > 0:
+        summarize_timers(conn, run_id, rank)
+
+    return nrows
+
+
+def summarize_timers(conn, run_id, rank):
+    """
+    Rebuild the per-timer totals of a run and rank. Timers which are
+    zero in some steps have a minimum of zero.
+    """
+
+    conn.execute(
+        "DELETE FROM timer_summary WHERE run_id = ? AND rank = ?", (run_id, rank)
+    )
+    conn.execute(
+        """
+        INSERT INTO timer_summary
+        SELECT v.run_id, v.rank, v.timer_id, s.n, SUM(v.value),
+            CASE WHEN COUNT(*) < s.n THEN 0.0 ELSE MIN(v.value) END, MAX(v.value)
+        FROM timer_values v,
+            (SELECT COUNT(*) AS n FROM timer_steps WHERE run_id = ? AND rank = ?) s
+        WHERE v.run_id = ? AND v.rank = ?
+        GROUP BY v.timer_id
+        """,
+        (run_id, rank, run_id, rank),
+    )
+
+    return
+
+
+def ingest_statistics(conn, run_id, fname):
+    """
+    Add the rows of a statistics.txt appended since the last ingest.
+    Returns the number of rows read, or None if the file has no
+    step column.
+    """
+
+    try:
+        names, _, units, header_offset = swift_statistics.read_header(fname)
+    except ValueError:
+        return None
+    if "step" not in names:
+        return None
+    units = [str(u) for u in units]
+    column_ids = np.array(
+        name_ids(conn, "statistics_columns", "column_id", names, extra=units)
+    )
+    istep = names.index("step")
+
+    start = file_start(conn, run_id, fname, "statistics", 0, header_offset)
+    if start is None:
+        return 0
+
+    nrows = 0
+    offset = start
+    for rows, offset in read_rows(fname, len(names), start):
+        steps = rows[:, istep].astype(np.int64)
+        ncol = len(names)
+        conn.executemany(
+            "INSERT OR REPLACE INTO statistics VALUES (?, ?, ?, ?)",
+            zip(
+                [run_id] * (rows.shape[0] * ncol),
+                np.repeat(steps, ncol).tolist(),
+                np.tile(column_ids, rows.shape[0]).tolist(),
+                rows.ravel().tolist(),
+            ),
+        )
+        nrows += rows.shape[0]
+    file_done(conn, run_id, fname, "statistics", 0, offset)
+
+    return nrows
+
+
+def ingest_run(conn, path, name):
+    """
+    Ingest all known files of a run directory, in one transaction.
+    """
+
+    with conn:
+        run_id = get_run(conn, path, name)
+        report = []
+        modified = []
+
+        fname = os.path.join(path, "timesteps.txt")
+        if os.path.isfile(fname):
+            modified.append(os.stat(fname).st_mtime)
+            report.append(("timesteps", ingest_timesteps(conn, run_id, fname)))
+
+        fname = os.path.join(path, "statistics.txt")
+        if os.path.isfile(fname):
+            modified.append(os.stat(fname).st_mtime)
+            report.append(("statistics", ingest_statistics(conn, run_id, fname)))
+
+        for fname in sorted(glob.glob(os.path.join(path, "timers_*.txt"))):
+            match = regex_timers.search(fname)
+            if match is None:
+                continue
+            modified.append(os.stat(fname).st_mtime)
+            rank = int(match.group(1))
+            report.append(
+                ("timers_{0:d}".format(rank), ingest_timers(conn, run_id, fname, rank))
+            )
+
+        conn.execute(
+            "UPDATE runs SET modified = ?, ingested = ? WHERE run_id = ?",
+            (max(modified) if len(modified) > 0 else None, time.time(), run_id),
+        )
+
+    return report
+
+
+# -----------------------------------------------------------------
+# Queries
+# -----------------------------------------------------------------
+
+
+def glob_clause(column, patterns):
+    """
+    Get an SQL condition matching a column against any of the glob
+    patterns, and its parameters.
+    """
+
+    if patterns is None:
+        return "1", []
+
+    return "(" + " OR ".join(column + " GLOB ?" for _ in patterns) + ")", patterns
+
+
+def run_filter(args, alias="r"):
+    """
+    Get the SQL condition selecting runs by --run and --since, and
+    its parameters.
+    """
+
+    conds = []
+    params = []
+    if args.run is not None:
+        conds.append("({0}.name GLOB ? OR {0}.path GLOB ?)".format(alias))
+        params += [args.run, args.run]
+    if args.since is not None:
+        conds.append("{0}.modified >= ?".format(alias))
+        params.append(args.since)
+    if len(conds) == 0:
+        return "1", []
+
+    return " AND ".join(conds), params
+
+
+def format_cell(val):
+    """
+    Format a single table entry.
+    """
+
+    if val is None:
+        return "-"
+    if isinstance(val, float):
+        return "{0:.6g}".format(val)
+
+    return str(val)
+
+
+def print_table(columns, rows, csv):
+    """
+    Print query results to screen.
+    """
+
+    cells = [[format_cell(v) for v in row] for row in rows]
+
+    if csv:
+        print(",".join(columns))
+        for line in cells:
+            print(",".join(line))
+        return
+
+    widths = [len(c) for c in columns]
+    for line in cells:
+        widths = [max(w, len(c)) for w, c in zip(widths, line)]
+
+    print(" | ".join("{0:{1}}".format(c, w) for c, w in zip(columns, widths)))
+    print("-+-".join("-" * w for w in widths))
+    for line in cells:
+        print(" | ".join("{0:>{1}}".format(c, w) for c, w in zip(line, widths)))
+
+    return
+
+
+def list_runs(conn, args):
+    """
+    Print the runs with their step counts and total wall-clock time.
+    """
+
+    where, params = run_filter(args)
+    cur = conn.execute(
+        """
+        SELECT r.name, r.path, r.branch, r.revision,
+            datetime(r.modified, 'unixepoch', 'localtime'),
+            t.nsteps, t.time, t.wallclock * 1e-3, t.deadtime * 1e-3,
+            (SELECT COUNT(DISTINCT rank) FROM timer_steps s WHERE s.run_id = r.run_id)
+        FROM runs r
+        LEFT JOIN (
+            SELECT run_id, COUNT(*) AS nsteps, MAX(time) AS time,
+                SUM(wallclock) AS wallclock, SUM(deadtime) AS deadtime
+            FROM timesteps GROUP BY run_id
+        ) t ON t.run_id = r.run_id
+        WHERE {0}
+        ORDER BY r.modified, r.name
+        """.format(
+            where
+        ),
+        params,
+    )
+    columns = [
+        "run",
+        "path",
+        "branch",
+        "revision",
+        "modified",
+        "steps",
+        "t_end",
+        "wallclock [s]",
+        "deadtime [s]",
+        "timer ranks",
+    ]
+    print_table(columns, cur.fetchall(), args.csv)
+
+    return
+
+
+def query_timers(conn, args):
+    """
+    Print the mean time per step of the selected timers of each run.
+    Multiple ranks are averaged; their largest mean is shown too.
+    """
+
+    where, params = run_filter(args)
+    tcond, tparams = glob_clause("n.name", args.timers)
+    if args.by_timer:
+        inner_timer, outer_timer, group = "n.name", "p.timer", ", n.name"
+    else:
+        inner_timer, outer_timer, group = (
+            "COUNT(DISTINCT t.timer_id)",
+            "MAX(p.timer)",
+            "",
+        )
+
+    # per rank first, then over the ranks of each run
+    query = """
+        SELECT r.name, {2}, COUNT(*), MAX(p.nsteps), SUM(p.total),
+            AVG(p.rank_mean), MAX(p.rank_mean)
+        FROM runs r
+        JOIN (
+            SELECT t.run_id, t.rank, {3} AS timer, MAX(t.nsteps) AS nsteps,
+                SUM(t.total) AS total, SUM(t.total / t.nsteps) AS rank_mean
+            FROM timer_summary t JOIN timer_names n USING (timer_id)
+            WHERE {1}
+            GROUP BY t.run_id, t.rank{4}
+        ) p ON p.run_id = r.run_id
+        WHERE {0}
+        GROUP BY r.run_id{5}
+        HAVING ? IS NULL OR AVG(p.rank_mean) > ?
+        ORDER BY r.modified, r.name{5}
+        """.format(
+        where,
+        tcond,
+        outer_timer,
+        inner_timer,
+        group,
+        ", p.timer" if args.by_timer else "",
+    )
+    cur = conn.execute(query, tparams + params + [args.above, args.above])
+    columns = [
+        "run",
+        "timer" if args.by_timer else "timers",
+        "ranks",
+        "steps",
+        "total [ms]",
+        "mean/step [ms]",
+        "max rank mean/step [ms]",
+    ]
+    print_table(columns, cur.fetchall(), args.csv)
+
+    return
+
+
+def export_series(conn, args):
+    """
+    Write the per-step series of the selected runs to a .csv or .npz
+    file. Timers and statistics are written in long form, one row
+    per run, step and column; timers only where they are non-zero.
+    """
+
+    where, params = run_filter(args)
+
+    if args.table == "timesteps":
+        query = """
+            SELECT r.name, t.{0} FROM timesteps t JOIN runs r USING (run_id)
+            WHERE {1} ORDER BY r.name, t.step
+            """.format(
+            ", t.".join(timestep_columns), where
+        )
+        columns = ["run"] + timestep_columns
+    elif args.table == "timers":
+        ccond, cparams = glob_clause("n.name", args.columns)
+        query = """
+            SELECT r.name, v.rank, v.step, n.name, v.value
+            FROM timer_values v
+            JOIN runs r USING (run_id) JOIN timer_names n USING (timer_id)
+            WHERE {0} AND {1} ORDER BY r.name, v.rank, v.step, n.name
+            """.format(
+            where, ccond
+        )
+        params = params + cparams
+        columns = ["run", "rank", "step", "timer", "value"]
+    else:
+        ccond, cparams = glob_clause("c.name", args.columns)
+        query = """
+            SELECT r.name, s.step, c.name, s.value
+            FROM statistics s
+            JOIN runs r USING (run_id) JOIN statistics_columns c USING (column_id)
+            WHERE {0} AND {1} ORDER BY r.name, s.step, c.column_id
+            """.format(
+            where, ccond
+        )
+        params = params + cparams
+        columns = ["run", "step", "column", "value"]
+
+    cur = conn.execute(query, params)
+
+    if args.outfile.endswith(".npz"):
+        rows = cur.fetchall()
+        arrays = {}
+        for i, col in enumerate(columns):
+            values = [row[i] for row in rows]
+            if col in ["run", "timer", "column"]:
+                arrays[col] = np.array(values, dtype=str)
+            else:
+                arrays[col] = np.array(
+                    [np.nan if v is None else v for v in values], dtype=np.float64
+                )
+        np.savez(args.outfile, **arrays)
+        nrows = len(rows)
+    else:
+        nrows = 0
+        with open(args.outfile, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            while True:
+                rows = cur.fetchmany(chunkrows)
+                if len(rows) == 0:
+                    break
+                writer.writerows(rows)
+                nrows += len(rows)
+
+    print("Written", nrows, args.table, "rows to", args.outfile)
+
+    return
+
+
+def main():
+
+    args = getargs()
+
+    if args.command == "ingest":
+        conn = connect(args.db)
+        for path in args.runs:
+            report = ingest_run(conn, path, args.name)
+            parts = []
+            for kind, nrows in report:
+                if nrows is None:
+                    parts.append("{0}: no header, skipped".format(kind))
+                else:
+                    parts.append("{0}: {1:d} new rows".format(kind, nrows))
+            if len(parts) == 0:
+                parts.append("no timesteps, statistics or timers files")
+            print(path, "-", ", ".join(parts))
+        conn.close()
+        return
+
+    conn = connect(args.db, readonly=True)
+    if args.command == "runs":
+        list_runs(conn, args)
+    elif args.command == "timers":
+        query_timers(conn, args)
+    elif args.command == "export":
+        export_series(conn, args)
+    elif args.command == "sql":
+        cur = conn.execute(args.query)
+        columns = [d[0] for d in cur.description] if cur.description else []
+        print_table(columns, cur.fetchall(), args.csv)
+    conn.close()
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Print summary statistics (min, max,
+# mean, std, log histogram) of particle
+# fields in a swift hdf5 file.
+# usage:
+#   swift-snapshot-stats.py <fname>
+# =====================================
+
+
+import numpy as np
+import argparse
+import h5py
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import swift_io
+
+
+fields_default = "Densities,SmoothingLengths,Masses,InternalEnergies"
+
+# fixed log10 histogram range, so that partial histograms of
+# different chunks can simply be added up.
+hist_log_min = -40.0
+hist_log_max = 40.0
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to print summary statistics of particle fields.
+        Datasets are read in chunks by a pool of processes, so
+        memory use is independent of the file size.
+            """
+    )
+
+    parser.add_argument("filename")
+    parser.add_argument(
+        "--pt",
+        dest="ptypes",
+        action="store",
+        default=None,
+        help="Comma separated list of PartTypes to use. Default: all present",
+    )
+    parser.add_argument(
+        "--fields",
+        dest="fields",
+        action="store",
+        default=fields_default,
+        help="Comma separated list of datasets to summarise. Default=" + fields_default,
+    )
+    parser.add_argument(
+        "--hist",
+        dest="hist",
+        action="store_true",
+        help="Also print log10 histograms",
+    )
+    parser.add_argument(
+        "--bins-per-dex",
+        dest="bins_per_dex",
+        type=int,
+        action="store",
+        default=4,
+        help="Histogram resolution. Default=4",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of processes to use. Default: all cores",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        type=int,
+        action="store",
+        default=swift_io.chunksize_default,
+        help="Number of particles per chunk. Default={0}".format(
+            swift_io.chunksize_default
+        ),
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.filename):
+        print("Given filename, '", args.filename, "' is not a file.")
+        quit(2)
+
+    args.fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    if args.ptypes is not None:
+        args.ptypes = [p.strip() for p in args.ptypes.split(",") if p.strip()]
+
+    return args
+
+
+class PartialStats(object):
+    """
+    Mergeable summary statistics of a (chunk of a) dataset, per
+    component. Means and variances are combined with the pairwise
+    update of Chan et al., so merging is exact up to round-off.
+    """
+
+    def __init__(self, ncomp, bins_per_dex):
+        nbins = int((hist_log_max - hist_log_min) * bins_per_dex)
+        self.bins_per_dex = bins_per_dex
+        self.count = np.zeros(ncomp, dtype=np.int64)
+        self.nonfinite = np.zeros(ncomp, dtype=np.int64)
+        self.min = np.full(ncomp, np.inf)
+        self.max = np.full(ncomp, -np.inf)
+        self.mean = np.zeros(ncomp)
+        self.m2 = np.zeros(ncomp)
+        # column 0: values <= 0; columns 1..nbins: log bins incl. clipping
+        self.hist = np.zeros((ncomp, nbins + 1), dtype=np.int64)
+
+    @classmethod
+    def from_values(cls, values, bins_per_dex):
+        """
+        Compute the statistics of an (n, ncomp) array.
+        """
+
+        ncomp = values.shape[1]
+        stats = cls(ncomp, bins_per_dex)
+        nbins = stats.hist.shape[1] - 1
+
+        values = values.astype(np.float64)
+        finite = np.isfinite(values)
+        stats.nonfinite = values.shape[0] - finite.sum(axis=0)
+
+        for c in range(ncomp):
+            v = values[finite[:, c], c]
+            n = v.shape[0]
+            stats.count[c] = n
+            if n == 0:
+                continue
+            stats.min[c] = v.min()
+            stats.max[c] = v.max()
+            stats.mean[c] = v.mean()
+            stats.m2[c] = ((v - stats.mean[c]) ** 2).sum()
+
+            ind = np.zeros(n, dtype=np.int64)
+            pos = v > 0
+            ind[pos] = 1 + np.clip(
+                np.floor((np.log10(v[pos]) - hist_log_min) * bins_per_dex).astype(
+                    np.int64
+                ),
+                0,
+                nbins - 1,
+            )
+            stats.hist[c] = np.bincount(ind, minlength=nbins + 1)
+
+        return stats
+
+    def merge(self, other):
+        """
+        Add the statistics of `other` to these ones.
+        """
+
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = np.where(n > 0, other.count / np.maximum(n, 1), 0.0)
+        self.mean = self.mean + delta * frac
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count * frac
+        self.count = n
+        self.nonfinite = self.nonfinite + other.nonfinite
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.hist = self.hist + other.hist
+
+        return self
+
+    def std(self):
+        return np.sqrt(self.m2 / np.maximum(self.count, 1))
+
+
+def chunk_stats(fname, ptype, field, start, stop, bins_per_dex):
+    """
+    Worker: read one chunk of a dataset and get its statistics.
+    """
+
+    with swift_io.SnapshotReader(fname, nthreads=1) as reader:
+        values = swift_io.read_dataset(
+            reader.dataset(ptype, field), start, stop, mmap=True
+        )
+
+    values = values.reshape(values.shape[0], -1)
+    return PartialStats.from_values(values, bins_per_dex)
+
+
+def make_tasks(fname, ptypes, fields, chunksize):
+    """
+    Split all requested datasets into chunks. Returns the list of
+    chunks to work on and the number of components per dataset.
+    """
+
+    tasks = []
+    ncomp = {}
+
+    with h5py.File(fname, "r") as f:
+        if ptypes is None:
+            ptypes = sorted(k for k in f.keys() if k.startswith("PartType"))
+
+        for ptype in ptypes:
+            if ptype not in f:
+                print("No", ptype, "in file, skipping it.")
+                continue
+            group = f[ptype]
+            for field in fields:
+                try:
+                    dset = group[swift_io.resolve_field(group, field)]
+                except KeyError:
+                    continue
+                ncomp[(ptype, field)] = int(np.prod(dset.shape[1:]))
+                for start in range(0, dset.shape[0], chunksize):
+                    stop = min(start + chunksize, dset.shape[0])
+                    tasks.append((ptype, field, start, stop))
+
+    return tasks, ncomp
+
+
+def print_stats(results, ncomp, show_hist):
+    """
+    Print results to screen.
+    """
+
+    print(
+        "{0:10} {1:20} {2:>4} | {3:>12} {4:>12} {5:>12} {6:>12} {7:>12} {8:>8}".format(
+            "PartType", "Field", "comp", "count", "min", "max", "mean", "std", "nonfin"
+        )
+    )
+    print("-" * 115)
+
+    for key in sorted(ncomp.keys()):
+        if key not in results:
+            continue
+        ptype, field = key
+        stats = results[key]
+        std = stats.std()
+        for c in range(ncomp[key]):
+            print(
+                "{0:10} {1:20} {2:4d} | {3:12d} {4:12.4e} {5:12.4e} {6:12.4e} {7:12.4e} {8:8d}".format(
+                    ptype,
+                    field,
+                    c,
+                    stats.count[c],
+                    stats.min[c],
+                    stats.max[c],
+                    stats.mean[c],
+                    std[c],
+                    stats.nonfinite[c],
+                )
+            )
+
+    if not show_hist:
+        return
+
+    for key in sorted(ncomp.keys()):
+        if key not in results:
+            continue
+        ptype, field = key
+        stats = results[key]
+        for c in range(ncomp[key]):
+            print()
+            print("{0} {1} [{2}]: log10 histogram".format(ptype, field, c))
+            print_histogram(stats.hist[c], stats.bins_per_dex)
+
+    return
+
+
+def print_histogram(hist, bins_per_dex, width=50):
+    """
+    Print one log10 histogram as text, skipping empty edges.
+    """
+
+    peak = hist.max()
+    if peak == 0:
+        print("  (empty)")
+        return
+
+    if hist[0] > 0:
+        bar = "#" * int(round(width * hist[0] / peak))
+        print("  {0:>16} {1:12d} {2}".format("<= 0", hist[0], bar))
+
+    nonzero = np.flatnonzero(hist[1:]) + 1
+    if nonzero.shape[0] == 0:
+        return
+
+    for i in range(nonzero[0], nonzero[-1] + 1):
+        lo = hist_log_min + (i - 1) / bins_per_dex
+        label = "[{0:6.2f},{1:6.2f})".format(lo, lo + 1.0 / bins_per_dex)
+        bar = "#" * int(round(width * hist[i] / peak))
+        print("  {0:>16} {1:12d} {2}".format(label, hist[i], bar))
+
+    return
+
+
+def main():
+
+    args = getargs()
+
+    tasks, ncomp = make_tasks(args.filename, args.ptypes, args.fields, args.chunksize)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=max(args.nproc, 1)) as pool:
+        futures = {
+            pool.submit(
+                chunk_stats, args.filename, ptype, field, start, stop, args.bins_per_dex
+            ): (ptype, field)
+            for ptype, field, start, stop in tasks
+        }
+        for fut in as_completed(futures):
+            key = futures[fut]
+            if key in results:
+                results[key].merge(fut.result())
+            else:
+                results[key] = fut.result()
+
+    print_stats(results, ncomp, args.hist)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
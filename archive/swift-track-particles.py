@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+# =====================================
+# Track a set of particles through a
+# series of swift snapshots and store
+# their properties over time.
+# usage:
+#   swift-track-particles.py --ids 1,2,3 snapshot_*.hdf5
+#   swift-track-particles.py --id-file ids.txt "output/snap_*.hdf5"
+# =====================================
+
+
+import numpy as np
+import argparse
+import glob
+import h5py
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import swift_cache
+import swift_io
+
+
+fields_default = "Coordinates,Velocities,Masses"
+index_dirname = ".swift-id-index"
+
+
+def getargs():
+    """
+    Read cmd line args.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="""
+        A program to track particles through a series of swift
+        snapshots. Particles are looked up by their IDs in every
+        snapshot, across all particle types, so particles changing
+        type (e.g. gas turning into stars) are followed too.
+            """
+    )
+
+    parser.add_argument(
+        "snapshots",
+        nargs="+",
+        help="Snapshot files, in order. Glob patterns are expanded.",
+    )
+    parser.add_argument(
+        "--ids",
+        dest="ids",
+        action="store",
+        default=None,
+        help="Comma separated list of particle IDs to track",
+    )
+    parser.add_argument(
+        "--id-file",
+        dest="id_file",
+        action="store",
+        default=None,
+        help="File with particle IDs to track: .npy, or text with one ID per line",
+    )
+    parser.add_argument(
+        "--fields",
+        dest="fields",
+        action="store",
+        default=fields_default,
+        help="Comma separated list of datasets to track. Default=" + fields_default,
+    )
+    parser.add_argument(
+        "--pt",
+        dest="ptypes",
+        action="store",
+        default=None,
+        help="Comma separated list of PartTypes to look in. Default: all present",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="outfile",
+        action="store",
+        default="tracked_particles.npz",
+        help="Output file. Default=tracked_particles.npz",
+    )
+    parser.add_argument(
+        "-j",
+        "--nproc",
+        dest="nproc",
+        type=int,
+        action="store",
+        default=os.cpu_count(),
+        help="Number of processes to read snapshots with. Default: all cores",
+    )
+    parser.add_argument(
+        "--index-dir",
+        dest="index_dir",
+        action="store",
+        default=None,
+        help="Directory to store the per-snapshot ID indices in. "
+        "Default: " + index_dirname + " next to each snapshot",
+    )
+
+    args = parser.parse_args()
+
+    snapshots = []
+    for s in args.snapshots:
+        if any(c in s for c in "*?["):
+            snapshots += sorted(glob.glob(s))
+        else:
+            snapshots.append(s)
+    for fname in snapshots:
+        if not os.path.isfile(fname):
+            print("Given filename, '", fname, "' is not a file.")
+            quit(2)
+    if len(snapshots) == 0:
+        print("No snapshots found.")
+        quit(2)
+    args.snapshots = snapshots
+
+    if args.ids is not None:
+        ids = [int(i) for i in args.ids.split(",") if i.strip()]
+    elif args.id_file is not None:
+        if args.id_file.endswith(".npy"):
+            ids = np.load(args.id_file)
+        else:
+            ids = np.loadtxt(args.id_file, dtype=np.uint64, ndmin=1)
+    else:
+        print("I need particle IDs to track: use --ids or --id-file")
+        quit(2)
+
+    # SWIFT's IDs are unsigned 64 bit; don't lose the large ones to int64
+    if np.any(np.asarray(ids, dtype=object) < 0):
+        print("Particle IDs can't be negative.")
+        quit(2)
+    args.ids = np.unique(np.asarray(ids, dtype=np.uint64))
+    args.fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    if args.ptypes is not None:
+        args.ptypes = [p.strip() for p in args.ptypes.split(",") if p.strip()]
+
+    return args
+
+
+def get_id_index(f, fname, ptype, index_dir):
+    """
+    Get the ID index of a particle type in a snapshot: the sorted
+    IDs and the position of each of them in the file. The index is
+    cached on disk, keyed by the snapshot's full path, modification
+    time and size, so it only needs to be built once per snapshot,
+    also when snapshots of several runs share an index directory.
+    """
+
+    path, mtime, size = swift_cache.file_key(fname)
+    if index_dir is None:
+        index_dir = os.path.join(os.path.dirname(path), index_dirname)
+    # the basename is only there to make the directory readable
+    prefix = "{0}.{1}.{2}.".format(
+        os.path.basename(fname), swift_cache.hash_key(path)[:16], ptype
+    )
+    tag = "{0}-{1}".format(mtime, size)
+    index_file = os.path.join(index_dir, prefix + tag + ".npy")
+
+    if os.path.isfile(index_file):
+        index = np.load(index_file, mmap_mode="r")
+        return index["id"], index["pos"]
+
+    ids = f[ptype]["ParticleIDs"][:]
+    order = np.argsort(ids, kind="stable")
+    index = np.empty(ids.shape[0], dtype=[("id", ids.dtype), ("pos", np.int64)])
+    index["id"] = ids[order]
+    index["pos"] = order
+
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        # remove indices of older versions of this snapshot
+        for old in os.listdir(index_dir):
+            if old.startswith(prefix):
+                os.remove(os.path.join(index_dir, old))
+        tmpname = index_file + ".tmp{0}.npy".format(os.getpid())
+        np.save(tmpname, index)
+        os.replace(tmpname, index_file)
+    except OSError as e:
+        print("Couldn't store ID index", index_file, ":", e)
+
+    return index["id"], index["pos"]
+
+
+def read_selection(dset, pos):
+    """
+    Read the entries `pos` of a dataset. Contiguous, unfiltered
+    datasets are indexed through a memmap, which only touches the
+    pages holding the entries. Otherwise, hdf5 needs increasing
+    indices, so sort them and undo the sorting afterwards.
+    """
+
+    mapped = swift_io.memmap_dataset(dset)
+    if mapped is not None:
+        return mapped[pos]
+
+    order = np.argsort(pos)
+    data = dset[pos[order]]
+    out = np.empty_like(data)
+    out[order] = data
+    return out
+
+
+def track_snapshot(fname, ids, fields, ncols, ptypes, index_dir):
+    """
+    Find the particles `ids` in a snapshot and read their fields.
+    Returns the snapshot time, a (len(ids), ncols) array with NaN for
+    particles or fields which aren't present, and the index of the
+    particle type each particle was found in (-1 if not found).
+    """
+
+    data = np.full((ids.shape[0], ncols), np.nan)
+    found_type = np.full(ids.shape[0], -1, dtype=np.int8)
+
+    with h5py.File(fname, "r") as f:
+        time = float(np.ravel(f["Header"].attrs.get("Time", np.nan))[0])
+
+        if ptypes is None:
+            ptypes = sorted(k for k in f.keys() if k.startswith("PartType"))
+
+        for ptype in ptypes:
+            if ptype not in f or "ParticleIDs" not in f[ptype]:
+                continue
+
+            sorted_ids, sorted_pos = get_id_index(f, fname, ptype, index_dir)
+            if sorted_ids.shape[0] == 0:
+                continue
+
+            # compare in the file's ID type; mixing uint64 with int64
+            # would go through float64. IDs which don't fit can't match.
+            fits = ids <= np.iinfo(sorted_ids.dtype).max
+            query = np.where(fits, ids, 0).astype(sorted_ids.dtype)
+            ind = np.searchsorted(sorted_ids, query)
+            ind = np.minimum(ind, sorted_ids.shape[0] - 1)
+            match = fits & (sorted_ids[ind] == query) & (found_type < 0)
+            if not match.any():
+                continue
+
+            pos = np.asarray(sorted_pos[ind[match]])
+            found_type[match] = int(ptype[len("PartType") :])
+
+            col = 0
+            for field, ncomp in fields:
+                try:
+                    dset = f[ptype][swift_io.resolve_field(f[ptype], field)]
+                except KeyError:
+                    col += ncomp
+                    continue
+                values = read_selection(dset, pos).reshape(pos.shape[0], -1)
+                data[match, col : col + ncomp] = values
+                col += ncomp
+
+    return time, data, found_type
+
+
+def get_columns(snapshots, fields, ptypes):
+    """
+    Find the number of components of each field from the first
+    snapshot which has it, and name the output columns.
+    """
+
+    shapes = {}
+    for fname in snapshots:
+        with h5py.File(fname, "r") as f:
+            groups = ptypes
+            if groups is None:
+                groups = sorted(k for k in f.keys() if k.startswith("PartType"))
+            for ptype in groups:
+                if ptype not in f:
+                    continue
+                for field in fields:
+                    if field in shapes:
+                        continue
+                    try:
+                        dset = f[ptype][swift_io.resolve_field(f[ptype], field)]
+                    except KeyError:
+                        continue
+                    shapes[field] = int(np.prod(dset.shape[1:]))
+        if len(shapes) == len(fields):
+            break
+
+    for field in fields:
+        if field not in shapes:
+            raise KeyError("Field '{0}' not found in any snapshot".format(field))
+
+    fields_ncomp = [(field, shapes[field]) for field in fields]
+    columns = []
+    for field, ncomp in fields_ncomp:
+        if ncomp == 1:
+            columns.append(field)
+        elif ncomp == 3:
+            columns += [field + "_" + c for c in "xyz"]
+        else:
+            columns += [field + "_{0}".format(c) for c in range(ncomp)]
+
+    return fields_ncomp, columns
+
+
+def main():
+
+    args = getargs()
+
+    fields, columns = get_columns(args.snapshots, args.fields, args.ptypes)
+    nsnap = len(args.snapshots)
+    npart = args.ids.shape[0]
+
+    times = np.full(nsnap, np.nan)
+    data = np.full((nsnap, npart, len(columns)), np.nan)
+    ptype = np.full((nsnap, npart), -1, dtype=np.int8)
+
+    with ProcessPoolExecutor(max_workers=max(args.nproc, 1)) as pool:
+        futures = [
+            pool.submit(
+                track_snapshot,
+                fname,
+                args.ids,
+                fields,
+                len(columns),
+                args.ptypes,
+                args.index_dir,
+            )
+            for fname in args.snapshots
+        ]
+        for i, fut in enumerate(futures):
+            times[i], data[i], ptype[i] = fut.result()
+            nfound = np.count_nonzero(ptype[i] >= 0)
+            print(
+                "{0:40} t={1:12.6g} found {2}/{3}".format(
+                    args.snapshots[i], times[i], nfound, npart
+                )
+            )
+
+    np.savez(
+        args.outfile,
+        ids=args.ids,
+        times=times,
+        snapshots=np.array(args.snapshots),
+        columns=np.array(columns),
+        data=data,
+        ptype=ptype,
+    )
+    print(
+        "Written (n_snap, n_particles, n_fields) = {0} array to {1}".format(
+            data.shape, args.outfile
+        )
+    )
+
+    return
+
+
+if __name__ == "__main__":
+    main()
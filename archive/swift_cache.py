@@ -0,0 +1,166 @@
+# =====================================
+# On-disk cache locations and keys,
+# shared by the swift-*.py scripts in
+# this directory.
+# =====================================
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+# bump this to invalidate all cache entries written by older versions
+cache_version = 2
+
+
+def cache_dir(subdir=None):
+    """
+    Get (and create) the cache directory. Uses $SWIFT_SCRIPTS_CACHE
+    if set, otherwise $XDG_CACHE_HOME/swift_scripts or
+    ~/.cache/swift_scripts.
+    """
+
+    root = os.environ.get("SWIFT_SCRIPTS_CACHE")
+    if root is None:
+        xdg = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        root = os.path.join(xdg, "swift_scripts")
+
+    if subdir is not None:
+        root = os.path.join(root, subdir)
+
+    os.makedirs(root, exist_ok=True)
+
+    return root
+
+
+def hash_key(*items):
+    """
+    Get a hex digest identifying the given items. numpy arrays are
+    hashed by their content, dtype and shape; everything else by its
+    repr.
+    """
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(cache_version).encode())
+
+    for item in items:
+        if isinstance(item, np.ndarray):
+            arr = np.ascontiguousarray(item)
+            digest.update(str((arr.dtype.str, arr.shape)).encode())
+            # hash in slices to avoid copying huge arrays at once
+            flat = arr.reshape(-1).view(np.uint8)
+            step = 1 << 26
+            for start in range(0, flat.shape[0], step):
+                digest.update(flat[start : start + step])
+        else:
+            digest.update(repr(item).encode())
+        digest.update(b"|")
+
+    return digest.hexdigest()
+
+
+def entry_path(subdir, key):
+    """
+    Get the directory of a cache entry. Returns None if the entry
+    doesn't exist yet. Existing entries are marked as recently used
+    for evict().
+    """
+
+    path = os.path.join(cache_dir(subdir), key)
+    if os.path.isdir(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    return None
+
+
+def file_key(fname):
+    """
+    Get a tuple identifying the current version of a file: its
+    absolute path, modification time and size.
+    """
+
+    st = os.stat(fname)
+    return (os.path.abspath(fname), st.st_mtime_ns, st.st_size)
+
+
+def entry_size(path):
+    """
+    Get the total size of the files in a cache entry in bytes.
+    """
+
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+
+    return size
+
+
+def evict(subdir, max_bytes):
+    """
+    Delete the least recently used entries of a cache subdirectory
+    until its total size is at most max_bytes. Entries are used when
+    written and when found by entry_path(). Temporary entries still
+    being written are left alone.
+    """
+
+    root = cache_dir(subdir)
+    entries = []
+    total = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith(".tmp-") or not os.path.isdir(path):
+            continue
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        size = entry_size(path)
+        entries.append((mtime, size, path))
+        total += size
+
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+    return total
+
+
+def new_entry(subdir):
+    """
+    Create a temporary directory to write a new cache entry into.
+    Publish it with commit_entry() once complete, so that readers
+    never see partially written entries.
+    """
+
+    return tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir(subdir))
+
+
+def commit_entry(subdir, key, tmpdir):
+    """
+    Move a completely written temporary entry to its final place.
+    If another process was faster, keep theirs.
+    """
+
+    path = os.path.join(cache_dir(subdir), key)
+    try:
+        os.rename(tmpdir, path)
+        os.utime(path)
+    except OSError:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return path
@@ -0,0 +1,144 @@
+# =====================================
+# Shape-preserving decimation of long
+# time series before plotting, shared
+# by the swift-*.py scripts in this
+# directory.
+# =====================================
+
+
+import numpy as np
+
+
+# series with at most this many points per pixel are plotted as they are
+points_per_pixel_max = 4
+
+# series with at most this many points per pixel are decimated with
+# LTTB; longer ones with the min/max envelope, which is O(N)
+lttb_points_per_pixel_max = 32
+
+
+def minmax_indices(x, y, nbins):
+    """
+    Get the indices of the points to keep of a series with x sorted
+    ascending, such that the min/max envelope is exact: the x range
+    is split into nbins equal bins, e.g. one per pixel, and the
+    first, last, smallest and largest point of each bin are kept.
+    Spikes, and the first and last point of the series, are never
+    lost. Non-finite values are kept too, so gaps stay visible.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = y.shape[0]
+    if n <= 4 * nbins:
+        return np.arange(n)
+
+    xmin = x[0]
+    xmax = x[-1]
+    if xmax > xmin:
+        binid = ((x - xmin) * (nbins / (xmax - xmin))).astype(np.int64)
+        np.clip(binid, 0, nbins - 1, out=binid)
+    else:
+        binid = np.zeros(n, dtype=np.int64)
+
+    # bins are contiguous index ranges, since x is sorted
+    starts = np.flatnonzero(np.r_[True, binid[1:] != binid[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+
+    finite = np.isfinite(y)
+    yfin = np.where(finite, y, np.nan)
+    with np.errstate(invalid="ignore"):
+        mins = np.fmin.reduceat(yfin, starts)
+        maxs = np.fmax.reduceat(yfin, starts)
+
+    # first index of each bin holding its min and its max
+    group = np.repeat(np.arange(starts.shape[0]), ends - starts + 1)
+    keep = [starts, ends, np.flatnonzero(~finite)]
+    for extreme in [mins, maxs]:
+        hit = np.flatnonzero(y == extreme[group])
+        _, first = np.unique(group[hit], return_index=True)
+        keep.append(hit[first])
+
+    return np.unique(np.concatenate(keep))
+
+
+def lttb_indices(x, y, nout):
+    """
+    Get the indices of the nout points to keep of a series with
+    the Largest-Triangle-Three-Buckets algorithm (Steinarsson 2013):
+    the first and last point are kept, and from each of nout - 2
+    buckets of equal size the point forming the largest triangle
+    with the point kept from the previous bucket and the mean of the
+    next bucket.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = y.shape[0]
+    if nout >= n or nout < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, nout - 1).astype(np.int64)
+    starts = edges[:-1]
+    ends = edges[1:]
+
+    # means of the buckets, with the last point as the bucket after the last
+    counts = ends - starts
+    xmean = np.add.reduceat(x[: n - 1], starts) / counts
+    ymean = np.add.reduceat(y[: n - 1], starts) / counts
+    xnext = np.r_[xmean[1:], x[-1]]
+    ynext = np.r_[ymean[1:], y[-1]]
+
+    keep = np.empty(nout, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for b in range(nout - 2):
+        s = starts[b]
+        e = ends[b]
+        area = np.abs(
+            (x[a] - xnext[b]) * (y[s:e] - y[a]) - (x[a] - x[s:e]) * (ynext[b] - y[a])
+        )
+        a = s + int(np.argmax(area))
+        keep[b + 1] = a
+
+    return keep
+
+
+def downsample_indices(x, y, npixels):
+    """
+    Get the indices of the points of a series to plot on an axis
+    npixels wide. Short series are kept as they are; moderately
+    oversampled ones are decimated with LTTB to two points per pixel;
+    long ones with the min/max envelope over one bin per pixel.
+    """
+
+    n = np.shape(y)[0]
+    npixels = max(int(npixels), 1)
+
+    if n <= points_per_pixel_max * npixels:
+        return np.arange(n)
+    if n <= lttb_points_per_pixel_max * npixels:
+        return lttb_indices(x, y, 2 * npixels)
+
+    return minmax_indices(x, y, npixels)
+
+
+def axis_pixels(ax):
+    """
+    Get the width of a matplotlib axis in pixels of its figure.
+    """
+
+    fig = ax.get_figure()
+    return int(np.ceil(ax.get_position().width * fig.get_figwidth() * fig.dpi))
+
+
+def plot(ax, x, y, *args, **kwargs):
+    """
+    Same as ax.plot(x, y, ...), but with the series decimated by
+    downsample_indices() to the width of the axis in pixels first.
+    """
+
+    keep = downsample_indices(x, y, axis_pixels(ax))
+
+    return ax.plot(x[keep], y[keep], *args, **kwargs)
@@ -0,0 +1,611 @@
+# =====================================
+# Helpers to read swift hdf5 files in
+# chunks, shared by the swift-*.py
+# scripts in this directory.
+# =====================================
+
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+
+# number of particles to read per chunk by default
+chunksize_default = 1 << 20
+
+# number of threads to fetch datasets with by default
+nthreads_default = min(8, os.cpu_count() or 1)
+
+# the chunk cache of a chunked dataset holds at least this many of
+# its chunks, so that consecutive partial reads don't decompress the
+# chunks at their boundaries twice; and at least the HDF5 default
+chunk_cache_chunks = 4
+chunk_cache_min = 1 << 20
+
+# old SWIFT header versions -> new SWIFT header versions
+field_aliases = {
+    "Density": "Densities",
+    "SmoothingLength": "SmoothingLengths",
+    "InternalEnergy": "InternalEnergies",
+    "Entropy": "Entropies",
+    "Velocity": "Velocities",
+    "Acceleration": "Accelerations",
+    "Pressure": "Pressures",
+}
+
+
+def resolve_field(group, field):
+    """
+    Get the name of the dataset `field` in the hdf5 group `group`,
+    trying both the old and the new SWIFT naming conventions.
+    Raises a KeyError if neither exists.
+    """
+
+    if field in group:
+        return field
+
+    for old, new in field_aliases.items():
+        if field == old and new in group:
+            return new
+        if field == new and old in group:
+            return old
+
+    raise KeyError("No dataset '{0}' in '{1}'".format(field, group.name))
+
+
+def open_dataset(group, name):
+    """
+    Open the dataset `name` of an hdf5 group with its chunk cache
+    sized to its chunk layout. The HDF5 default of 1 MB is smaller
+    than a single chunk of many snapshots, in which case every
+    partial read decompresses whole chunks again.
+    """
+
+    dset = group[name]
+    if dset.chunks is None:
+        return dset
+
+    chunk_bytes = int(np.prod(dset.chunks)) * dset.dtype.itemsize
+    nbytes = max(chunk_cache_chunks * chunk_bytes, chunk_cache_min)
+    # the number of hash table slots should be a prime ~100 times
+    # the number of chunks fitting into the cache
+    nslots = _next_prime(100 * max(nbytes // chunk_bytes, 1))
+
+    dapl = h5py.h5p.create(h5py.h5p.DATASET_ACCESS)
+    dapl.set_chunk_cache(nslots, nbytes, 1.0)
+    return h5py.Dataset(h5py.h5d.open(group.id, name.encode(), dapl=dapl))
+
+
+def _next_prime(n):
+    """
+    Get the smallest prime >= n.
+    """
+
+    n = max(n, 2)
+    while any(n % d == 0 for d in range(2, int(n**0.5) + 1)):
+        n += 1
+
+    return n
+
+
+def raw_offset(dset):
+    """
+    Get the byte offset of the data of a dataset in its file if the
+    data is stored there as one contiguous, unfiltered block, so
+    that it can be read without going through HDF5. Returns None
+    otherwise, e.g. for chunked or compressed datasets.
+    """
+
+    f = dset.file
+    if f.driver != "sec2" or f.userblock_size != 0:
+        return None
+
+    plist = dset.id.get_create_plist()
+    if plist.get_layout() != h5py.h5d.CONTIGUOUS:
+        return None
+    if plist.get_nfilters() != 0 or plist.get_external_count() != 0:
+        return None
+
+    # None if no data has been written yet
+    return dset.id.get_offset()
+
+
+def memmap_dataset(dset):
+    """
+    Get a read-only np.memmap of a contiguous, unfiltered dataset at
+    its offset in the file, without reading anything yet. The array
+    has the dtype stored in the file, which may be big endian.
+    Returns None for datasets which can't be mapped, e.g. chunked or
+    compressed ones; read those with read_dataset().
+    """
+
+    if dset.ndim == 0 or dset.size == 0:
+        return None
+    offset = raw_offset(dset)
+    if offset is None:
+        return None
+
+    return np.memmap(
+        dset.file.filename,
+        mode="r",
+        dtype=dset.id.get_type().dtype,
+        offset=offset,
+        shape=dset.shape,
+    )
+
+
+def read_dataset(dset, start=None, stop=None, mmap=False):
+    """
+    Read the rows [start, stop) of a dataset, by default all of them.
+
+    Contiguous, unfiltered datasets are read straight from the file
+    at their offset; reading a file releases the GIL, while h5py
+    serializes all calls into HDF5, so such reads run concurrently
+    when issued from several threads. With mmap=True, they aren't
+    read at all, but returned as a read-only memmap view instead, so
+    that the OS page cache serves them. Other datasets are read by
+    h5py directly into the output array.
+    """
+
+    if dset.ndim == 0:
+        return dset[()]
+
+    nrows = dset.shape[0]
+    start = 0 if start is None else max(start, 0)
+    stop = nrows if stop is None else min(stop, nrows)
+    stop = max(stop, start)
+
+    if mmap:
+        mapped = memmap_dataset(dset)
+        if mapped is not None:
+            return mapped[start:stop]
+
+    offset = raw_offset(dset)
+    if offset is None:
+        out = np.empty((stop - start,) + dset.shape[1:], dtype=dset.dtype)
+        if out.size > 0:
+            dset.read_direct(out, source_sel=np.s_[start:stop])
+        return out
+
+    # the dtype as stored in the file, which may be big endian
+    dtype = dset.id.get_type().dtype
+    out = np.empty((stop - start,) + dset.shape[1:], dtype=dtype)
+    row_bytes = out[:1].nbytes if out.shape[0] > 0 else 0
+    buf = memoryview(out.reshape(-1).view(np.uint8))
+    with open(dset.file.filename, "rb", buffering=0) as fh:
+        fh.seek(offset + start * row_bytes)
+        done = 0
+        while done < buf.nbytes:
+            n = fh.readinto(buf[done:])
+            if not n:
+                raise IOError(
+                    "'{0}' ends within dataset '{1}'".format(
+                        dset.file.filename, dset.name
+                    )
+                )
+            done += n
+
+    if not out.dtype.isnative:
+        out = out.astype(out.dtype.newbyteorder("="))
+
+    return out
+
+
+class SnapshotReader(object):
+    """
+    Reader for the particle datasets of a swift hdf5 file. All the
+    (ptype, field) pairs needed are requested at once: fields are
+    resolved with both the old and new naming conventions, pairs
+    naming the same dataset are read only once, chunked datasets get
+    a chunk cache sized to their layout, and the datasets are fetched
+    concurrently by a pool of threads.
+
+    With mmap=True, contiguous, unfiltered datasets are returned as
+    read-only memmap views instead of being read; see
+    read_dataset(). Don't write to the file while they are in use.
+
+    Use as a context manager, or call close() when done.
+    """
+
+    def __init__(self, fname, nthreads=nthreads_default, mmap=False):
+        self.fname = fname
+        self.nthreads = max(nthreads, 1)
+        self.mmap = mmap
+        self.file = h5py.File(fname, "r")
+        self.datasets = {}
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Close the file.
+        """
+
+        self.datasets = {}
+        self.file.close()
+
+        return
+
+    def dataset(self, ptype, field):
+        """
+        Get the open dataset of a (ptype, field) pair. Raises a
+        KeyError if it doesn't exist.
+        """
+
+        if ptype not in self.file:
+            raise KeyError("No group '{0}' in '{1}'".format(ptype, self.fname))
+        group = self.file[ptype]
+        name = resolve_field(group, field)
+        if (ptype, name) not in self.datasets:
+            self.datasets[(ptype, name)] = open_dataset(group, name)
+
+        return self.datasets[(ptype, name)]
+
+    def has(self, ptype, field):
+        """
+        Check whether the file has a (ptype, field) dataset.
+        """
+
+        try:
+            self.dataset(ptype, field)
+        except KeyError:
+            return False
+
+        return True
+
+    def read(self, requests, start=None, stop=None, missing="raise"):
+        """
+        Read rows [start, stop), by default all, of the requested
+        (ptype, field) pairs. Returns a dict (ptype, field) -> array.
+        With missing="skip", pairs which aren't in the file are left
+        out of the result instead of raising a KeyError.
+        """
+
+        # coalesce the requests into one read per dataset
+        reads = {}
+        for ptype, field in dict.fromkeys(requests):
+            try:
+                dset = self.dataset(ptype, field)
+            except KeyError:
+                if missing == "skip":
+                    continue
+                raise
+            reads.setdefault(dset.name, (dset, []))[1].append((ptype, field))
+
+        jobs = list(reads.values())
+        if self.nthreads == 1 or len(jobs) < 2:
+            arrays = [read_dataset(dset, start, stop, self.mmap) for dset, _ in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.nthreads, len(jobs))) as pool:
+                arrays = list(
+                    pool.map(
+                        lambda job: read_dataset(job[0], start, stop, self.mmap), jobs
+                    )
+                )
+
+        out = {}
+        for (_, keys), array in zip(jobs, arrays):
+            for key in keys:
+                out[key] = array
+
+        return out
+
+    def read_records(self, ptype, fields, start, stop, dtype=None):
+        """
+        Read particles [start, stop) of the given fields of `ptype`
+        into a structured array, see record_dtype(). `dtype` may have
+        further fields, which are left uninitialized.
+        """
+
+        if dtype is None:
+            dtype = record_dtype(self.file[ptype], fields)
+        data = self.read([(ptype, field) for field in fields], start, stop)
+
+        rec = np.empty(stop - start, dtype=dtype)
+        for field in fields:
+            rec[field] = data[(ptype, field)]
+
+        return rec
+
+    def iter_records(self, ptype, fields, chunksize=chunksize_default, dtype=None):
+        """
+        Generator yielding structured arrays of at most `chunksize`
+        particles with the given fields of `ptype`, in file order.
+        """
+
+        if dtype is None:
+            dtype = record_dtype(self.file[ptype], fields)
+        npart = self.dataset(ptype, fields[0]).shape[0]
+
+        for start in range(0, npart, chunksize):
+            stop = min(start + chunksize, npart)
+            yield self.read_records(ptype, fields, start, stop, dtype=dtype)
+
+
+def read_fields(fname, requests, start=None, stop=None, missing="raise", mmap=False):
+    """
+    Read the requested (ptype, field) pairs of a swift hdf5 file
+    with a SnapshotReader. See SnapshotReader.read().
+    """
+
+    with SnapshotReader(fname, mmap=mmap) as reader:
+        return reader.read(requests, start=start, stop=stop, missing=missing)
+
+
+def record_dtype(group, fields):
+    """
+    Get a structured numpy dtype holding one record per particle
+    for the given fields. Vector datasets (e.g. Coordinates) become
+    sub-array fields.
+    """
+
+    descr = []
+    for field in fields:
+        dset = group[resolve_field(group, field)]
+        if dset.ndim == 1:
+            descr.append((field, dset.dtype))
+        else:
+            descr.append((field, dset.dtype, dset.shape[1:]))
+
+    return np.dtype(descr)
+
+
+def external_sort(chunks, key, chunksize=chunksize_default, tmpdir=None):
+    """
+    Sort a stream of structured arrays by the field `key` without
+    holding the entire stream in memory.
+
+    Each incoming chunk is sorted and written to a temporary run
+    file; the runs are then merged blockwise, with roughly
+    `chunksize` records in memory at a time. Yields sorted structured
+    arrays. If the whole stream fits into a single chunk, nothing is
+    written to disk.
+    """
+
+    workdir = None
+    runs = []
+    first = None
+
+    try:
+        for chunk in chunks:
+            chunk = chunk[np.argsort(chunk[key], kind="stable")]
+            if workdir is None:
+                if first is None:
+                    first = chunk
+                    continue
+                workdir = tempfile.mkdtemp(prefix="swift-sort-", dir=tmpdir)
+                runs.append(_write_run(workdir, len(runs), first))
+                first = None
+            runs.append(_write_run(workdir, len(runs), chunk))
+
+        if workdir is None:
+            if first is not None:
+                yield first
+            return
+
+        runs = [np.load(run, mmap_mode="r") for run in runs]
+        yield from _merge_runs(runs, key, chunksize)
+
+    finally:
+        if workdir is not None:
+            runs = None
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _write_run(workdir, index, chunk):
+    """
+    Store a sorted run in the temporary directory.
+    """
+
+    fname = os.path.join(workdir, "run{0:06d}.npy".format(index))
+    np.save(fname, chunk)
+    return fname
+
+
+def _merge_runs(runs, key, chunksize):
+    """
+    Merge sorted runs. Per iteration, a block is taken from the
+    front of every run. Everything up to the smallest last key of
+    the blocks which do not exhaust their run is guaranteed to come
+    before any record not yet looked at, so it can be emitted.
+    """
+
+    pos = np.zeros(len(runs), dtype=np.int64)
+    ends = np.array([run.shape[0] for run in runs], dtype=np.int64)
+    block = max(chunksize // len(runs), 1)
+
+    while (pos < ends).any():
+        active = np.flatnonzero(pos < ends)
+        blocks = {}
+        cutoff = None
+        for r in active:
+            stop = min(pos[r] + block, ends[r])
+            blocks[r] = np.asarray(runs[r][pos[r] : stop])
+            if stop < ends[r]:
+                last = blocks[r][key][-1]
+                if cutoff is None or last < cutoff:
+                    cutoff = last
+
+        out = []
+        for r in active:
+            b = blocks[r]
+            if cutoff is None:
+                n = b.shape[0]
+            else:
+                n = np.searchsorted(b[key], cutoff, side="right")
+            out.append(b[:n])
+            pos[r] += n
+
+        merged = np.concatenate(out)
+        yield merged[np.argsort(merged[key], kind="stable")]
+
+
+def npart_in_group(f, ptype):
+    """
+    Get the number of particles of type `ptype` in the open file `f`.
+    """
+
+    group = f[ptype]
+    for name in ("ParticleIDs", "Coordinates", "Masses"):
+        if name in group:
+            return group[name].shape[0]
+
+    raise KeyError("Can't determine particle count in '{0}'".format(ptype))
+
+
+def read_box(f, ndim=None):
+    """
+    Get the box size and the number of dimensions from the header of
+    the open file `f`. The box size is returned with 3 entries: a
+    single value is used for all axes, and the box of a file with
+    fewer dimensions is padded with its last entry, so that it can
+    be applied to 3-component coordinates. `ndim` overrides the
+    Dimension header attribute.
+    """
+
+    header = f["Header"].attrs
+    boxsize = np.ravel(header["BoxSize"]).astype(np.float64)
+    if ndim is None:
+        ndim = int(np.ravel(header.get("Dimension", [3]))[0])
+    if boxsize.shape[0] == 0:
+        raise ValueError("Empty BoxSize in '{0}'".format(f.filename))
+    if boxsize.shape[0] < 3:
+        boxsize = np.append(boxsize, np.repeat(boxsize[-1], 3 - boxsize.shape[0]))
+
+    return boxsize[:3], ndim
+
+
+def periodic_offset(x, centre, boxsize):
+    """
+    Get the periodic distance x - centre along one axis, wrapped
+    into [-boxsize/2, boxsize/2).
+    """
+
+    return np.mod(x - centre + 0.5 * boxsize, boxsize) - 0.5 * boxsize
+
+
+def cell_ranges(f, ptype, axis, lo, hi, boxsize):
+    """
+    Use the Cells/ metadata of a snapshot to find the contiguous
+    ranges of particles [start, stop) in cells which may contain
+    particles within [lo, hi) along the given axis. Cells are padded
+    by one cell size, as particles may have drifted out of their
+    cells. Returns None if the file has no cell metadata.
+    """
+
+    if "Cells" not in f:
+        return None
+
+    cells = f["Cells"]
+    offsets_name = None
+    for name in ["OffsetsInFile", "Offsets"]:
+        if name in cells and ptype in cells[name]:
+            offsets_name = name
+            break
+    if offsets_name is None or "Counts" not in cells or "Centres" not in cells:
+        return None
+
+    size = np.ravel(cells["Meta-data"].attrs["size"])[axis]
+    centres = cells["Centres"][:, axis]
+    counts = cells["Counts"][ptype][:]
+    offsets = cells[offsets_name][ptype][:]
+
+    centre = 0.5 * (lo + hi)
+    half = 0.5 * (hi - lo) + 1.5 * size
+    d = periodic_offset(centres, centre, boxsize)
+    sel = (np.abs(d) < half) & (counts > 0)
+
+    starts = offsets[sel].astype(np.int64)
+    stops = starts + counts[sel].astype(np.int64)
+    order = np.argsort(starts)
+    starts = starts[order]
+    stops = stops[order]
+
+    # merge adjacent ranges to read as few of them as possible
+    ranges = []
+    for start, stop in zip(starts, stops):
+        if len(ranges) > 0 and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], stop)
+        else:
+            ranges.append([start, stop])
+
+    return ranges
+
+
+def read_slab(
+    reader,
+    ptype,
+    fields,
+    axis,
+    lo,
+    hi,
+    boxsize,
+    kernel_gamma=None,
+    chunksize=chunksize_default,
+):
+    """
+    Read the given fields of all particles within the periodic slab
+    lo <= x[axis] < hi of the file of a SnapshotReader. If
+    kernel_gamma is given, all particles whose kernel (radius
+    kernel_gamma * h) overlaps the slab are selected instead.
+
+    Only the particle ranges of cells close to the slab are read if
+    the file has cell metadata; otherwise, the coordinates (and
+    smoothing lengths) are scanned chunk by chunk. Other fields are
+    only read for the chunks containing selected particles.
+
+    Returns a dict of field -> array of the selected particles.
+    """
+
+    coords = reader.dataset(ptype, "Coordinates")
+    npart = coords.shape[0]
+
+    ranges = None
+    if hi - lo < boxsize:
+        ranges = cell_ranges(reader.file, ptype, axis, lo, hi, boxsize)
+    if ranges is None:
+        ranges = [[0, npart]]
+
+    centre = 0.5 * (lo + hi)
+    half = 0.5 * (hi - lo)
+
+    out = {field: [] for field in fields}
+    for start, stop in ranges:
+        for cstart in range(start, stop, chunksize):
+            cstop = min(cstart + chunksize, stop)
+            if hi - lo >= boxsize:
+                sel = slice(None)
+            else:
+                z = read_dataset(coords, cstart, cstop)[:, axis]
+                d = np.abs(periodic_offset(z, centre, boxsize))
+                width = half
+                if kernel_gamma is not None:
+                    hset = reader.dataset(ptype, "SmoothingLengths")
+                    width = half + kernel_gamma * read_dataset(hset, cstart, cstop)
+                sel = np.flatnonzero(d < width)
+                if sel.shape[0] == 0:
+                    continue
+
+            data = reader.read([(ptype, field) for field in fields], cstart, cstop)
+            for field in fields:
+                out[field].append(data[(ptype, field)][sel])
+
+    for field in fields:
+        if len(out[field]) > 0:
+            out[field] = np.concatenate(out[field])
+        else:
+            dset = reader.dataset(ptype, field)
+            out[field] = np.empty((0,) + dset.shape[1:], dtype=dset.dtype)
+
+    return out
@@ -0,0 +1,739 @@
+# =====================================
+# Vectorized SPH slices and projections
+# of particle data onto a pixel grid,
+# shared by the swift-*.py scripts in
+# this directory.
+# =====================================
+
+
+import os
+
+import numpy as np
+import unyt
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+import swift_cache
+import swift_io
+import swift_sph
+
+
+# max number of (particle, pixel) pairs to evaluate at once
+budget_default = 1 << 21
+
+# projected particles wider than this many pixels use the analytic
+# kernel normalisation instead of being renormalised over the pixels;
+# the difference is negligible at that size
+renormalise_radius = 64
+
+# cache subdirectory and default size cap for projected maps
+projection_cache = "projections"
+cache_max_default = 4 << 30
+
+
+def _wrap_positions(x, xmin, length, periodic):
+    """
+    Move periodic coordinates into [xmin, xmin + length).
+    """
+
+    if periodic:
+        return xmin + np.mod(x - xmin, length)
+    return x
+
+
+def _deposit_huge(images, x, y, H, values, dz, nx, ny, extent, w, norm, kdim, periodic):
+    """
+    Deposit particles whose kernel is larger than the whole image by
+    evaluating each of them on every pixel. There are usually only a
+    few of these, so they are done one by one.
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    dx = (xmax - xmin) / nx
+    dy = (ymax - ymin) / ny
+    px = xmin + (np.arange(nx) + 0.5) * dx
+    py = ymin + (np.arange(ny) + 0.5) * dy
+
+    for p in range(x.shape[0]):
+        rx = px - x[p]
+        ry = py - y[p]
+        if periodic[0]:
+            rx = swift_io.periodic_offset(rx, 0.0, xmax - xmin)
+        if periodic[1]:
+            ry = swift_io.periodic_offset(ry, 0.0, ymax - ymin)
+        r2 = rx[:, None] ** 2 + ry[None, :] ** 2
+        if dz is not None:
+            r2 = r2 + dz[p] ** 2
+        weight = (norm / H[p] ** kdim * w(np.sqrt(r2) / H[p])).ravel()
+        for f in range(values.shape[0]):
+            images[f] += values[f, p] * weight
+
+    return
+
+
+def _deposit_loop(
+    images, x, y, H, values, dz, nx, ny, extent, kernel_id, norm, kdim, periodic
+):
+    """
+    Particle loop behind deposit(), compiled with numba if available.
+    Does exactly what the vectorized version does, but evaluates each
+    particle's kernel weights once for all fields without building
+    temporary (particle, pixel) arrays.
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    dx = (xmax - xmin) / nx
+    dy = (ymax - ymin) / ny
+    lx = xmax - xmin
+    ly = ymax - ymin
+    nfields = values.shape[0]
+    projection = dz.shape[0] == 0
+    nmax = max(nx, ny)
+
+    nbufmax = (2 * renormalise_radius + 3) ** 2
+    wbuf = np.empty(nbufmax, dtype=np.float64)
+    kbuf = np.empty(nbufmax, dtype=np.int64)
+
+    for p in range(x.shape[0]):
+        Hp = H[p]
+        dz2 = 0.0
+        if not projection:
+            dz2 = dz[p] ** 2
+            if dz2 >= Hp * Hp:
+                continue
+        radius = np.sqrt(Hp * Hp - dz2)
+        b = max(int(np.ceil(radius / min(dx, dy))), 1)
+        ic = int(np.floor((x[p] - xmin) / dx))
+        jc = int(np.floor((y[p] - ymin) / dy))
+
+        if b > nmax:
+            # kernel larger than the image: evaluate it on every pixel
+            scale = norm / Hp**kdim
+            for i in range(nx):
+                rx = xmin + (i + 0.5) * dx - x[p]
+                if periodic[0]:
+                    rx = (rx + 0.5 * lx) % lx - 0.5 * lx
+                for j in range(ny):
+                    ry = ymin + (j + 0.5) * dy - y[p]
+                    if periodic[1]:
+                        ry = (ry + 0.5 * ly) % ly - 0.5 * ly
+                    q = np.sqrt(rx * rx + ry * ry + dz2) / Hp
+                    w = swift_sph._w_scalar(q, kernel_id, kdim) * scale
+                    for f in range(nfields):
+                        images[f, i * ny + j] += values[f, p] * w
+            continue
+
+        # the weights of particles up to renormalise_radius pixels wide
+        # are buffered, so that projections can be renormalised over
+        # the (possibly off-image) pixels, and so that the fields are
+        # then added in tight loops over the buffer
+        buffered = b <= renormalise_radius
+        renorm = projection and buffered
+        scale = 1.0 if renorm else norm / Hp**kdim
+        nbuf = 0
+        wsum = 0.0
+
+        # only visit the pixel centres within the kernel's disk
+        ilo = int(np.ceil((x[p] - radius - xmin) / dx - 0.5))
+        ihi = int(np.floor((x[p] + radius - xmin) / dx - 0.5))
+        for i in range(ilo, ihi + 1):
+            rx = xmin + (i + 0.5) * dx - x[p]
+            rem = Hp * Hp - dz2 - rx * rx
+            if rem <= 0.0:
+                continue
+            ii = i
+            if periodic[0]:
+                if ii < 0 or ii >= nx:
+                    ii = ii % nx
+            elif i < 0 or i >= nx:
+                if not renorm:
+                    continue
+                ii = -1
+            half = np.sqrt(rem)
+            jlo = int(np.ceil((y[p] - half - ymin) / dy - 0.5))
+            jhi = int(np.floor((y[p] + half - ymin) / dy - 0.5))
+            for j in range(jlo, jhi + 1):
+                jj = j
+                if periodic[1]:
+                    if jj < 0 or jj >= ny:
+                        jj = jj % ny
+                elif j < 0 or j >= ny:
+                    jj = -1
+                ry = ymin + (j + 0.5) * dy - y[p]
+                q = np.sqrt(rx * rx + ry * ry + dz2) / Hp
+                w = swift_sph._w_scalar(q, kernel_id, kdim)
+                wsum += w
+                if ii < 0 or jj < 0 or w == 0.0:
+                    continue
+                k = ii * ny + jj
+                if buffered:
+                    wbuf[nbuf] = w
+                    kbuf[nbuf] = k
+                    nbuf += 1
+                else:
+                    for f in range(nfields):
+                        images[f, k] += values[f, p] * w * scale
+
+        if renorm:
+            if wsum <= 0.0:
+                # smaller than a pixel: everything goes into its own pixel
+                wsum = 1.0
+                i = ic % nx if periodic[0] else ic
+                j = jc % ny if periodic[1] else jc
+                if i >= 0 and i < nx and j >= 0 and j < ny:
+                    wbuf[0] = 1.0
+                    kbuf[0] = i * ny + j
+                    nbuf = 1
+            scale = 1.0 / (wsum * dx * dy)
+
+        for f in range(nfields):
+            vf = values[f, p] * scale
+            for n in range(nbuf):
+                images[f, kbuf[n]] += vf * wbuf[n]
+
+    return
+
+
+if numba is not None:
+    _deposit_loop = numba.njit(cache=True)(_deposit_loop)
+
+
+def deposit(
+    x,
+    y,
+    H,
+    values,
+    nx,
+    ny,
+    extent,
+    dz=None,
+    kernel="cubic spline",
+    periodic=(False, False),
+    budget=budget_default,
+):
+    """
+    Deposit particle values onto an (nx, ny) pixel grid covering
+    extent = (xmin, xmax, ymin, ymax). H are the compact support
+    radii of the kernels (gamma * h).
+
+    values may be an (n_fields, N) array, in which case all fields
+    are deposited in the same pass over the particles, sharing the
+    kernel weights, and an (n_fields, nx, ny) array is returned.
+
+    If dz is None, this is a projection: each particle is spread over
+    the pixels with its 2D kernel, renormalised so that the values
+    are conserved exactly (up to renormalise_radius pixels wide); the
+    result is a sum of values per unit area. Particles smaller than a
+    pixel end up in their own pixel.
+
+    If dz is given, this is a slice at distance dz from the
+    particles: the 3D kernel is evaluated at each pixel centre, and
+    the result is sum_j value_j W(r_j, H_j), e.g. the density if the
+    values are masses.
+
+    If numba is available, a compiled loop over the particles is
+    used. Otherwise, particles are grouped by the radius of their
+    footprint in pixels, and the footprints of all particles of a
+    group are evaluated and binned at once.
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    dx = (xmax - xmin) / nx
+    dy = (ymax - ymin) / ny
+
+    x = _wrap_positions(np.asarray(x, dtype=np.float64), xmin, xmax - xmin, periodic[0])
+    y = _wrap_positions(np.asarray(y, dtype=np.float64), ymin, ymax - ymin, periodic[1])
+    H = np.asarray(H, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    single = values.ndim == 1
+    if single:
+        values = values[None, :]
+    nfields = values.shape[0]
+
+    if dz is None:
+        kdim = 2
+        radius = H
+    else:
+        kdim = 3
+        dz = np.asarray(dz, dtype=np.float64)
+        radius = np.sqrt(np.maximum(H**2 - dz**2, 0.0))
+    w, _, norm, _ = swift_sph.get_kernel(kernel, kdim)
+
+    images = np.zeros((nfields, nx * ny), dtype=np.float64)
+    if x.shape[0] == 0:
+        return _shape_images(images, nx, ny, single)
+
+    if numba is not None and kernel in swift_sph.compiled_kernels:
+        _deposit_loop(
+            images,
+            x,
+            y,
+            H,
+            values,
+            np.empty(0) if dz is None else dz,
+            nx,
+            ny,
+            tuple(float(e) for e in extent),
+            swift_sph.compiled_kernels[kernel],
+            norm,
+            kdim,
+            (bool(periodic[0]), bool(periodic[1])),
+        )
+        return _shape_images(images, nx, ny, single)
+
+    ic = np.floor((x - xmin) / dx).astype(np.int64)
+    jc = np.floor((y - ymin) / dy).astype(np.int64)
+
+    npix = np.maximum(np.ceil(radius / min(dx, dy)), 1.0).astype(np.int64)
+    npix = np.minimum(npix, max(nx, ny) + 1)
+
+    for b in np.unique(npix):
+        ind = np.flatnonzero(npix == b)
+        b = int(b)
+
+        if b > max(nx, ny):
+            _deposit_huge(
+                images,
+                x[ind],
+                y[ind],
+                H[ind],
+                values[:, ind],
+                None if dz is None else dz[ind],
+                nx,
+                ny,
+                extent,
+                w,
+                norm,
+                kdim,
+                periodic,
+            )
+            continue
+
+        off = np.arange(-b, b + 1)
+        oi, oj = np.meshgrid(off, off, indexing="ij")
+        # pixel centres within H are at most b + 1/sqrt(2) pixels away
+        # from the particle's own pixel
+        disk = (oi**2 + oj**2 <= (b + 1) ** 2).ravel()
+        oi = oi.ravel()[disk]
+        oj = oj.ravel()[disk]
+        centre = oi.shape[0] // 2
+        nbatch = max(1, budget // oi.shape[0])
+
+        for start in range(0, ind.shape[0], nbatch):
+            p = ind[start : start + nbatch]
+            pi = ic[p, None] + oi[None, :]
+            pj = jc[p, None] + oj[None, :]
+
+            rx = xmin + (pi + 0.5) * dx - x[p, None]
+            ry = ymin + (pj + 0.5) * dy - y[p, None]
+            r2 = rx**2 + ry**2
+            if dz is not None:
+                r2 += dz[p, None] ** 2
+            weight = w(np.sqrt(r2) / H[p, None])
+
+            if dz is None and b <= renormalise_radius:
+                # renormalise over the (possibly off-image) pixels the
+                # kernel covers, so every particle deposits exactly its value
+                wsum = weight.sum(axis=1)
+                small = wsum <= 0.0
+                weight[small, centre] = 1.0
+                wsum[small] = 1.0
+                weight *= (1.0 / (wsum * dx * dy))[:, None]
+            else:
+                weight *= (norm / H[p] ** kdim)[:, None]
+
+            if periodic[0]:
+                pi = np.mod(pi, nx)
+            if periodic[1]:
+                pj = np.mod(pj, ny)
+            valid = (pi >= 0) & (pi < nx) & (pj >= 0) & (pj < ny) & (weight != 0.0)
+
+            pix = pi[valid] * ny + pj[valid]
+            weight = weight[valid]
+            pvalues = values[:, p[np.nonzero(valid)[0]]]
+            for f in range(nfields):
+                images[f] += np.bincount(
+                    pix, weights=weight * pvalues[f], minlength=nx * ny
+                )
+
+    return _shape_images(images, nx, ny, single)
+
+
+def _shape_images(images, nx, ny, single):
+    """
+    Reshape the flat deposited images to (n_fields, nx, ny), or to
+    (nx, ny) if a single field was given as a 1D array.
+    """
+
+    images = images.reshape(-1, nx, ny)
+    if single:
+        return images[0]
+    return images
+
+
+def tile_particles(x, y, H, nx, ny, extent, tilesize, periodic=(False, False)):
+    """
+    Find the tiles of tilesize x tilesize pixels each particle's
+    kernel (radius H) overlaps. Returns the number of tiles along
+    each axis and a CSR-like pair (indptr, indices), where the
+    particles overlapping tile t = tx * nty + ty are
+    indices[indptr[t] : indptr[t + 1]].
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    dx = (xmax - xmin) / nx
+    dy = (ymax - ymin) / ny
+    ntx = (nx + tilesize - 1) // tilesize
+    nty = (ny + tilesize - 1) // tilesize
+
+    def segments(pos, pmin, d, npix, per):
+        """
+        Get up to two ranges [lo, lo + count) of tiles along one axis
+        for each particle; two if its kernel wraps around a periodic
+        boundary.
+        """
+
+        ntiles = (npix + tilesize - 1) // tilesize
+        plo = np.floor((pos - H - pmin) / d).astype(np.int64)
+        phi = np.floor((pos + H - pmin) / d).astype(np.int64)
+        zero = np.zeros_like(plo)
+
+        if not per:
+            lo = np.maximum(plo, 0) // tilesize
+            hi = np.minimum(phi, npix - 1) // tilesize
+            count = np.where(phi < 0, 0, np.maximum(hi - lo + 1, 0))
+            return [(lo, count), (zero, zero)]
+
+        everything = phi - plo + 1 >= npix
+        a = np.mod(plo, npix)
+        b = a + (phi - plo)
+        wraps = (b >= npix) & ~everything
+        lo1 = np.where(everything, 0, a // tilesize)
+        hi1 = np.where(everything, ntiles - 1, np.minimum(b, npix - 1) // tilesize)
+        hi2 = np.where(wraps, (b - npix) // tilesize, -1)
+        # don't count tiles twice if both ranges meet
+        hi2 = np.minimum(hi2, lo1 - 1)
+        return [(lo1, hi1 - lo1 + 1), (zero, np.maximum(hi2 + 1, 0))]
+
+    xseg = segments(x, xmin, dx, nx, periodic[0])
+    yseg = segments(y, ymin, dy, ny, periodic[1])
+
+    # one entry per (particle, tile) pair
+    parts = []
+    tiles = []
+    for txlo, cx in xseg:
+        for tylo, cy in yseg:
+            counts = cx * cy
+            part = np.repeat(np.arange(x.shape[0], dtype=np.int64), counts)
+            k = np.arange(part.shape[0], dtype=np.int64) - np.repeat(
+                np.cumsum(counts) - counts, counts
+            )
+            tx = txlo[part] + k // cy[part]
+            ty = tylo[part] + k % cy[part]
+            parts.append(part)
+            tiles.append(tx * nty + ty)
+    part = np.concatenate(parts)
+    tile = np.concatenate(tiles)
+
+    order = np.argsort(tile, kind="stable")
+    indices = part[order]
+    indptr = np.zeros(ntx * nty + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(tile, minlength=ntx * nty))
+
+    return ntx, nty, indptr, indices
+
+
+def _deposit_tile(
+    outfile, i0, i1, j0, j1, x, y, H, values, dz, nx, ny, extent, kernel, periodic
+):
+    """
+    Worker: deposit the particles overlapping one tile onto it, and
+    write the tile into its place in the memory-mapped output file.
+    Particle coordinates are already shifted to the tile's periodic
+    image; the tile itself is only periodic along axes it spans
+    completely.
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    dx = (xmax - xmin) / nx
+    dy = (ymax - ymin) / ny
+    tile_extent = (xmin + i0 * dx, xmin + i1 * dx, ymin + j0 * dy, ymin + j1 * dy)
+
+    tile = deposit(
+        x,
+        y,
+        H,
+        values,
+        i1 - i0,
+        j1 - j0,
+        tile_extent,
+        dz=dz,
+        kernel=kernel,
+        periodic=periodic,
+    )
+
+    out = np.load(outfile, mmap_mode="r+")
+    out[:, i0:i1, j0:j1] = tile
+    out.flush()
+    del out
+
+    return i0, j0
+
+
+def deposit_tiled(
+    outfile,
+    x,
+    y,
+    H,
+    values,
+    nx,
+    ny,
+    extent,
+    tilesize=2048,
+    dz=None,
+    kernel="cubic spline",
+    periodic=(False, False),
+    nproc=1,
+    verbose=False,
+):
+    """
+    Same as deposit(), but the image is split into tiles of
+    tilesize x tilesize pixels which are deposited independently
+    by nproc worker processes, each only getting the particles whose
+    kernels overlap its tile. Tiles are written straight into an
+    (n_fields, nx, ny) .npy file, so memory use is bounded by the
+    tile size rather than the image size. Tiles are aligned to the
+    pixel grid of the whole image, so the result is the same as that
+    of deposit(), except for particles with kernels wider than half
+    a periodic box.
+
+    Returns the output file opened as a read-only memmap.
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    dx = (xmax - xmin) / nx
+    dy = (ymax - ymin) / ny
+    lx = xmax - xmin
+    ly = ymax - ymin
+
+    x = _wrap_positions(np.asarray(x, dtype=np.float64), xmin, lx, periodic[0])
+    y = _wrap_positions(np.asarray(y, dtype=np.float64), ymin, ly, periodic[1])
+    H = np.asarray(H, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[None, :]
+    if dz is not None:
+        dz = np.asarray(dz, dtype=np.float64)
+        # the footprint of a slice is only as wide as the kernel at dz
+        radius = np.sqrt(np.maximum(H**2 - dz**2, 0.0))
+    else:
+        radius = H
+
+    out = np.lib.format.open_memmap(
+        outfile, mode="w+", dtype=np.float64, shape=(values.shape[0], nx, ny)
+    )
+    del out
+
+    ntx, nty, indptr, indices = tile_particles(
+        x, y, radius, nx, ny, extent, tilesize, periodic
+    )
+
+    def tasks():
+        for tx in range(ntx):
+            for ty in range(nty):
+                t = tx * nty + ty
+                p = indices[indptr[t] : indptr[t + 1]]
+                if p.shape[0] == 0:
+                    # the output file is already zeroed
+                    continue
+                i0 = tx * tilesize
+                i1 = min(i0 + tilesize, nx)
+                j0 = ty * tilesize
+                j1 = min(j0 + tilesize, ny)
+
+                # move particles to the periodic image closest to the tile
+                xp = x[p]
+                yp = y[p]
+                if periodic[0]:
+                    cx = xmin + 0.5 * (i0 + i1) * dx
+                    xp = cx + swift_io.periodic_offset(xp, cx, lx)
+                if periodic[1]:
+                    cy = ymin + 0.5 * (j0 + j1) * dy
+                    yp = cy + swift_io.periodic_offset(yp, cy, ly)
+
+                yield (
+                    outfile,
+                    i0,
+                    i1,
+                    j0,
+                    j1,
+                    xp,
+                    yp,
+                    H[p],
+                    values[:, p],
+                    None if dz is None else dz[p],
+                    nx,
+                    ny,
+                    extent,
+                    kernel,
+                    (periodic[0] and ntx == 1, periodic[1] and nty == 1),
+                )
+
+    ntiles = ntx * nty
+    done = 0
+    with ProcessPoolExecutor(max_workers=max(nproc, 1)) as pool:
+        # only keep a few tiles' particles in flight at a time
+        pending = set()
+        for task in tasks():
+            pending.add(pool.submit(_deposit_tile, *task))
+            if len(pending) >= 2 * max(nproc, 1):
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    fut.result()
+                    done += 1
+                    if verbose:
+                        print("Finished tile {0}/{1}".format(done, ntiles))
+        for fut in pending:
+            fut.result()
+            done += 1
+            if verbose:
+                print("Finished tile {0}/{1}".format(done, ntiles))
+
+    return np.load(outfile, mmap_mode="r")
+
+
+def project_gas_fields(
+    data,
+    fields,
+    resolution,
+    kernel="wendland C2",
+    tilesize=None,
+    outfile=None,
+    nproc=1,
+):
+    """
+    Project several gas fields of a snapshot loaded with
+    swiftsimio.load() along z in one pass, as a fused replacement for
+    calling swiftsimio's project_gas() once per field. Vector fields
+    are projected as their norm. Each map is the sum of the field
+    times the kernel per unit area over the whole box, as in
+    project_gas().
+
+    If tilesize is given, the maps are deposited tile by tile with
+    deposit_tiled() into the .npy file outfile, using nproc
+    processes, and returned as a memmap.
+
+    Returns the (n_fields, resolution, resolution) array of maps in
+    units of the box size and a list of their units.
+    """
+
+    gas = data.gas
+    boxsize = data.metadata.boxsize
+    length_units = boxsize.units
+    L = boxsize.to(length_units).value
+
+    x = gas.coordinates.to(length_units).value
+    try:
+        h = gas.smoothing_lengths
+    except AttributeError:
+        h = gas.smoothing_length
+    h = h.to(length_units).value
+    # the projected kernel is a 2D kernel, as in project_gas()
+    _, _, _, kernel_gamma = swift_sph.get_kernel(kernel, 2)
+
+    values = np.empty((len(fields), x.shape[0]), dtype=np.float64)
+    units = []
+    for f, field in enumerate(fields):
+        arr = getattr(gas, field)
+        units.append(arr.units / length_units**2)
+        arr = np.asarray(arr.value, dtype=np.float64)
+        if arr.ndim > 1:
+            arr = np.sqrt(np.sum(arr**2, axis=1))
+        values[f] = arr
+
+    if tilesize is not None:
+        maps = deposit_tiled(
+            outfile,
+            x[:, 0],
+            x[:, 1],
+            kernel_gamma * h,
+            values,
+            resolution,
+            resolution,
+            (0.0, L[0], 0.0, L[1]),
+            tilesize=tilesize,
+            kernel=kernel,
+            periodic=(True, True),
+            nproc=nproc,
+            verbose=True,
+        )
+    else:
+        maps = deposit(
+            x[:, 0],
+            x[:, 1],
+            kernel_gamma * h,
+            values,
+            resolution,
+            resolution,
+            (0.0, L[0], 0.0, L[1]),
+            kernel=kernel,
+            periodic=(True, True),
+        )
+
+    return maps, units
+
+
+def project_gas_fields_cached(
+    data, fields, resolution, kernel="wendland C2", max_bytes=cache_max_default
+):
+    """
+    Same as project_gas_fields(), but each map is stored in the
+    on-disk cache together with its units, keyed on the snapshot's
+    path, modification time and size, the field, resolution, region
+    and kernel. Only the fields which aren't cached yet are
+    projected, in a single pass. The cache is then trimmed to
+    max_bytes, evicting the least recently used maps first.
+    """
+
+    boxsize = data.metadata.boxsize
+    L = boxsize.to(boxsize.units).value
+    region = (0.0, float(L[0]), 0.0, float(L[1]), str(boxsize.units))
+    snapshot = swift_cache.file_key(data.filename)
+
+    keys = [
+        swift_cache.hash_key(snapshot, "gas", field, resolution, region, kernel)
+        for field in fields
+    ]
+
+    maps = [None] * len(fields)
+    units = [None] * len(fields)
+    missing = []
+    for f, key in enumerate(keys):
+        path = swift_cache.entry_path(projection_cache, key)
+        if path is None:
+            missing.append(f)
+            continue
+        maps[f] = np.load(os.path.join(path, "map.npy"))
+        with open(os.path.join(path, "units.txt")) as unitfile:
+            units[f] = unyt.Unit(unitfile.read().strip())
+
+    if len(missing) > 0:
+        new_maps, new_units = project_gas_fields(
+            data, [fields[f] for f in missing], resolution, kernel=kernel
+        )
+        for f, new_map, new_unit in zip(missing, new_maps, new_units):
+            maps[f] = new_map
+            units[f] = new_unit
+            outdir = swift_cache.new_entry(projection_cache)
+            np.save(os.path.join(outdir, "map.npy"), new_map)
+            with open(os.path.join(outdir, "units.txt"), "w") as unitfile:
+                unitfile.write(str(new_unit) + "\n")
+            swift_cache.commit_entry(projection_cache, keys[f], outdir)
+
+    swift_cache.evict(projection_cache, max_bytes)
+
+    return np.stack(maps), units
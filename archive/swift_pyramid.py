@@ -0,0 +1,194 @@
+# =====================================
+# Multi-resolution quadtree pyramids of
+# projected maps, stored as tiled arrays
+# on disk, shared by the swift-*.py
+# scripts in this directory.
+# =====================================
+
+
+import json
+import os
+
+import numpy as np
+
+
+pyramid_version = 1
+meta_file = "pyramid.json"
+
+
+def level_file(outdir, level):
+    """
+    Get the file name of a pyramid level.
+    """
+
+    return os.path.join(outdir, "level{0:02d}.npy".format(level))
+
+
+def retile(image, outfile, tilesize):
+    """
+    Copy an (n_fields, nx, ny) image, e.g. a memmap, into a tiled
+    (n_fields, ntx, nty, tilesize, tilesize) .npy file, so that each
+    tile is contiguous on disk. nx and ny must be multiples of
+    tilesize. Copies one row of tiles at a time.
+    """
+
+    nfields, nx, ny = image.shape
+    ntx = nx // tilesize
+    nty = ny // tilesize
+
+    out = np.lib.format.open_memmap(
+        outfile,
+        mode="w+",
+        dtype=image.dtype,
+        shape=(nfields, ntx, nty, tilesize, tilesize),
+    )
+    for tx in range(ntx):
+        rows = np.asarray(image[:, tx * tilesize : (tx + 1) * tilesize, :])
+        rows = rows.reshape(nfields, tilesize, nty, tilesize)
+        out[:, tx] = rows.transpose(0, 2, 1, 3)
+    out.flush()
+    del out
+
+    return
+
+
+def downsample_level(infile, outfile):
+    """
+    Build the next coarser tiled level from the tiled level in infile.
+    Each coarse tile is made of 2 x 2 fine tiles, with each coarse
+    pixel the mean of 2 x 2 fine pixels, which keeps per-area maps
+    such as projections consistent between levels.
+    """
+
+    fine = np.load(infile, mmap_mode="r")
+    nfields, ntx, nty, tilesize, _ = fine.shape
+    half = tilesize // 2
+
+    out = np.lib.format.open_memmap(
+        outfile,
+        mode="w+",
+        dtype=fine.dtype,
+        shape=(nfields, ntx // 2, nty // 2, tilesize, tilesize),
+    )
+    for tx in range(ntx):
+        for ty in range(nty):
+            tile = np.asarray(fine[:, tx, ty])
+            coarse = tile.reshape(nfields, half, 2, half, 2).mean(axis=(2, 4))
+            i0 = (tx % 2) * half
+            j0 = (ty % 2) * half
+            out[:, tx // 2, ty // 2, i0 : i0 + half, j0 : j0 + half] = coarse
+    out.flush()
+    del out, fine
+
+    return
+
+
+def build_pyramid(outdir, finest, extent, tilesize, fields=None, units=None):
+    """
+    Build a quadtree pyramid in the directory outdir from the finest
+    level, an (n_fields, nx, nx) image with nx = tilesize * 2^k, e.g.
+    the memmap written by swift_projection.deposit_tiled(). Level k
+    is the finest one, level 0 a single tile of the whole extent;
+    each level is stored tiled by retile(). fields and units are
+    stored with the pyramid's metadata to label the maps.
+    """
+
+    nfields, nx, ny = finest.shape
+    if nx != ny or nx % tilesize != 0:
+        raise ValueError("Finest level must be square with a multiple of tilesize")
+    levels = int(round(np.log2(nx // tilesize))) + 1
+    if tilesize * 2 ** (levels - 1) != nx:
+        raise ValueError("Finest level size must be tilesize times a power of 2")
+
+    os.makedirs(outdir, exist_ok=True)
+
+    retile(finest, level_file(outdir, levels - 1), tilesize)
+    for level in range(levels - 2, -1, -1):
+        downsample_level(level_file(outdir, level + 1), level_file(outdir, level))
+
+    meta = {
+        "version": pyramid_version,
+        "levels": levels,
+        "tilesize": tilesize,
+        "extent": [float(e) for e in extent],
+        "fields": fields,
+        "units": None if units is None else [str(u) for u in units],
+    }
+    tmpname = os.path.join(outdir, meta_file + ".tmp{0}".format(os.getpid()))
+    with open(tmpname, "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmpname, os.path.join(outdir, meta_file))
+
+    return meta
+
+
+def load_meta(outdir):
+    """
+    Read a pyramid's metadata.
+    """
+
+    with open(os.path.join(outdir, meta_file), "r") as f:
+        meta = json.load(f)
+
+    if meta.get("version") != pyramid_version:
+        raise ValueError(
+            "Pyramid in '{0}' has version {1}, expected {2}".format(
+                outdir, meta.get("version"), pyramid_version
+            )
+        )
+
+    return meta
+
+
+def fetch(outdir, level, region=None, meta=None):
+    """
+    Get the maps of a region = (xmin, xmax, ymin, ymax) at the given
+    level of the pyramid in outdir, reading only the tiles which
+    overlap the region. The region is widened to whole pixels and
+    clipped to the pyramid's extent; None means the whole extent.
+
+    Returns the (n_fields, nx, ny) maps and their actual extent.
+    """
+
+    if meta is None:
+        meta = load_meta(outdir)
+    if level < 0 or level >= meta["levels"]:
+        raise ValueError(
+            "Level {0} not in pyramid with {1} levels".format(level, meta["levels"])
+        )
+
+    tilesize = meta["tilesize"]
+    xmin, xmax, ymin, ymax = meta["extent"]
+    npix = tilesize * 2**level
+    dx = (xmax - xmin) / npix
+    dy = (ymax - ymin) / npix
+
+    if region is None:
+        region = meta["extent"]
+    i0 = int(np.clip(np.floor((region[0] - xmin) / dx), 0, npix))
+    i1 = int(np.clip(np.ceil((region[1] - xmin) / dx), 0, npix))
+    j0 = int(np.clip(np.floor((region[2] - ymin) / dy), 0, npix))
+    j1 = int(np.clip(np.ceil((region[3] - ymin) / dy), 0, npix))
+
+    tiles = np.load(level_file(outdir, level), mmap_mode="r")
+    nfields = tiles.shape[0]
+    image = np.empty((nfields, max(i1 - i0, 0), max(j1 - j0, 0)), dtype=tiles.dtype)
+
+    for tx in range(i0 // tilesize, (i1 - 1) // tilesize + 1 if i1 > i0 else 0):
+        a0 = max(i0, tx * tilesize)
+        a1 = min(i1, (tx + 1) * tilesize)
+        for ty in range(j0 // tilesize, (j1 - 1) // tilesize + 1 if j1 > j0 else 0):
+            b0 = max(j0, ty * tilesize)
+            b1 = min(j1, (ty + 1) * tilesize)
+            image[:, a0 - i0 : a1 - i0, b0 - j0 : b1 - j0] = tiles[
+                :,
+                tx,
+                ty,
+                a0 - tx * tilesize : a1 - tx * tilesize,
+                b0 - ty * tilesize : b1 - ty * tilesize,
+            ]
+    del tiles
+
+    extent = (xmin + i0 * dx, xmin + i1 * dx, ymin + j0 * dy, ymin + j1 * dy)
+
+    return image, extent
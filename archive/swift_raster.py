@@ -0,0 +1,136 @@
+# =====================================
+# Rasterized, density shaded particle
+# scatter images, shared by the
+# swift-*.py scripts in this directory.
+# =====================================
+
+
+import h5py
+import numpy as np
+
+import swift_io
+
+
+# particle types drawn by default, in drawing order: name, group, color
+particle_layers = [
+    ("DM", "PartType1", (1.0, 0.0, 0.0)),
+    ("gas", "PartType0", (0.0, 0.0, 1.0)),
+    ("stars", "PartType4", (1.0, 0.84, 0.0)),
+]
+
+
+def count_grid(x, y, nx, ny, extent, counts=None):
+    """
+    Bin positions x, y into an (nx, ny) grid of particle counts over
+    extent = (xmin, xmax, ymin, ymax). Particles outside the extent
+    are ignored. If counts is given, the particles are added to it.
+    """
+
+    xmin, xmax, ymin, ymax = extent
+    if counts is None:
+        counts = np.zeros((nx, ny), dtype=np.int64)
+
+    i = np.floor((x - xmin) * (nx / (xmax - xmin))).astype(np.int64)
+    j = np.floor((y - ymin) * (ny / (ymax - ymin))).astype(np.int64)
+    inside = (i >= 0) & (i < nx) & (j >= 0) & (j < ny)
+
+    counts += np.bincount(i[inside] * ny + j[inside], minlength=nx * ny).reshape(nx, ny)
+
+    return counts
+
+
+def count_grid_file(f, ptype, nx, ny, extent, axes=(0, 1), chunksize=None):
+    """
+    Bin the particles of type ptype of the open file f into an
+    (nx, ny) count grid, reading the coordinates chunk by chunk.
+    Returns None if there are no such particles.
+    """
+
+    if ptype not in f:
+        return None
+    if chunksize is None:
+        chunksize = swift_io.chunksize_default
+
+    dset = f[ptype]["Coordinates"]
+    counts = np.zeros((nx, ny), dtype=np.int64)
+    for start in range(0, dset.shape[0], chunksize):
+        x = dset[start : start + chunksize]
+        count_grid(x[:, axes[0]], x[:, axes[1]], nx, ny, extent, counts)
+
+    return counts
+
+
+def file_count_grids(fname, nx, ny, layers=None, chunksize=None):
+    """
+    Get the count grids of all particle layers present in a file,
+    over the whole box in the x-y plane. Returns a list of
+    (name, color, counts) and the box size.
+    """
+
+    if layers is None:
+        layers = particle_layers
+
+    grids = []
+    with h5py.File(fname, "r") as f:
+        boxsize, _ = swift_io.read_box(f)
+        extent = (0.0, boxsize[0], 0.0, boxsize[1])
+        for name, ptype, color in layers:
+            counts = count_grid_file(f, ptype, nx, ny, extent, chunksize=chunksize)
+            if counts is not None and counts.sum() > 0:
+                grids.append((name, color, counts))
+
+    return grids, boxsize
+
+
+def shade(counts, mode="log", vmax=None):
+    """
+    Map a count grid to intensities in [0, 1]. Empty pixels are 0.
+
+    mode "log": log(1 + counts) / log(1 + vmax), with vmax the
+        largest count unless given, so that several images can share
+        the same scale.
+    mode "eq": histogram equalisation, i.e. each non-empty pixel's
+        intensity is the fraction of non-empty pixels with at most
+        its count.
+    """
+
+    counts = np.asarray(counts)
+
+    if mode == "log":
+        if vmax is None:
+            vmax = counts.max()
+        if vmax <= 0:
+            return np.zeros(counts.shape)
+        return np.clip(np.log1p(counts) / np.log1p(vmax), 0.0, 1.0)
+
+    if mode == "eq":
+        intensity = np.zeros(counts.shape)
+        nonzero = counts > 0
+        if not nonzero.any():
+            return intensity
+        values, occurrences = np.unique(counts[nonzero], return_counts=True)
+        cdf = np.cumsum(occurrences) / occurrences.sum()
+        intensity[nonzero] = cdf[np.searchsorted(values, counts[nonzero])]
+        return intensity
+
+    raise ValueError("Unknown shading mode '{0}'".format(mode))
+
+
+def composite(layers, background=(1.0, 1.0, 1.0)):
+    """
+    Composite a list of (color, intensity) layers, each intensity an
+    (nx, ny) array in [0, 1], over a background color. Each layer is
+    drawn over the previous ones with its intensity as opacity.
+    Returns an (ny, nx, 3) RGB image to be shown with
+    imshow(..., origin="lower").
+    """
+
+    nx, ny = layers[0][1].shape
+    rgb = np.empty((ny, nx, 3))
+    rgb[:] = background
+
+    for color, intensity in layers:
+        alpha = intensity.T[:, :, None]
+        rgb = rgb * (1.0 - alpha) + np.asarray(color)[None, None, :] * alpha
+
+    return rgb
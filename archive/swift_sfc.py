@@ -0,0 +1,119 @@
+# =====================================
+# Space-filling curve keys of particle
+# positions, shared by the swift-*.py
+# scripts in this directory.
+# =====================================
+
+
+import numpy as np
+
+
+curves = ["hilbert", "morton"]
+
+
+def bits_default(ndim):
+    """
+    Get the number of bits per dimension such that a key fits into
+    63 bits, but at most 32.
+    """
+
+    return min(63 // ndim, 32)
+
+
+def grid_coordinates(x, boxsize, bits):
+    """
+    Get the integer coordinates in [0, 2^bits) of positions x of
+    shape (n, ndim) in a periodic box. Positions outside the box are
+    wrapped into it.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    boxsize = np.asarray(boxsize, dtype=np.float64)
+    nmax = (1 << bits) - 1
+
+    scaled = np.mod(x, boxsize) / boxsize * (1 << bits)
+    ix = np.floor(scaled).astype(np.uint64)
+    np.minimum(ix, np.uint64(nmax), out=ix)
+
+    return ix
+
+
+def interleave(ix, bits):
+    """
+    Interleave the bits of integer coordinates of shape (n, ndim),
+    most significant first, with the first axis leading.
+    """
+
+    n, ndim = ix.shape
+    keys = np.zeros(n, dtype=np.uint64)
+    one = np.uint64(1)
+    for b in range(bits - 1, -1, -1):
+        for d in range(ndim):
+            keys <<= one
+            keys |= (ix[:, d] >> np.uint64(b)) & one
+
+    return keys
+
+
+def morton_keys(x, boxsize, bits):
+    """
+    Get the Morton (Z-order) keys of positions x of shape (n, ndim).
+    """
+
+    return interleave(grid_coordinates(x, boxsize, bits), bits)
+
+
+def hilbert_keys(x, boxsize, bits):
+    """
+    Get the Peano-Hilbert keys of positions x of shape (n, ndim),
+    using Skilling's transform of the coordinates (AIP Conf. Proc.
+    707, 381 (2004)) vectorized over the particles.
+    """
+
+    ix = grid_coordinates(x, boxsize, bits)
+    ndim = ix.shape[1]
+    X = [ix[:, d].copy() for d in range(ndim)]
+
+    # inverse undo of the excess work
+    q = 1 << (bits - 1)
+    while q > 1:
+        Q = np.uint64(q)
+        P = np.uint64(q - 1)
+        for d in range(ndim):
+            high = (X[d] & Q) != 0
+            # invert the low bits of X[0] where the bit is set, and
+            # exchange them between X[0] and X[d] where it isn't
+            t = np.where(high, P, (X[0] ^ X[d]) & P)
+            X[0] ^= t
+            if d > 0:
+                X[d] ^= np.where(high, np.uint64(0), t)
+        q >>= 1
+
+    # Gray encode
+    for d in range(1, ndim):
+        X[d] ^= X[d - 1]
+    t = np.zeros(ix.shape[0], dtype=np.uint64)
+    q = 1 << (bits - 1)
+    while q > 1:
+        t ^= np.where((X[ndim - 1] & np.uint64(q)) != 0, np.uint64(q - 1), 0).astype(
+            np.uint64
+        )
+        q >>= 1
+    for d in range(ndim):
+        X[d] ^= t
+
+    return interleave(np.stack(X, axis=1), bits)
+
+
+def keys(x, boxsize, bits, curve="hilbert"):
+    """
+    Get the keys of positions x of shape (n, ndim) along the given
+    curve, one of `curves`.
+    """
+
+    if curve == "hilbert":
+        return hilbert_keys(x, boxsize, bits)
+    if curve == "morton":
+        return morton_keys(x, boxsize, bits)
+
+    raise ValueError("Unknown curve '{0}'; use one of {1}".format(curve, curves))
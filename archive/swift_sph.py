@@ -0,0 +1,869 @@
+# =====================================
+# Vectorized SPH kernels and density
+# estimates for particle data, shared
+# by the swift-*.py scripts in this
+# directory.
+# =====================================
+
+
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+import swift_cache
+
+
+# number of particles to query neighbours for at once
+chunksize_default = 1 << 16
+
+# the cell grid neighbour search is used if its particle pair
+# candidates are at most this many times the number of neighbours
+# wanted; otherwise, e.g. for strongly clustered particles with a
+# few very large smoothing lengths, the tree is faster
+grid_candidates_max = 64
+
+
+def _w_cubic_spline(q):
+    """
+    Cubic spline kernel shape w(q), q = r / H in [0, 1].
+    """
+
+    w = np.zeros_like(q)
+    inner = q < 0.5
+    outer = (q >= 0.5) & (q < 1.0)
+    qi = q[inner]
+    w[inner] = 0.5 - 3.0 * qi**2 + 3.0 * qi**3
+    w[outer] = (1.0 - q[outer]) ** 3
+    return w
+
+
+def _dwdq_cubic_spline(q):
+    """
+    Derivative of the cubic spline kernel shape dw/dq.
+    """
+
+    dw = np.zeros_like(q)
+    inner = q < 0.5
+    outer = (q >= 0.5) & (q < 1.0)
+    qi = q[inner]
+    dw[inner] = 9.0 * qi**2 - 6.0 * qi
+    dw[outer] = -3.0 * (1.0 - q[outer]) ** 2
+    return dw
+
+
+def _w_wendland_C2(q):
+    """
+    Wendland C2 kernel shape w(q) for 2D and 3D.
+    """
+
+    w = np.zeros_like(q)
+    inside = q < 1.0
+    qi = q[inside]
+    w[inside] = (1.0 - qi) ** 4 * (1.0 + 4.0 * qi)
+    return w
+
+
+def _dwdq_wendland_C2(q):
+    """
+    Derivative of the Wendland C2 kernel shape dw/dq for 2D and 3D.
+    """
+
+    dw = np.zeros_like(q)
+    inside = q < 1.0
+    qi = q[inside]
+    dw[inside] = -20.0 * qi * (1.0 - qi) ** 3
+    return dw
+
+
+def _w_wendland_C2_1D(q):
+    """
+    Wendland C2 kernel shape w(q) for 1D.
+    """
+
+    w = np.zeros_like(q)
+    inside = q < 1.0
+    qi = q[inside]
+    w[inside] = (1.0 - qi) ** 3 * (1.0 + 3.0 * qi)
+    return w
+
+
+def _dwdq_wendland_C2_1D(q):
+    """
+    Derivative of the Wendland C2 kernel shape dw/dq for 1D.
+    """
+
+    dw = np.zeros_like(q)
+    inside = q < 1.0
+    qi = q[inside]
+    dw[inside] = -12.0 * qi * (1.0 - qi) ** 2
+    return dw
+
+
+# kernel name -> dimension -> (w, dw/dq, normalisation, gamma = H / h)
+# Normalisations are for W(r, H) = norm / H^ndim * w(r / H), with
+# H the compact support radius; gamma as defined in SWIFT.
+kernels = {
+    "cubic spline": {
+        1: (_w_cubic_spline, _dwdq_cubic_spline, 8.0 / 3.0, 1.732051),
+        2: (_w_cubic_spline, _dwdq_cubic_spline, 80.0 / (7.0 * np.pi), 1.778002),
+        3: (_w_cubic_spline, _dwdq_cubic_spline, 16.0 / np.pi, 1.825742),
+    },
+    "wendland C2": {
+        1: (_w_wendland_C2_1D, _dwdq_wendland_C2_1D, 5.0 / 4.0, 1.620185),
+        2: (_w_wendland_C2, _dwdq_wendland_C2, 7.0 / np.pi, 1.897367),
+        3: (_w_wendland_C2, _dwdq_wendland_C2, 21.0 / (2.0 * np.pi), 1.936492),
+    },
+}
+
+
+# kernels the compiled loops know about
+compiled_kernels = {"cubic spline": 0, "wendland C2": 1}
+
+
+def _w_scalar(q, kernel_id, ndim):
+    """
+    Kernel shape w(q) of a single q, for the compiled loops.
+    """
+
+    if q >= 1.0:
+        return 0.0
+    t = 1.0 - q
+    if kernel_id == 0:
+        if q < 0.5:
+            return 0.5 - 3.0 * q * q * t
+        return t * t * t
+    if ndim == 1:
+        return t * t * t * (1.0 + 3.0 * q)
+    t2 = t * t
+    return t2 * t2 * (1.0 + 4.0 * q)
+
+
+if numba is not None:
+    _w_scalar = numba.njit(cache=True)(_w_scalar)
+
+
+def get_kernel(kernel, ndim):
+    """
+    Get the kernel shape function w(q), its derivative, the
+    normalisation constant and gamma = H / h for a kernel name and
+    number of dimensions.
+    """
+
+    try:
+        return kernels[kernel][ndim]
+    except KeyError:
+        raise ValueError(
+            "Kernel '{0}' in {1}D not available. Have: {2}".format(
+                kernel, ndim, list(kernels.keys())
+            )
+        )
+
+
+def kernel_W(r, H, kernel="cubic spline", ndim=3):
+    """
+    Evaluate the kernel W(r, H) for arrays of distances r and
+    compact support radii H (broadcast against each other).
+    """
+
+    w, _, norm, _ = get_kernel(kernel, ndim)
+    r = np.asarray(r, dtype=np.float64)
+    H = np.asarray(H, dtype=np.float64)
+    q = r / H
+    return norm / H**ndim * w(q)
+
+
+def neighbour_lists(
+    x, k, boxsize=None, cache=True, chunksize=chunksize_default, workers=-1
+):
+    """
+    Get the k nearest neighbours of all particles at positions x, in
+    CSR layout: the neighbours of particle i are
+    indices[indptr[i]:indptr[i+1]] at distances
+    distances[indptr[i]:indptr[i+1]], sorted by distance.
+
+    With cache=True, the lists are stored on disk, keyed on the
+    content of x, the box size and k, and returned as read-only
+    memory maps. Repeated calls with unchanged data then skip building
+    the tree and querying it entirely.
+    """
+
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    npart = x.shape[0]
+    k = min(k, npart)
+
+    if cache:
+        box = None if boxsize is None else np.asarray(boxsize, dtype=np.float64)
+        key = swift_cache.hash_key(x, box, k)
+        path = swift_cache.entry_path("neighbours", key)
+        if path is not None:
+            return tuple(
+                np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                for name in ["indptr", "indices", "distances"]
+            )
+        outdir = swift_cache.new_entry("neighbours")
+
+        def allocate(name, dtype, shape):
+            return np.lib.format.open_memmap(
+                os.path.join(outdir, name + ".npy"),
+                mode="w+",
+                dtype=dtype,
+                shape=shape,
+            )
+
+    else:
+
+        def allocate(name, dtype, shape):
+            return np.empty(shape, dtype=dtype)
+
+    # all rows have k entries, but keep the general CSR layout so the
+    # lists can be used like any other sparse neighbour list.
+    indptr = allocate("indptr", np.int64, (npart + 1,))
+    indptr[:] = np.arange(npart + 1, dtype=np.int64) * k
+    indices = allocate("indices", np.int64, (npart * k,))
+    distances = allocate("distances", np.float64, (npart * k,))
+
+    tree = cKDTree(x, boxsize=boxsize)
+    for start in range(0, npart, chunksize):
+        stop = min(start + chunksize, npart)
+        dist, neighs = tree.query(x[start:stop], k=k, workers=workers)
+        indices[start * k : stop * k] = neighs.reshape(-1)
+        distances[start * k : stop * k] = dist.reshape(-1)
+
+    if cache:
+        for arr in [indptr, indices, distances]:
+            arr.flush()
+        del indptr, indices, distances
+        path = swift_cache.commit_entry("neighbours", key, outdir)
+        return tuple(
+            np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+            for name in ["indptr", "indices", "distances"]
+        )
+
+    return indptr, indices, distances
+
+
+def _select_smallest(keys, values, n, k):
+    """
+    Partially sort keys[:n] in place with quickselect, such that
+    keys[:k] are the k smallest, moving values along with them.
+    """
+
+    lo = 0
+    hi = n - 1
+    while lo < hi:
+        pivot = keys[(lo + hi) // 2]
+        i = lo
+        j = hi
+        while i <= j:
+            while keys[i] < pivot:
+                i += 1
+            while keys[j] > pivot:
+                j -= 1
+            if i <= j:
+                keys[i], keys[j] = keys[j], keys[i]
+                values[i], values[j] = values[j], values[i]
+                i += 1
+                j -= 1
+        if k - 1 <= j:
+            hi = j
+        elif k - 1 >= i:
+            lo = i
+        else:
+            break
+
+    return
+
+
+def _grid_density(
+    xq,
+    qcell,
+    order,
+    support,
+    k,
+    x,
+    m,
+    cell_start,
+    cell_particles,
+    ncells,
+    origin,
+    cellsize,
+    box,
+    kernel_id,
+    norm,
+):
+    """
+    Density estimate of approximate_density() at the query points
+    xq on a cell grid, compiled with numba if available: the up to k
+    nearest particles with distance < support are found, the kernel
+    support radius is set to the distance of the furthest of them,
+    and their kernel weighted masses are summed up. Also returns the
+    number of neighbours used for each point.
+
+    The grid has ncells cells per axis, each at least as large as
+    the largest support; the particles of cell c are
+    cell_particles[cell_start[c]:cell_start[c+1]], and cell c's
+    lower corner is at origin + c * cellsize. Axes with box > 0 are
+    periodic with that period, and all points must be within
+    [0, box) along them. qcell holds the cell of each query point,
+    and order sorts the query points by cell, so that the candidate
+    neighbours of a cell are gathered only once; each query point
+    then skips those neighbouring cells which are out of its reach.
+    """
+
+    nq = xq.shape[0]
+    ndim = xq.shape[1]
+    rho = np.zeros(nq)
+    count = np.zeros(nq, dtype=np.int64)
+
+    c = np.empty(ndim, dtype=np.int64)
+    offset = np.empty(ndim, dtype=np.int64)
+    shift = np.empty(ndim)
+    nseg = 3**ndim
+    seg_lo = np.empty((ndim, nseg))
+    seg_hi = np.empty((ndim, nseg))
+    seg_start = np.zeros(nseg + 1, dtype=np.int64)
+    # cells' bounds are widened a little so that round-off in the
+    # cell indices never drops a particle
+    pad = 1e-12 * cellsize
+    cx = np.empty((ndim, 64))
+    cm = np.empty(64)
+    r2 = np.empty(64)
+    fm = np.empty(64)
+    fr2 = np.empty(64)
+
+    start = 0
+    while start < nq:
+        cell = qcell[order[start]]
+        stop = start + 1
+        while stop < nq and qcell[order[stop]] == cell:
+            stop += 1
+
+        rem = cell
+        for d in range(ndim - 1, -1, -1):
+            c[d] = rem % ncells[d]
+            rem //= ncells[d]
+
+        # gather the candidates of the (up to) 3^ndim neighbouring
+        # cells, shifted to the periodic image next to this cell
+        ncand = 0
+        seg = 0
+        for d in range(ndim):
+            offset[d] = -1
+        while True:
+            neighbour = 0
+            inside = True
+            for d in range(ndim):
+                cd = c[d] + offset[d]
+                shift[d] = 0.0
+                if box[d] > 0.0:
+                    if cd < 0:
+                        cd += ncells[d]
+                        shift[d] = -box[d]
+                    elif cd >= ncells[d]:
+                        cd -= ncells[d]
+                        shift[d] = box[d]
+                elif cd < 0 or cd >= ncells[d]:
+                    inside = False
+                neighbour = neighbour * ncells[d] + cd
+
+            if inside:
+                first = cell_start[neighbour]
+                last = cell_start[neighbour + 1]
+                if ncand + last - first > cm.shape[0]:
+                    size = 2 * (ncand + last - first)
+                    cxnew = np.empty((ndim, size))
+                    cmnew = np.empty(size)
+                    cxnew[:, :ncand] = cx[:, :ncand]
+                    cmnew[:ncand] = cm[:ncand]
+                    cx = cxnew
+                    cm = cmnew
+                    r2 = np.empty(size)
+                    fm = np.empty(size)
+                    fr2 = np.empty(size)
+                for n in range(first, last):
+                    j = cell_particles[n]
+                    for d in range(ndim):
+                        cx[d, ncand] = x[j, d] + shift[d]
+                    cm[ncand] = m[j]
+                    ncand += 1
+                for d in range(ndim):
+                    lo = origin[d] + (c[d] + offset[d]) * cellsize[d]
+                    seg_lo[d, seg] = lo - pad[d]
+                    seg_hi[d, seg] = lo + cellsize[d] + pad[d]
+                seg += 1
+                seg_start[seg] = ncand
+
+            # next neighbouring cell
+            d = ndim - 1
+            while d >= 0:
+                offset[d] += 1
+                if offset[d] <= 1:
+                    break
+                offset[d] = -1
+                d -= 1
+            if d < 0:
+                break
+
+        for i in range(start, stop):
+            q = order[i]
+            s2 = support[q] * support[q]
+            nfound = 0
+            for g in range(seg):
+                # distance to the cell's box
+                dsq = 0.0
+                for d in range(ndim):
+                    dx = max(seg_lo[d, g] - xq[q, d], xq[q, d] - seg_hi[d, g], 0.0)
+                    dsq += dx * dx
+                if dsq >= s2:
+                    continue
+
+                first = seg_start[g]
+                last = seg_start[g + 1]
+                r2[first:last] = 0.0
+                for d in range(ndim):
+                    xd = xq[q, d]
+                    for n in range(first, last):
+                        dx = cx[d, n] - xd
+                        r2[n] += dx * dx
+                for n in range(first, last):
+                    if r2[n] < s2:
+                        fm[nfound] = cm[n]
+                        fr2[nfound] = r2[n]
+                        nfound += 1
+
+            if nfound > k:
+                _select_smallest(fr2, fm, nfound, k)
+                nfound = k
+            count[q] = nfound
+
+            H2 = 0.0
+            for n in range(nfound):
+                H2 = max(H2, fr2[n])
+            if H2 == 0.0:
+                # only the particle itself, as in the vectorized version
+                rho[q] = np.nan
+                continue
+            H = np.sqrt(H2)
+            wsum = 0.0
+            for n in range(nfound):
+                wsum += fm[n] * _w_scalar(np.sqrt(fr2[n]) / H, kernel_id, ndim)
+            rho[q] = norm / H**ndim * wsum
+
+        start = stop
+
+    return rho, count
+
+
+if numba is not None:
+    _select_smallest = numba.njit(cache=True)(_select_smallest)
+    _grid_density = numba.njit(cache=True)(_grid_density)
+
+
+class CellGrid(object):
+    """
+    Particles sorted into a grid of cells at least as large as the
+    largest kernel support, as a faster alternative to a cKDTree for
+    the fixed radius k nearest neighbour sums of SPH. Needs numba.
+    """
+
+    def __init__(self, x, cellsize, boxsize=None):
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        npart, ndim = x.shape
+        box = np.zeros(ndim)
+        if boxsize is not None:
+            # a scalar, or at least one entry per column of x
+            box[:] = np.ravel(boxsize)[:ndim]
+
+        origin = np.where(box > 0.0, 0.0, x.min(axis=0))
+        extent = np.where(box > 0.0, box, x.max(axis=0) - origin)
+        ncells = np.maximum(np.floor(extent / cellsize), 1).astype(np.int64)
+        # at most ~ one cell per particle
+        while np.prod(ncells) > max(npart, 1) and ncells.max() > 1:
+            ncells = np.maximum(ncells // 2, 1)
+
+        self.box = box
+        self.origin = origin
+        self.ncells = ncells
+        self.cellsize = np.where(extent > 0.0, extent / ncells, 1.0)
+        self.x = x = self.wrap(x)
+
+        cid = self.cell_index(x)
+        counts = np.bincount(cid, minlength=np.prod(ncells))
+        self.cell_particles = np.argsort(cid, kind="stable")
+        self.cell_start = np.zeros(counts.shape[0] + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.cell_start[1:])
+        self.counts = counts.reshape(ncells)
+
+    def wrap(self, x):
+        """
+        Move points into [0, box) along the periodic axes.
+        """
+
+        periodic = self.box > 0.0
+        outside = (x[:, periodic] < 0.0) | (x[:, periodic] >= self.box[periodic])
+        if not outside.any():
+            return x
+
+        x = x.copy()
+        for d in np.flatnonzero(periodic):
+            x[:, d] %= self.box[d]
+            # tiny negative values end up at exactly box
+            x[x[:, d] >= self.box[d], d] = 0.0
+
+        return x
+
+    def cell_index(self, x):
+        """
+        Get the flat index of the cell holding each point x.
+        """
+
+        cid = np.zeros(x.shape[0], dtype=np.int64)
+        for d in range(x.shape[1]):
+            n = self.ncells[d]
+            cd = np.floor((x[:, d] - self.origin[d]) / self.cellsize[d])
+            cd = cd.astype(np.int64)
+            if self.box[d] > 0.0:
+                cd %= n
+            else:
+                np.clip(cd, 0, n - 1, out=cd)
+            cid = cid * n + cd
+
+        return cid
+
+    def candidates(self):
+        """
+        Get the number of particle pairs a query of all particles
+        would have to look at.
+        """
+
+        # particles in each cell's neighbourhood of up to 3^ndim cells
+        near = self.counts
+        for d in range(near.ndim):
+            width = [(0, 0)] * near.ndim
+            width[d] = (1, 1)
+            mode = "wrap" if self.box[d] > 0.0 else "constant"
+            padded = np.pad(near, width, mode=mode)
+            n = self.ncells[d]
+            near = sum(np.take(padded, np.arange(n) + s, axis=d) for s in range(3))
+
+        return int((near * self.counts).sum())
+
+    def density(self, xq, support, m, k, kernel, ndim):
+        """
+        Get the density estimate of approximate_density() and the
+        number of neighbours used at the points xq.
+        """
+
+        xq = self.wrap(np.ascontiguousarray(xq, dtype=np.float64))
+        qcell = self.cell_index(xq)
+
+        return _grid_density(
+            xq,
+            qcell,
+            np.argsort(qcell, kind="stable"),
+            np.ascontiguousarray(support, dtype=np.float64),
+            k,
+            self.x,
+            m,
+            self.cell_start,
+            self.cell_particles,
+            self.ncells,
+            self.origin,
+            self.cellsize,
+            self.box,
+            compiled_kernels[kernel],
+            get_kernel(kernel, ndim)[2],
+        )
+
+
+def approximate_density(
+    x,
+    m,
+    h,
+    boxsize=None,
+    ndim=3,
+    kernel="cubic spline",
+    neighbours=50,
+    chunksize=chunksize_default,
+    workers=-1,
+    cache=False,
+    targets=None,
+):
+    """
+    Approximate the SPH density of particles at positions x with
+    masses m and smoothing lengths h. If `targets` is given, only
+    the densities of the particles with these indices are computed
+    and returned; all particles still serve as neighbours.
+
+    For each particle, up to `neighbours` nearest neighbours within
+    the kernel support gamma * h are used, and the kernel support
+    radius is taken to be the distance of the furthest of them.
+
+    If numba is available and the particles aren't too clustered for
+    it, the neighbours are found and summed up in a single compiled
+    pass over a cell grid. Otherwise, the neighbour search is done
+    for `chunksize` particles per tree query using `workers` threads,
+    and the kernel is evaluated over the whole (chunksize, neighbours)
+    distance array at once.
+
+    With cache=True, the neighbour lists are taken from (or stored
+    in) the on-disk cache of neighbour_lists().
+
+    Returns the density as a plain numpy array in units of
+    [m] / [x]^ndim.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    m = np.asarray(m, dtype=np.float64)
+    h = np.asarray(h, dtype=np.float64)
+
+    npart = m.shape[0]
+    k = min(neighbours, npart)
+    _, _, _, kernel_gamma = get_kernel(kernel, ndim)
+
+    if targets is None:
+        targets = np.arange(npart)
+    ntargets = targets.shape[0]
+
+    if cache:
+        _, indices, distances = neighbour_lists(
+            x, k, boxsize=boxsize, cache=True, chunksize=chunksize, workers=workers
+        )
+        indices = indices.reshape(npart, k)
+        distances = distances.reshape(npart, k)
+    else:
+        if numba is not None and kernel in compiled_kernels and npart > 0:
+            support_max = kernel_gamma * h.max()
+            grid = CellGrid(x, support_max, boxsize)
+            # the tree only sees the nearest periodic image
+            periodic = grid.box > 0.0
+            if (support_max < 0.5 * grid.box[periodic]).all() and (
+                grid.candidates() <= grid_candidates_max * k * npart
+            ):
+                rho, count = grid.density(
+                    x[targets], kernel_gamma * h[targets], m, k, kernel, ndim
+                )
+                if (count == 0).any():
+                    raise RuntimeError("Found no neighbour for a particle.")
+                return rho
+        tree = cKDTree(x, boxsize=boxsize)
+    rho = np.zeros(ntargets)
+
+    for start in range(0, ntargets, chunksize):
+        stop = min(start + chunksize, ntargets)
+        ind = targets[start:stop]
+        support = kernel_gamma * h[ind]
+
+        if cache:
+            dist = np.asarray(distances[ind])
+            neighs = np.asarray(indices[ind])
+        else:
+            dist, neighs = tree.query(
+                x[ind],
+                k=k,
+                distance_upper_bound=support.max(),
+                workers=workers,
+            )
+        dist = dist.reshape(stop - start, k)
+        neighs = neighs.reshape(stop - start, k)
+
+        # tree.query returns index npart if not enough neighbours were
+        # found. Distances are sorted, so valid neighbours come first.
+        mask = (neighs < npart) & (dist < support[:, None])
+        count = mask.sum(axis=1)
+        if (count == 0).any():
+            raise RuntimeError("Found no neighbour for a particle.")
+
+        H = dist[np.arange(stop - start), count - 1]
+        W = kernel_W(np.where(mask, dist, 0.0), H[:, None], kernel, ndim)
+        W[~mask] = 0.0
+        rho[start:stop] = (W * m[np.where(mask, neighs, 0)]).sum(axis=1)
+
+    return rho
+
+
+# volume of the unit sphere in 1, 2, 3 dimensions
+unit_sphere_volume = {1: 2.0, 2: np.pi, 3: 4.0 / 3.0 * np.pi}
+
+
+def _neighbour_sums(
+    tree, x, h, m, k, kernel, ndim, workers, chunksize=chunksize_default
+):
+    """
+    Get the kernel sums needed for the smoothing length iteration of
+    particles at positions x with smoothing lengths h:
+    sum_j w(q_ij), sum_j q_ij w'(q_ij) and sum_j m_j W(r_ij, h_i).
+
+    Neighbours are found with k-nearest-neighbour queries. Particles
+    whose kernel may contain more than k neighbours are queried again
+    with twice as many until all neighbours are found.
+    """
+
+    w, dwdq, norm, kernel_gamma = get_kernel(kernel, ndim)
+    npart_tree = tree.n
+
+    n = x.shape[0]
+    wsum = np.zeros(n)
+    qdwsum = np.zeros(n)
+    rho = np.zeros(n)
+
+    todo = np.arange(n)
+    while todo.shape[0] > 0:
+        kq = min(k, npart_tree)
+        retry = []
+
+        for start in range(0, todo.shape[0], chunksize):
+            ind = todo[start : start + chunksize]
+            support = kernel_gamma * h[ind]
+
+            dist, neighs = tree.query(
+                x[ind], k=kq, distance_upper_bound=support.max(), workers=workers
+            )
+            dist = dist.reshape(ind.shape[0], kq)
+            neighs = neighs.reshape(ind.shape[0], kq)
+
+            mask = (neighs < npart_tree) & (dist < support[:, None])
+            if kq < npart_tree:
+                full = mask[:, -1]
+                if full.any():
+                    retry.append(ind[full])
+                    keep = ~full
+                    ind = ind[keep]
+                    support = support[keep]
+                    dist = dist[keep]
+                    neighs = neighs[keep]
+                    mask = mask[keep]
+
+            q = np.where(mask, dist, 0.0) / support[:, None]
+            wq = np.where(mask, w(q), 0.0)
+            dwq = np.where(mask, dwdq(q), 0.0)
+
+            wsum[ind] = wq.sum(axis=1)
+            qdwsum[ind] = (q * dwq).sum(axis=1)
+            rho[ind] = (
+                norm / support**ndim * (wq * m[np.where(mask, neighs, 0)]).sum(axis=1)
+            )
+
+        todo = np.concatenate(retry) if len(retry) > 0 else np.empty(0, dtype=int)
+        k = 2 * kq
+
+    return wsum, qdwsum, rho
+
+
+def solve_smoothing_lengths(
+    x,
+    m,
+    boxsize=None,
+    ndim=3,
+    kernel="cubic spline",
+    eta=1.2348,
+    h_init=None,
+    tolerance=1e-4,
+    max_iterations=50,
+    chunksize=chunksize_default,
+    workers=-1,
+    verbose=False,
+):
+    """
+    Find smoothing lengths h such that h^ndim * sum_j W(r_ij, h) = eta^ndim
+    for all particles, the same condition SWIFT uses, and the resulting
+    densities.
+
+    All particles are iterated simultaneously with Newton-Raphson
+    steps, limited to a factor of 2 per iteration. Each iteration
+    only re-queries the neighbours of the particles which haven't
+    converged yet.
+
+    x: (npart, >= ndim) particle positions. Only the first ndim
+        columns are used.
+    m: (npart) particle masses
+    boxsize: box size for periodic boxes, or None. A scalar, or at
+        least ndim entries of which the first ndim are used.
+    h_init: initial guess. Default: from the mean particle spacing
+
+    Returns h, rho and the number of particles which didn't converge.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    x = np.ascontiguousarray(x[:, :ndim])
+    m = np.asarray(m, dtype=np.float64)
+    npart = m.shape[0]
+
+    if boxsize is not None:
+        boxsize = np.ravel(np.asarray(boxsize, dtype=np.float64))
+        if boxsize.shape[0] == 1:
+            boxsize = np.repeat(boxsize, ndim)
+        if boxsize.shape[0] < ndim:
+            raise ValueError(
+                "Box size {0} has fewer than {1} dimensions".format(boxsize, ndim)
+            )
+        boxsize = boxsize[:ndim].copy()
+        x = np.mod(x, boxsize)
+        volume = np.prod(boxsize)
+    else:
+        volume = np.prod(x.max(axis=0) - x.min(axis=0))
+
+    _, _, norm, kernel_gamma = get_kernel(kernel, ndim)
+    n_target = eta**ndim
+
+    h_guess = eta * (volume / npart) ** (1.0 / ndim)
+    if h_init is None:
+        h = np.full(npart, h_guess)
+    else:
+        h = np.array(h_init, dtype=np.float64).reshape(npart)
+        h[~(h > 0)] = h_guess
+
+    # expected number of neighbours, with some margin for the first query
+    k = int(2 * unit_sphere_volume[ndim] * (kernel_gamma * eta) ** ndim) + 1
+
+    tree = cKDTree(x, boxsize=boxsize)
+    rho = np.zeros(npart)
+    active = np.arange(npart)
+
+    for iteration in range(max_iterations):
+        if active.shape[0] == 0:
+            break
+
+        h_act = h[active]
+        wsum, qdwsum, rho_act = _neighbour_sums(
+            tree, x[active], h_act, m, k, kernel, ndim, workers, chunksize
+        )
+        rho[active] = rho_act
+
+        # f(h) = h^d sum_j W(r_ij, h) - eta^d; W = norm / (gamma h)^d w(q)
+        f = norm / kernel_gamma**ndim * wsum - n_target
+        fprime = -norm / kernel_gamma**ndim * qdwsum / h_act
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            h_new = h_act - f / fprime
+        # no neighbours in the kernel other than the particle itself
+        h_new = np.where(np.isfinite(h_new), h_new, 2.0 * h_act)
+        h_new = np.clip(h_new, 0.5 * h_act, 2.0 * h_act)
+
+        converged = np.abs(f) < tolerance * n_target
+        h[active[~converged]] = h_new[~converged]
+        active = active[~converged]
+
+        if verbose:
+            print(
+                "Iteration {0:3d}: {1} particles left to converge".format(
+                    iteration, active.shape[0]
+                )
+            )
+
+    if active.shape[0] > 0:
+        # make sure h and rho are consistent for the unconverged ones
+        _, _, rho_act = _neighbour_sums(
+            tree, x[active], h[active], m, k, kernel, ndim, workers, chunksize
+        )
+        rho[active] = rho_act
+
+    return h, rho, active.shape[0]
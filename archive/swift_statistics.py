@@ -0,0 +1,239 @@
+# =====================================
+# Lightweight reader for SWIFT's
+# statistics.txt, with memory-mapped
+# binary caching of parsed columns,
+# shared by the swift-*.py scripts in
+# this directory.
+# =====================================
+
+
+import os
+import re
+
+import numpy as np
+import unyt
+
+import swift_cache
+
+
+# cache subdirectory and default size cap for parsed columns
+statistics_cache = "statistics"
+cache_max_default = 1 << 30
+
+# number of rows to parse at once
+chunkrows_default = 1 << 16
+
+regex_name = re.compile(r"# \(([0-9]*)\) +(.*)")
+regex_unit = re.compile(r"# *Unit = ([^\s]+) ?(.*)")
+
+
+def snake_case(name):
+    """
+    Turn a column name of the header into an attribute name, the
+    same way swiftsimio does, e.g. "Kin. Energy" -> "kin_energy".
+    """
+
+    return name.replace(".", "").replace(" ", "_").replace("\n", "").lower()
+
+
+def read_header(fname):
+    """
+    Read the header of a statistics file.
+
+    Returns the attribute names of the columns, their header names,
+    their units and the byte offset of the first data row.
+    """
+
+    units = []
+    header_names = []
+    last = None
+    offset = 0
+
+    with open(fname, "rb") as f:
+        for raw in f:
+            if not raw.startswith(b"#"):
+                break
+            offset += len(raw)
+            line = raw.decode().rstrip("\n")
+            last = line
+
+            name_match = regex_name.match(line)
+            if name_match:
+                header_names.append(name_match.group(2).strip().rstrip("."))
+                units.append(unyt.dimensionless)
+                continue
+
+            unit_match = regex_unit.match(line)
+            if unit_match and len(units) > 0:
+                if unit_match.group(1) != "dimensionless":
+                    units[-1] = unyt.unyt_quantity(
+                        float(unit_match.group(1)), unit_match.group(2)
+                    )
+
+    if last is None:
+        raise ValueError("'{0}' has no statistics header".format(fname))
+
+    # the last header line holds the column names, separated by 2+ spaces
+    names = [snake_case(x) for x in re.split(r"\s{2,}", last[1:]) if x != ""]
+    if len(header_names) != len(names):
+        header_names = names
+
+    return names, header_names, units, offset
+
+
+def parse_rows(lines, columns):
+    """
+    Parse a list of data rows (bytes) into a (nrows, len(columns))
+    float64 array, keeping only the given column indices. Incomplete
+    rows, e.g. the last one of a file still being written, must
+    already be removed.
+    """
+
+    if len(lines) == 0:
+        return np.empty((0, len(columns)), dtype=np.float64)
+
+    return np.loadtxt(
+        lines, dtype=np.float64, usecols=columns, ndmin=2, comments="#"
+    ).reshape(-1, len(columns))
+
+
+def read_columns(fname, columns, offset, chunkrows=chunkrows_default, stop=None):
+    """
+    Read the given column indices of the data rows of a statistics
+    file, starting at byte offset, chunkrows rows at a time. Reads
+    up to byte stop, or to the end of the last complete row.
+
+    Returns the (nrows, len(columns)) array and the byte offset
+    after the last row read, to continue from later.
+    """
+
+    chunks = []
+    with open(fname, "rb") as f:
+        f.seek(offset)
+        lines = []
+        for line in f:
+            if stop is not None and offset + len(line) > stop:
+                break
+            if not line.endswith(b"\n"):
+                # a row still being written
+                break
+            offset += len(line)
+            lines.append(line)
+            if len(lines) == chunkrows:
+                chunks.append(parse_rows(lines, columns))
+                lines = []
+        chunks.append(parse_rows(lines, columns))
+
+    return np.concatenate(chunks), offset
+
+
+class StatisticsFile(object):
+    """
+    Columns of a statistics file as unyt arrays, named like the
+    attributes of swiftsimio's load_statistics(), e.g. time,
+    gas_mass, kin_energy. Columns are read on first access, or all
+    requested ones at once by load_statistics().
+    """
+
+    def __init__(self, filename, use_cache=True, max_bytes=cache_max_default):
+        self.filename = filename
+        self.use_cache = use_cache
+        self.max_bytes = max_bytes
+        (
+            self.header_snake_case_names,
+            self.header_names,
+            self.header_units,
+            self.data_offset,
+        ) = read_header(filename)
+
+        return
+
+    def __getattr__(self, name):
+        # only called for attributes which aren't loaded yet
+        if name.startswith("_") or name not in self.__dict__.get(
+            "header_snake_case_names", []
+        ):
+            raise AttributeError(name)
+        self.load([name])
+        return self.__dict__[name]
+
+    def load(self, names):
+        """
+        Load the given columns, reading all those which aren't
+        cached in a single pass over the file.
+        """
+
+        names = [n for n in dict.fromkeys(names) if n not in self.__dict__]
+        for name in names:
+            if name not in self.header_snake_case_names:
+                raise AttributeError(
+                    "'{0}' has no column '{1}'".format(self.filename, name)
+                )
+        if len(names) == 0:
+            return
+
+        columns = [self.header_snake_case_names.index(n) for n in names]
+        arrays = [None] * len(names)
+        missing = list(range(len(names)))
+        keys = None
+
+        if self.use_cache:
+            source = swift_cache.file_key(self.filename)
+            keys = [swift_cache.hash_key(source, "column", c) for c in columns]
+            missing = []
+            for i, key in enumerate(keys):
+                path = swift_cache.entry_path(statistics_cache, key)
+                if path is None:
+                    missing.append(i)
+                else:
+                    arrays[i] = np.load(os.path.join(path, "column.npy"), mmap_mode="r")
+
+        if len(missing) > 0:
+            data, _ = read_columns(
+                self.filename, [columns[i] for i in missing], self.data_offset
+            )
+            for j, i in enumerate(missing):
+                arrays[i] = np.ascontiguousarray(data[:, j])
+                if self.use_cache:
+                    outdir = swift_cache.new_entry(statistics_cache)
+                    np.save(os.path.join(outdir, "column.npy"), arrays[i])
+                    swift_cache.commit_entry(statistics_cache, keys[i], outdir)
+
+            if self.use_cache:
+                swift_cache.evict(statistics_cache, self.max_bytes)
+
+        for name, column, array in zip(names, columns, arrays):
+            setattr(
+                self,
+                name,
+                unyt.unyt_array(
+                    array,
+                    units=self.header_units[column],
+                    name=self.header_names[column],
+                ),
+            )
+
+        return
+
+    def __str__(self):
+        return "Statistics file: {0}, containing fields: {1}".format(
+            self.filename, ", ".join(self.header_snake_case_names)
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def load_statistics(filename, columns=None, use_cache=True):
+    """
+    Load a statistics file. The given columns, attribute names like
+    "time" or "gas_mass", are read at once; any others are read when
+    first accessed. Parsed columns are cached as binary files and
+    memory-mapped on later loads, until the file changes.
+    """
+
+    data = StatisticsFile(filename, use_cache=use_cache)
+    if columns is not None:
+        data.load(columns)
+
+    return data